@@ -0,0 +1,90 @@
+"""Builders for the byte streams of a synthetic RFB session, as a recording writer receives them."""
+
+from __future__ import annotations
+
+import zlib
+from struct import Struct
+
+import numpy as np
+from numpy.typing import NDArray
+
+from uitask.vnc.protocol import SessionMirror
+from uitask.vnc.rfb_messages import Encoding, MouseButtons, PointerEvent, ServerMessageKind
+
+# A recorded chunk: client side?, data, timestamp (nanoseconds)
+Record = tuple[bool, bytes, int]
+
+WIDTH = 640
+HEIGHT = 400
+
+_HEADER_STRUCT = Struct("!BxH")
+_RECT_STRUCT = Struct("!HHHHi")
+# 32 bits per pixel, depth 24, little endian, true color, RGB in the low bytes
+_PIXEL_FORMAT = Struct("!BBBBHHHBBBxxx").pack(32, 24, 0, 1, 255, 255, 255, 0, 8, 16)
+
+
+def handshake(timestamp_ns: int = 0) -> list[Record]:
+    """A handshake without security into a `WIDTH` x `HEIGHT` session."""
+    name = b"test"
+    messages = [
+        (False, b"RFB 003.008\n"),
+        (True, b"RFB 003.008\n"),
+        (False, b"\x01\x01"),
+        (True, b"\x01"),
+        (False, b"\x00\x00\x00\x00"),
+        (True, b"\x01"),
+        (
+            False,
+            Struct("!HH").pack(WIDTH, HEIGHT) + _PIXEL_FORMAT + Struct("!I").pack(len(name)) + name,
+        ),
+    ]
+    return [(client, data, timestamp_ns + i) for i, (client, data) in enumerate(messages)]
+
+
+def raw_update(x: int, y: int, pixels: NDArray[np.uint8]) -> bytes:
+    """A `FramebufferUpdate` with one raw rectangle of the RGB `pixels`."""
+    height, width = pixels.shape[:2]
+    padded = np.zeros((height, width, 4), dtype=np.uint8)
+    padded[:, :, :3] = pixels
+    rect = _RECT_STRUCT.pack(x, y, width, height, Encoding.RAW.value) + padded.tobytes()
+    return _HEADER_STRUCT.pack(ServerMessageKind.FRAMEBUFFER_UPDATE.value, 1) + rect
+
+
+class TightEncoder:
+    """Encodes `FramebufferUpdate`s with Tight rectangles through zlib stream 0, like a server."""
+
+    def __init__(self) -> None:
+        self._compressor = zlib.compressobj()
+
+    def update(self, x: int, y: int, pixels: NDArray[np.uint8]) -> bytes:
+        height, width = pixels.shape[:2]
+        data = self._compressor.compress(pixels.tobytes())
+        data += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        rect = _RECT_STRUCT.pack(x, y, width, height, Encoding.TIGHT.value)
+        rect += b"\x00" + _encode_length(len(data)) + data
+        return _HEADER_STRUCT.pack(ServerMessageKind.FRAMEBUFFER_UPDATE.value, 1) + rect
+
+
+def pointer_event(x: int, y: int, buttons: int = 0) -> bytes:
+    return PointerEvent(buttons=MouseButtons(buttons), x=x, y=y).to_bytes()
+
+
+def replay_screen(records: list[Record]) -> NDArray[np.uint8]:
+    """The screen after the recorded chunks, decoded by a fresh session."""
+    mirror = SessionMirror()
+    for client, data, _ in records:
+        if client:
+            mirror.feed_client(data)
+        else:
+            mirror.feed_server(data)
+    assert mirror.session is not None and not mirror.failed
+    return mirror.session.framebuffer.get_array(0, 0, WIDTH, HEIGHT)
+
+
+def _encode_length(value: int) -> bytes:
+    """The compact length of Tight data."""
+    if value < 0x80:
+        return bytes((value,))
+    if value < 0x4000:
+        return bytes((value & 0x7F | 0x80, value >> 7))
+    return bytes((value & 0x7F | 0x80, (value >> 7) & 0x7F | 0x80, value >> 14))
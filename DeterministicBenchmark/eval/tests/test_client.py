@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+import pytest
+from rfb_helpers import handshake, pointer_event, raw_update
+
+from uitask.vnc.client import TcpSyncStream, VncClient
+from uitask.vnc.recording.replay import QueuedRfbRecordingWriter, RecordingError
+
+
+class _Server:
+    """Accepts one client on a socket pair: answers the handshake with one update, then listens."""
+
+    def __init__(self) -> None:
+        self.client_socket, self._socket = socket.socketpair()
+        self.received = bytearray()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        self._socket.sendall(b"".join(data for client, data, _ in handshake() if not client))
+        self._socket.sendall(raw_update(0, 0, np.zeros((16, 16, 3), dtype=np.uint8)))
+        while data := self._socket.recv(1 << 16):
+            self.received += data
+
+    def close(self) -> None:
+        self._socket.close()
+        self._thread.join()
+
+
+@pytest.fixture
+def server() -> Iterator[_Server]:
+    server = _Server()
+    yield server
+    server.close()
+
+
+def _fail_flush(batch: list[tuple[bool, bytes, int]]) -> None:
+    raise OSError(28, "No space left on device")
+
+
+def test_failing_recording_keeps_the_connection(server: _Server, tmp_path: Path) -> None:
+    client = VncClient.create(TcpSyncStream(server.client_socket))
+    reconnects: list[int] = []
+
+    def connect() -> TcpSyncStream:
+        reconnects.append(client.reconnects)
+        raise ConnectionError("The test server accepts one connection")
+
+    client._connect = connect
+    client.start_recording(tmp_path)
+    writer = client._recording_writer
+    assert isinstance(writer, QueuedRfbRecordingWriter)
+    writer._write_batch = _fail_flush
+
+    # The flush thread fails on the first move, the next one reports it
+    client.mouse_move(10, 20)
+    deadline = time.monotonic() + 5
+    while writer._error is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(RecordingError):
+        client.mouse_move(30, 40)
+    with pytest.raises(RecordingError):
+        client.stop_recording()
+
+    client.mouse_move(50, 60)
+    client.close()
+    server.close()
+    assert not reconnects
+    assert client.reconnects == 0
+    for x, y in [(10, 20), (30, 40), (50, 60)]:
+        assert pointer_event(x, y) in server.received
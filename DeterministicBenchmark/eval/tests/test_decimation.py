@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import numpy as np
+from rfb_helpers import (
+    HEIGHT,
+    WIDTH,
+    Record,
+    TightEncoder,
+    handshake,
+    pointer_event,
+    raw_update,
+    replay_screen,
+)
+
+from uitask.vnc.recording.decimation import DecimationPolicy, UpdateDecimator
+
+_FRAME_NS = 10_000_000  # 100 updates per second
+
+
+def _decimate(
+    records: list[Record], policy: DecimationPolicy
+) -> tuple[list[Record], UpdateDecimator]:
+    decimator = UpdateDecimator(policy)
+    stored: list[Record] = []
+    for client, data, timestamp in records:
+        stored.extend(decimator.filter(client, data, timestamp))
+    stored.extend(decimator.finish())
+    return stored, decimator
+
+
+def test_sub_frame_churn_is_repainted() -> None:
+    # A blinking cursor and a spinner: small updates of the same regions
+    rng = np.random.default_rng(0)
+    records = handshake()
+    for i in range(200):
+        x, y = (100, 50) if i % 2 else (300, 200)
+        pixels = rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)
+        records.append((False, raw_update(x, y, pixels), 1_000 + i * _FRAME_NS))
+
+    stored, decimator = _decimate(records, DecimationPolicy(max_fps=2))
+
+    stats = decimator.stats
+    assert stats.updates == 200
+    assert stats.stored_updates < 10
+    assert stats.repaints > 0
+    assert stats.keyframes == 0
+    assert stats.stored_bytes < stats.num_bytes / 10
+    np.testing.assert_array_equal(replay_screen(stored), replay_screen(records))
+
+
+def test_repaint_primes_the_zlib_streams() -> None:
+    rng = np.random.default_rng(1)
+    encoder = TightEncoder()
+    # A busy screen, whose keyframe is large
+    screen = rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    records = [*handshake(), (False, encoder.update(0, 0, screen), 500)]
+    for i in range(100):
+        pixels = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        records.append((False, encoder.update(200 + i % 4 * 8, 100, pixels), 1_000 + i * _FRAME_NS))
+        # Input events resolve the dropped updates midway
+        if i % 40 == 39:
+            records.append((True, pointer_event(i, i), 2_000 + i * _FRAME_NS))
+
+    stored, decimator = _decimate(records, DecimationPolicy(max_fps=2))
+
+    stats = decimator.stats
+    assert stats.repaints > 0
+    # Updates after a repaint refer back into the zlib stream, which must match the live one
+    np.testing.assert_array_equal(replay_screen(stored), replay_screen(records))
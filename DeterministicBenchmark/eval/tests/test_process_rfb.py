@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from uitask.vnc.recording.markers import (
+    MARKERS_FILENAME,
+    ActionMarker,
+    ActionMarkerWriter,
+    read_action_markers,
+)
+from uitask.vnc.recording.process_rfb import _plan_action_frames
+from uitask.vnc.recording.replay import RfbReplayEvent
+from uitask.vnc.rfb_messages import MouseButtons, PointerEvent
+
+_MS = 1_000_000
+
+
+def _click_steps(click_times: list[int]) -> list[RfbReplayEvent]:
+    """Framebuffer updates every 50 ms, and a left click at each of `click_times`."""
+    end = max(click_times) + 1_000 * _MS
+    steps = [RfbReplayEvent(timestamp=t, event=None) for t in range(0, end, 50 * _MS)]
+    for i, t in enumerate(click_times):
+        x, y = 100 + i * 50, 100
+        steps.append(RfbReplayEvent(t, PointerEvent(buttons=MouseButtons.LEFT, x=x, y=y)))
+        steps.append(RfbReplayEvent(t + 20 * _MS, PointerEvent(buttons=MouseButtons(0), x=x, y=y)))
+    steps.sort(key=lambda step: step.timestamp)
+    return steps
+
+
+def test_actions_after_a_truncated_marker_file_align_with_their_input(tmp_path: Path) -> None:
+    click_times = [1_005 * _MS, 3_005 * _MS, 5_005 * _MS, 7_005 * _MS]
+    steps = _click_steps(click_times)
+    actions = [{"action": "mouse_click", "params": {}} for _ in click_times]
+
+    # The agent crashed while the third marker was written
+    writer = ActionMarkerWriter(tmp_path)
+    for i, t in enumerate(click_times):
+        writer.add(ActionMarker(index=i, start=t - 5 * _MS, end=t + 30 * _MS, name="mouse_click"))
+    writer.close()
+    path = tmp_path / MARKERS_FILENAME
+    marker_size = len(ActionMarker(0, 0, 0, "mouse_click").to_bytes())
+    path.write_bytes(path.read_bytes()[: marker_size * 2 + 10])
+    markers = {marker.index: marker for marker in read_action_markers(tmp_path) or []}
+    assert sorted(markers) == [0, 1]
+
+    frames = _plan_action_frames(steps, actions, markers)
+
+    # Every action, with or without marker, gets the last frame before its click
+    for (before_idx, after_idx), t in zip(frames, click_times):
+        assert t - 50 * _MS < steps[before_idx].timestamp <= t
+        assert after_idx is not None and steps[after_idx].timestamp > t
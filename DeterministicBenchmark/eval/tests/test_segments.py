@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+from rfb_helpers import handshake, pointer_event, raw_update
+
+from uitask.vnc.recording.eventlog import read_input_events
+from uitask.vnc.recording.replay import RfbRecordingWriter, RfbReplayParser, RfbReplayStreams
+from uitask.vnc.recording.segments import SegmentPolicy, segment_paths
+from uitask.vnc.rfb_messages import MouseButtons, PointerEvent
+
+
+def _record(recording_path: Path) -> None:
+    rng = np.random.default_rng(0)
+    writer = RfbRecordingWriter(recording_path, segments=SegmentPolicy(max_bytes=64 << 10))
+    for client, data, timestamp in handshake():
+        if client:
+            writer.record_client_bytes_at(data, timestamp)
+        else:
+            writer.record_server_bytes_at(data, timestamp)
+    # The pointer is moved and a button held before the first rotation, but not after it
+    writer.record_client_bytes_at(pointer_event(120, 80), 1_000)
+    writer.record_client_bytes_at(pointer_event(130, 90, buttons=1), 2_000)
+    for i in range(20):
+        pixels = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        writer.record_server_bytes_at(raw_update(i * 16, 100, pixels), 10_000 + i * 1_000)
+    writer.close()
+
+
+def test_segments_start_with_the_pointer_state(tmp_path: Path) -> None:
+    _record(tmp_path)
+
+    segments = segment_paths(tmp_path)
+    assert len(segments) > 1
+    for segment in segments[1:]:
+        with RfbReplayStreams.from_files(segment) as streams:
+            events = [
+                step.event
+                for step in RfbReplayParser(streams).iter_events()
+                if step.event is not None
+            ]
+        assert events == [PointerEvent(buttons=MouseButtons(1), x=130, y=90)]
+
+
+def test_event_log_leaves_out_the_resumed_pointer(tmp_path: Path) -> None:
+    _record(tmp_path)
+
+    events = read_input_events(tmp_path)
+    assert len(segment_paths(tmp_path)) > 1
+    assert events[["x", "y", "buttons"]].tolist() == [(120, 80, 0), (130, 90, 1)]
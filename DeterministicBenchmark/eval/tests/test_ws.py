@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections.abc import Callable
+
+import numpy as np
+import pytest
+from rfb_helpers import HEIGHT, WIDTH, TightEncoder, handshake, replay_screen
+
+from uitask.vnc.protocol import SessionMirror
+from uitask.vnc.rfb_messages import (
+    Encoding,
+    FramebufferUpdateRequest,
+    PixelFormat,
+    SetEncodings,
+    SetPixelFormat,
+)
+from uitask.vnc.ws import VncFanout
+
+_ENCODINGS = (Encoding.TIGHT, Encoding.JPEG_23, Encoding.PSEUDO_LAST_RECT)
+_REQUEST = FramebufferUpdateRequest(False, 0, 0, WIDTH, HEIGHT).to_bytes()
+
+
+class _WebSocket:
+    """The server side of an observer's WebSocket, which sends `incoming` and then waits."""
+
+    def __init__(self, incoming: list[bytes]) -> None:
+        self.incoming: asyncio.Queue[bytes] = asyncio.Queue()
+        for data in incoming:
+            self.incoming.put_nowait(data)
+        self.sent: list[bytes] = []
+        self.close_code: int | None = None
+        self.close_reason: str | None = None
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.sent.append(data)
+
+    async def receive_bytes(self) -> bytes:
+        return await self.incoming.get()
+
+    async def close(self, code: int = 1000, reason: str | None = None) -> None:
+        if self.close_code is None:
+            self.close_code, self.close_reason = code, reason
+
+
+class _Controller:
+    """Forwards a controlling session through a fan-out, like the proxy."""
+
+    def __init__(self, fanout: VncFanout) -> None:
+        self.fanout = fanout
+        self.mirror = SessionMirror(decode=False)
+        self.records: list[tuple[bool, bytes, int]] = []
+        fanout.start_session(self.mirror)
+
+    def client(self, data: bytes) -> None:
+        self.mirror.feed_client(data)
+        self.fanout.feed_client(data)
+        self.records.append((True, data, 0))
+
+    def server(self, data: bytes) -> None:
+        self.fanout.broadcast(self.mirror.feed_server(data))
+        self.records.append((False, data, 0))
+
+
+def _observer_setup(*messages: bytes) -> list[bytes]:
+    return [b"RFB 003.008\n", b"\x01", b"\x01", *messages, _REQUEST]
+
+
+async def _wait_until(condition: Callable[[], bool]) -> None:
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError
+
+
+def _start(controller: _Controller, tight: TightEncoder, rng: np.random.Generator) -> None:
+    for client, data, _ in handshake():
+        if client:
+            controller.client(data)
+        else:
+            controller.server(data)
+    controller.client(SetEncodings(_ENCODINGS).to_bytes())
+    pixels = rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    controller.server(tight.update(0, 0, pixels))
+
+
+def test_observer_follows_the_session_decoded_off_the_event_loop() -> None:
+    async def run() -> tuple[list[tuple[bool, bytes, int]], _WebSocket]:
+        rng = np.random.default_rng(0)
+        fanout = VncFanout()
+        controller = _Controller(fanout)
+        tight = TightEncoder()
+        _start(controller, tight, rng)
+
+        websocket = _WebSocket(_observer_setup(SetEncodings(_ENCODINGS).to_bytes()))
+        observe = asyncio.create_task(fanout.observe(websocket))  # pyright: ignore [reportArgumentType]
+        await _wait_until(lambda: fanout.num_observers == 1 and len(websocket.sent) >= 5)
+        for _ in range(3):
+            pixels = rng.integers(0, 256, (32, 48, 3), dtype=np.uint8)
+            controller.server(tight.update(100, 60, pixels))
+        await _wait_until(lambda: len(websocket.sent) == 8)
+        fanout.end_session()
+        await observe
+        return controller.records, websocket
+
+    # The controller's mirror only frames, decoding runs on the fan-out's thread
+    feed_server = SessionMirror.feed_server
+    decoding_threads: set[int] = set()
+
+    def spy(self: SessionMirror, data: bytes) -> list[bytes]:
+        if self.decode:
+            decoding_threads.add(threading.get_ident())
+        return feed_server(self, data)
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(SessionMirror, "feed_server", spy)
+        records, websocket = asyncio.run(run())
+    assert decoding_threads and threading.get_ident() not in decoding_threads
+
+    # The observer got a handshake like the controller's, a keyframe and the three updates
+    observed = [(False, data, 0) for data in websocket.sent]
+    observed[1:1] = [(True, data, 0) for data in (b"RFB 003.008\n", b"\x01", b"\x01")]
+    assert np.array_equal(replay_screen(observed), replay_screen(records))
+    assert websocket.close_code == 1000
+
+
+@pytest.mark.parametrize(
+    ("setup", "reason"),
+    [
+        (
+            [
+                SetPixelFormat(PixelFormat(16, 16, False, True, 31, 63, 31, 11, 5, 0)).to_bytes(),
+                SetEncodings(_ENCODINGS).to_bytes(),
+            ],
+            "The session only has the pixel format of its ServerInit",
+        ),
+        ([SetEncodings((Encoding.RAW,)).to_bytes()], "Unsupported encodings of the session"),
+        ([], "Unsupported encodings of the session: TIGHT, PSEUDO_LAST_RECT"),
+    ],
+)
+def test_observer_which_cannot_decode_the_session_is_closed(
+    setup: list[bytes], reason: str
+) -> None:
+    async def run() -> _WebSocket:
+        fanout = VncFanout()
+        controller = _Controller(fanout)
+        _start(controller, TightEncoder(), np.random.default_rng(0))
+        websocket = _WebSocket(_observer_setup(*setup))
+        await asyncio.wait_for(fanout.observe(websocket), 5)  # pyright: ignore [reportArgumentType]
+        fanout.end_session()
+        return websocket
+
+    websocket = asyncio.run(run())
+    assert websocket.close_code == 1008
+    assert websocket.close_reason is not None and websocket.close_reason.startswith(reason)
+    # Closed after the handshake, before the keyframe
+    assert len(websocket.sent) == 4
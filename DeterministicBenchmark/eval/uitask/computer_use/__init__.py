@@ -1,4 +1,4 @@
-from .act import EXECUTION_FILE, PARTIAL_EXECUTION_FILE, Agent
+from .act import EXECUTION_FILE, LATENCY_FILE, PARTIAL_EXECUTION_FILE, Agent
 from .byom.uipath.agent import UiPathScreenplay
 
 # Add computer use solution here. Make sure to implement `act` method
@@ -7,4 +7,5 @@ __all__ = [
     "UiPathScreenplay",
     "EXECUTION_FILE",
     "PARTIAL_EXECUTION_FILE",
+    "LATENCY_FILE",
 ]
@@ -34,9 +34,12 @@ from uitask.tools import (
 )
 from uitask.utils import to_jsonable
 from uitask.vnc import VncClient, X11Key
+from uitask.vnc.latency import LatencyReport
+from uitask.vnc.recording.markers import ActionMarker
 
 EXECUTION_FILE: Final[str] = "execution.json"
 PARTIAL_EXECUTION_FILE: Final[str] = "partial_execution.json"
+LATENCY_FILE: Final[str] = "latency.json"
 ERROR_FILE: Final[str] = "error.txt"
 
 P = ParamSpec("P")
@@ -53,18 +56,23 @@ def record_action(
         bound = inspect.signature(func).bind(self, *args, **kwargs)
         bound.apply_defaults()
         params = dict(list(bound.arguments.items())[1:])
+        start_ns = time.time_ns()
         try:
             action_result = func(self, *args, **kwargs)
         except Exception:
             self._add_action_to_history(
                 action=func.__name__,
                 params=to_jsonable(params),
+                start_ns=start_ns,
+                end_ns=time.time_ns(),
             )
             raise
         else:
             self._add_action_to_history(
                 action=func.__name__,
                 params=to_jsonable(params),
+                start_ns=start_ns,
+                end_ns=time.time_ns(),
             )
             return action_result
 
@@ -80,6 +88,7 @@ class Agent:
     cdp_port: int = 9222
 
     _action_history: list[dict[str, Any]] = field(default_factory=list, init=False)
+    _latency: LatencyReport = field(default_factory=LatencyReport, init=False, repr=False)
     _vnc_client_connected: bool = field(default=False, init=False, repr=False)
     _recording_started: bool = field(default=False, init=False, repr=False)
     _vnc_client: VncClient = field(init=False, repr=False)
@@ -203,6 +212,7 @@ class Agent:
 
             with open(self.output_dir / EXECUTION_FILE, "w") as f:
                 json.dump(self._action_history, f)
+            self._latency.write(self.output_dir / LATENCY_FILE)
         except (Exception, KeyboardInterrupt) as e:
             err_msg = f"Error during agent run ({type(e).__name__})"
             exception_msg = str(e).strip()
@@ -311,6 +321,7 @@ class Agent:
             )
             with open(output_file, "w") as f:
                 json.dump(self._action_history, f)
+            self._latency.write(self.output_dir / f"reenact_{LATENCY_FILE}")
         except (Exception, KeyboardInterrupt) as e:
             err_msg = f"Error during agent reenact ({type(e).__name__})"
             exception_msg = str(e).strip()
@@ -345,7 +356,7 @@ class Agent:
         """Ensure the agent connection is started before executing actions."""
         if not self._vnc_client_connected:
             self._vnc_client = VncClient.connect_ws(
-                f"{self.vnc_scheme}://{self.vnc_host}:{self.vnc_port}"
+                f"{self.vnc_scheme}://{self.vnc_host}:{self.vnc_port}", pipelined=True
             )
             self._vnc_client_connected = True
 
@@ -353,7 +364,15 @@ class Agent:
         self,
         action: str,
         params: dict[str, Any],
+        start_ns: int,
+        end_ns: int,
     ) -> None:
+        for latency in self._vnc_client.take_input_latencies():
+            self._latency.add(action, len(self._action_history), latency)
+        self._vnc_client.add_action_marker(
+            ActionMarker(index=len(self._action_history), start=start_ns, end=end_ns, name=action)
+        )
+
         record: dict[str, Any] = {"action": action, "params": params}
         record["task_marked_complete"] = self.check_task_success()
         self._action_history.append(record)
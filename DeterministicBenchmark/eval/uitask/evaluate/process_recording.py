@@ -6,12 +6,15 @@ from dask.distributed import Client, as_completed
 from tqdm import tqdm
 
 from uitask.vnc import postprocess_output_dir
+from uitask.vnc.recording.segments import MANIFEST_FILENAME
 
 app = typer.Typer(help="Utility CLI for UITask post-processing")
 
 
 def _has_recording(dir_path: Path) -> bool:
     rec = dir_path / "recording"
+    if (rec / MANIFEST_FILENAME).exists():
+        return True
     return (
         rec.is_dir()
         and (rec / "client.rfb.bin").exists()
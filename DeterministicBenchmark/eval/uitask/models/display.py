@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
 from enum import StrEnum
 
@@ -22,6 +24,42 @@ class ScreenResolution:
     height: int
 
 
+@dataclass(frozen=True)
+class ScreenRegion:
+    """Represents an axis-aligned rectangle on the screen, with the origin in the top left corner"""
+
+    x: int
+    y: int
+    width: int
+    height: int
+
+    def __post_init__(self) -> None:
+        assert 0 <= self.x and 0 <= self.y and 0 <= self.width and 0 <= self.height, (
+            f"Attempted to build an invalid ScreenRegion(x={self.x}, y={self.y}, "
+            f"width={self.width}, height={self.height}) with negative coordinates or size"
+        )
+
+    def intersects(self, other: ScreenRegion) -> bool:
+        """Whether the two regions share at least one pixel"""
+        return (
+            self.x < other.x + other.width
+            and other.x < self.x + self.width
+            and self.y < other.y + other.height
+            and other.y < self.y + self.height
+        )
+
+    def clip(self, resolution: ScreenResolution) -> ScreenRegion:
+        """Returns the part of the region which lies within a screen of the given resolution"""
+        x = min(self.x, resolution.width)
+        y = min(self.y, resolution.height)
+        return ScreenRegion(
+            x=x,
+            y=y,
+            width=min(self.width, resolution.width - x),
+            height=min(self.height, resolution.height - y),
+        )
+
+
 class ScrollActionDirection(StrEnum):
     DOWN = "down"
     UP = "up"
@@ -2,6 +2,7 @@ from .keys import (
     PageNavigationDirection,
     PageNavigationTool,
     PressKeyTool,
+    TypeTextStrategy,
     TypeTextTool,
 )
 from .pointer import (
@@ -19,6 +20,7 @@ __all__ = [
     "PageNavigationDirection",
     "PageNavigationTool",
     "PressKeyTool",
+    "TypeTextStrategy",
     "TypeTextTool",
     "MouseClickTool",
     "MouseDragTool",
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-import time
+import logging
 from abc import ABC, abstractmethod
 from contextvars import ContextVar
 from functools import wraps
@@ -20,6 +20,10 @@ class Tool[ToolInputT](ABC):
     # Depth counter for nested Tool.run invocations - declared here for type checking
     _RUN_DEPTH: ClassVar[ContextVar[int]]
 
+    # After each action, wait until the screen did not change for this long (up to the timeout)
+    SETTLE_QUIET_MS: ClassVar[float] = 150.0
+    SETTLE_TIMEOUT: ClassVar[float] = 5.0
+
     @abstractmethod
     def name(self) -> str:
         """
@@ -52,11 +56,14 @@ class Tool[ToolInputT](ABC):
                     return original_run(self, client, tool_input)
                 depth_context = Tool._RUN_DEPTH.set(depth + 1)
                 try:
-                    # Take a screenshot to force RFB updates
-                    client.take_screenshot()
+                    client.begin_input_batch()
                     original_run(self, client, tool_input)
-                    # Buffer actions by adding a slight delay
-                    time.sleep(0.3)
+                    # Let the UI finish rendering the effects of the action, measuring how long the
+                    # screen took to respond
+                    latency = client.end_input_batch(
+                        quiet_ms=self.SETTLE_QUIET_MS, timeout=self.SETTLE_TIMEOUT
+                    )
+                    _log.debug(f"{self.name()}: {latency}")
                 finally:
                     Tool._RUN_DEPTH.reset(depth_context)
 
@@ -68,3 +75,5 @@ class Tool[ToolInputT](ABC):
 # Required for reentracy with support for frozen dataclasses.
 # Defined outside class to avoid potential issues with dataclass subclasses.
 Tool._RUN_DEPTH = ContextVar("_tool_run_depth", default=0)
+
+_log = logging.getLogger(__name__)
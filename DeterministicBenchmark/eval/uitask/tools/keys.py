@@ -20,8 +20,18 @@ class PressKeyTool(Tool[Sequence[X11Key]]):
             ...
 
 
+class TypeTextStrategy(StrEnum):
+    TYPE = "type"  # one key press per character
+    PASTE = "paste"  # set the remote clipboard and press the paste shortcut
+    AUTO = "auto"  # paste text longer than `paste_threshold` when it is Latin-1, type otherwise
+
+
 @dataclass(frozen=True)
 class TypeTextTool(Tool[str]):
+    strategy: TypeTextStrategy = TypeTextStrategy.TYPE
+    paste_threshold: int = 32
+    verify_clipboard: bool = False
+
     def name(self) -> str:
         return "type_text"
 
@@ -29,7 +39,22 @@ class TypeTextTool(Tool[str]):
         return "Enter the given UTF-8 text"
 
     def run(self, client: VncClient, tool_input: str) -> None:
-        client.type_text(tool_input)
+        match self.strategy:
+            case TypeTextStrategy.TYPE:
+                client.type_text(tool_input)
+            case TypeTextStrategy.PASTE:
+                if not client.paste_text(tool_input, verify=self.verify_clipboard):
+                    raise RuntimeError("The VNC server did not confirm the clipboard contents")
+            case TypeTextStrategy.AUTO:
+                if len(tool_input) <= self.paste_threshold or not self._paste(client, tool_input):
+                    client.type_text(tool_input)
+
+    def _paste(self, client: VncClient, text: str) -> bool:
+        try:
+            return client.paste_text(text, verify=self.verify_clipboard)
+        except ValueError:
+            # Not representable in Latin-1, the only charset supported by the RFB cut buffer
+            return False
 
 
 class PageNavigationDirection(StrEnum):
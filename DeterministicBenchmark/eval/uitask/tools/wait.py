@@ -1,4 +1,3 @@
-import time
 from dataclasses import dataclass
 
 from uitask.vnc import VncClient
@@ -8,11 +7,17 @@ from .base import Tool
 
 @dataclass(frozen=True)
 class WaitTool(Tool[float]):
+    # The wait ends early once the screen did not change for this long
+    quiet_ms: float = 1000.0
+
     def name(self) -> str:
         return "wait"
 
     def description(self) -> str:
-        return "Wait for the specified duration without taking any actions."
+        return (
+            "Wait up to the specified duration without taking any actions, returning early once "
+            "the screen stops changing."
+        )
 
     def run(self, client: VncClient, tool_input: float) -> None:
-        time.sleep(tool_input)
+        client.wait_for_screen_stable(quiet_ms=self.quiet_ms, timeout=tool_input)
@@ -1,6 +1,15 @@
-from .client import VncClient
+from .async_client import AsyncVncClient
+from .client import InputLatency, ScreenStability, VncClient
 from .keysymdef import X11Key
 from .recording.process_rfb import postprocess_output_dir
 from .rfb_messages import MouseButtons
 
-__all__ = ["MouseButtons", "VncClient", "X11Key", "postprocess_output_dir"]
+__all__ = [
+    "AsyncVncClient",
+    "InputLatency",
+    "MouseButtons",
+    "ScreenStability",
+    "VncClient",
+    "X11Key",
+    "postprocess_output_dir",
+]
@@ -0,0 +1,822 @@
+"""
+This file implements the `AsyncVncClient` class, the asyncio counterpart of `VncClient`. It offers
+the same input and screenshot API as coroutines, so a single event loop can drive many VNC sessions
+concurrently without a thread per connection.
+
+The protocol state lives in the same sans-IO `HandshakeStateMachine` / `RfbSession` as in the
+synchronous client. Messages are first framed with a `MessageFramer`, which tells how many bytes to
+await from the connection, and then parsed from memory by the regular parsers.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Any, ClassVar, Protocol
+
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image as pillow
+from PIL.Image import Image
+from websockets.asyncio import client as ws_client
+from websockets.exceptions import ConnectionClosed
+
+from uitask.models.display import Position, ScreenRegion, ScreenResolution
+
+from .client import DAMAGE_LOG_SIZE, ScreenStability, VncClient, _FrameDamage, requires_shift
+from .keysymdef import X11Key
+from .protocol import HandshakeState, HandshakeStateMachine, RfbSession
+from .rfb_messages import (
+    ClientCutText,
+    ClientInit,
+    EnableContinuousUpdates,
+    Encoding,
+    Fence,
+    FenceFlags,
+    FramebufferUpdate,
+    FramebufferUpdateRequest,
+    KeyEvent,
+    MessageFramer,
+    MouseButtons,
+    PixelFormat,
+    PointerEvent,
+    ProtocolVersion,
+    SecurityType,
+    ServerCutText,
+    ServerMessage,
+    ServerSecurityResult,
+    SetEncodings,
+    SetPixelFormat,
+)
+
+
+class AsyncByteStream(Protocol):
+    """The transport of an `AsyncVncClient`"""
+
+    async def readexactly(self, n: int) -> bytes: ...
+
+    async def write(self, data: bytes) -> None: ...
+
+    async def close(self) -> None: ...
+
+
+@dataclass
+class AsyncVncClient:
+    """
+    An asyncio client for a VNC server, see `VncClient` for the synchronous version.
+
+    A reader task parses server messages as they arrive and keeps an incremental update request
+    outstanding (or enables continuous updates), like a pipelined `VncClient`. `take_screenshot()`
+    therefore returns the latest frame without a round trip by default.
+
+    Example:
+
+    ```python
+    async def run(uri: str) -> None:
+        async with await AsyncVncClient.connect_ws(uri) as client:
+            await client.mouse_move(100, 200)
+            await client.mouse_left_click()
+            await client.wait_for_screen_stable()
+            screenshot = await client.take_screenshot()
+
+    await asyncio.gather(*(run(uri) for uri in uris))
+    ```
+    """
+
+    PROTOCOL_VERSION: ClassVar[ProtocolVersion] = VncClient.PROTOCOL_VERSION
+    ENCODINGS: ClassVar[tuple[Encoding, ...]] = VncClient.ENCODINGS
+
+    _stream: AsyncByteStream = field(repr=False)
+    _session: RfbSession
+
+    _reader_task: asyncio.Task[None] | None = field(default=None, init=False, repr=False)
+    _reader_error: BaseException | None = field(default=None, init=False, repr=False)
+    _continuous_updates_enabled: bool = field(default=False, init=False, repr=False)
+
+    # Notified for every framebuffer update and server cut text applied by the reader task
+    _updates: asyncio.Condition = field(default_factory=asyncio.Condition, init=False, repr=False)
+    _frame_counter: int = field(default=0, init=False, repr=False)
+    _damage_log: deque[_FrameDamage] = field(
+        default_factory=lambda: deque(maxlen=DAMAGE_LOG_SIZE), init=False, repr=False
+    )
+    _cut_text_counter: int = field(default=0, init=False, repr=False)
+
+    @classmethod
+    async def connect_ws(cls, uri: str, shared: bool = True) -> AsyncVncClient:
+        """
+        Open a VNC connection over WebSockets, see `VncClient.connect_ws`.
+        """
+        return await cls.create(await AsyncWebsocketStream.connect(uri), shared)
+
+    @classmethod
+    async def connect_tcp(cls, host: str, port: int, shared: bool = True) -> AsyncVncClient:
+        """
+        Open a VNC connection over TCP, see `VncClient.connect_tcp`.
+        """
+        return await cls.create(await AsyncTcpStream.connect(host, port), shared)
+
+    @classmethod
+    async def create(cls, stream: AsyncByteStream, shared: bool = True) -> AsyncVncClient:
+        """
+        Create a VNC client after performing the RFB handshake, and start its reader task.
+
+        Args:
+            stream: The transport to the VNC server
+            shared: : If True, the server should try to share the desktop by leaving other clients
+                      connected.
+                      If False, it should give exclusive access to this client by disconnecting all
+                      others.
+        """
+        handshake = HandshakeStateMachine()
+        session: RfbSession | None = None
+        while session is None:
+            match handshake.state:
+                case HandshakeState.PROTOCOL_VERSION_HANDSHAKE_CLIENT:
+                    reply = cls.PROTOCOL_VERSION.to_bytes()
+                case HandshakeState.SECURITY_HANDSHAKE_CLIENT:
+                    # No VNC security protocol is supported by the client, this should be handled
+                    # at a different layer, e.g. Websockets over TLS.
+                    assert handshake.server_security is not None
+                    if SecurityType.NONE not in handshake.server_security.supported:
+                        raise NotImplementedError(
+                            f"The client only supports SecurityType.NONE; available server "
+                            f"security types: {handshake.server_security.supported}"
+                        )
+                    reply = _to_bytes(SecurityType.NONE)
+                case HandshakeState.INIT_CLIENT:
+                    reply = _to_bytes(ClientInit(shared))
+                case _:
+                    data = await read_message(stream, handshake.frame_server_message())
+                    if handshake.state == HandshakeState.SECURITY_RESULT_SERVER:
+                        result = ServerSecurityResult.from_bytes(BytesIO(data))
+                        assert result.success, result
+                    session = handshake.parse_server_message(BytesIO(data))
+                    continue
+
+            await stream.write(reply)
+            handshake.parse_client_message(BytesIO(reply))
+
+        client = cls(_stream=stream, _session=session)
+
+        # Set the encodings supported by the client and parse the first full frame inline, which
+        # also tells whether the server supports continuous updates
+        await client._send_message(SetPixelFormat(PixelFormat()))
+        await client._send_message(SetEncodings(encodings=cls.ENCODINGS))
+        screen = client.get_screen_size()
+        await client._write_message(
+            FramebufferUpdateRequest(False, 0, 0, screen.width, screen.height)
+        )
+        while not isinstance(await client._read_message(), FramebufferUpdate):
+            pass
+
+        await client._start_reader()
+        return client
+
+    def get_screen_size(self) -> ScreenResolution:
+        """
+        Gets the size of the screen in pixels
+
+        Returns:
+            (width, height): The size of the screen in pixels
+        """
+        server_init = self._session.handshake.server_init
+        return ScreenResolution(server_init.screen_width, server_init.screen_height)
+
+    def get_pointer_position(self) -> Position:
+        """
+        Gets the current position of the mouse pointer
+
+        Returns:
+            Position: The current position of the mouse pointer
+        """
+        pointer = self._session.pointer
+        return Position(x=pointer.x, y=pointer.y)
+
+    async def mouse_left_click(self) -> None:
+        """
+        Simulates a mouse left click at the current pointer location
+        """
+        await self.mouse_click(MouseButtons.LEFT)
+
+    async def mouse_double_click(self, button: MouseButtons) -> None:
+        """
+        Simulates a mouse double click at the current pointer location
+        """
+        for _ in range(2):
+            await self.mouse_click(button)
+
+    async def mouse_triple_click(self, button: MouseButtons) -> None:
+        """
+        Simulates a mouse triple click at the current pointer location
+        """
+        for _ in range(3):
+            await self.mouse_click(button)
+
+    async def mouse_right_click(self) -> None:
+        """
+        Simulates a mouse right click at the current pointer location
+        """
+        await self.mouse_click(MouseButtons.RIGHT)
+
+    async def mouse_scroll_up(self, repeat: int = 1) -> None:
+        """
+        Simulates scrolling the mouse wheel upwards, see `VncClient.mouse_scroll_up`.
+        """
+        for _ in range(repeat):
+            await self._scroll_wheel_event(MouseButtons.SCROLL_UP)
+
+    async def mouse_scroll_down(self, repeat: int = 1) -> None:
+        """
+        Simulates scrolling the mouse wheel downwards, see `VncClient.mouse_scroll_down`.
+        """
+        for _ in range(repeat):
+            await self._scroll_wheel_event(MouseButtons.SCROLL_DOWN)
+
+    async def mouse_scroll_left(self, repeat: int = 1) -> None:
+        """
+        Simulates horizontal scrolling to the left, see `VncClient.mouse_scroll_left`.
+        """
+        for _ in range(repeat):
+            await self._scroll_wheel_event(MouseButtons.SCROLL_LEFT)
+
+    async def mouse_scroll_right(self, repeat: int = 1) -> None:
+        """
+        Simulates horizontal scrolling to the right, see `VncClient.mouse_scroll_right`.
+        """
+        for _ in range(repeat):
+            await self._scroll_wheel_event(MouseButtons.SCROLL_RIGHT)
+
+    async def _scroll_wheel_event(self, scroll_button: MouseButtons) -> None:
+        """
+        Sends a scroll wheel press and release, combined with the buttons currently held down.
+        """
+        pointer = self._session.pointer
+        x, y = pointer.x, pointer.y
+        current_buttons = pointer.buttons
+        await self._send_message(PointerEvent(current_buttons | scroll_button, x, y))
+        await self._send_message(PointerEvent(current_buttons, x, y))
+
+    async def mouse_click(self, button: MouseButtons) -> None:
+        """
+        Simulates a mouse click at the current pointer location with the provided button(s)
+        """
+        pointer = self._session.pointer
+        buttons, x, y = pointer.buttons, pointer.x, pointer.y
+        await self._send_message(PointerEvent(buttons.down(button), x, y))
+        await self._send_message(PointerEvent(buttons.up(button), x, y))
+
+    async def mouse_button_up(self, button: MouseButtons) -> None:
+        """
+        Releases a mouse button (or multiple) at the current pointer location.
+        """
+        pointer = self._session.pointer
+        await self._send_message(PointerEvent(pointer.buttons.up(button), pointer.x, pointer.y))
+
+    async def mouse_button_down(self, button: MouseButtons) -> None:
+        """
+        Presses down a mouse button (or multiple) at the current pointer location.
+        """
+        pointer = self._session.pointer
+        await self._send_message(PointerEvent(pointer.buttons.down(button), pointer.x, pointer.y))
+
+    async def mouse_move(self, x: int, y: int) -> None:
+        """
+        Moves the mouse cursor to the given coordinates.
+
+        Args:
+            x: The x-coordinate where to move the cursor
+            y: The y-coordinate where to move the cursor
+        """
+        await self._send_message(PointerEvent(self._session.pointer.buttons, x, y))
+
+    async def type_text(self, text: str) -> None:
+        """
+        Types the given UTF-8 text by simulating key presses for each character, see
+        `VncClient.type_text`.
+        """
+        for char in text:
+            try:
+                x11_key = X11Key.from_char(char)
+            except ValueError as e:
+                raise ValueError(f"Cannot convert character {char!r} to X11 keysym: {e}")
+
+            if requires_shift(char):
+                async with self.hold_key(X11Key.Shift_L):
+                    await self.press_key(x11_key)
+                    continue
+
+            await self.press_key(x11_key)
+
+    async def set_clipboard(self, text: str, verify: bool = False, timeout: float = 1.0) -> bool:
+        """
+        Replaces the contents of the remote clipboard, see `VncClient.set_clipboard`.
+
+        Returns:
+            True if the clipboard was set (or `verify` is False), False if the server did not
+            confirm the new contents before `timeout`.
+        """
+        message = ClientCutText.from_text(text)
+        start_count = self._cut_text_counter
+        await self._send_message(message)
+
+        if not verify:
+            return True
+
+        def confirmed() -> bool:
+            return (
+                self._reader_error is not None
+                or self._cut_text_counter != start_count
+                and self._session.server_cut_text == message.text
+            )
+
+        try:
+            async with asyncio.timeout(timeout), self._updates:
+                await self._updates.wait_for(confirmed)
+        except TimeoutError:
+            return False
+        self._raise_reader_error()
+        return True
+
+    async def paste_text(
+        self,
+        text: str,
+        verify: bool = False,
+        timeout: float = 1.0,
+        paste_keys: tuple[X11Key, ...] = (X11Key.Control_L, X11Key.v),
+    ) -> bool:
+        """
+        Enters text by placing it on the remote clipboard and pressing the paste shortcut, see
+        `VncClient.paste_text`.
+        """
+        if not await self.set_clipboard(text, verify=verify, timeout=timeout):
+            return False
+
+        async with self.hold_keys(*paste_keys):
+            pass
+        return True
+
+    async def press_key(self, key: X11Key) -> None:
+        """
+        Simulates a key press and release of a single key.
+
+        Args:
+            key: The X11Key to press.
+        """
+        async with self.hold_key(key):
+            pass
+
+    @asynccontextmanager
+    async def hold_key(self, key: X11Key) -> AsyncIterator[None]:
+        """
+        Context manager that simulates holding down a key for the duration of the context.
+
+        Args:
+            key: The X11Key to hold down.
+        """
+        await self._send_message(KeyEvent(key, is_down=True))
+        try:
+            yield
+        finally:
+            await self._send_message(KeyEvent(key, is_down=False))
+
+    @asynccontextmanager
+    async def hold_keys(self, *keys: X11Key) -> AsyncIterator[None]:
+        """
+        Context manager that holds down multiple keys for the duration of the context. The keys are
+        pressed down in order and released in reverse order on exit.
+
+        Args:
+            *keys: The X11Keys to hold down.
+        """
+        async with AsyncExitStack() as stack:
+            for key in keys:
+                await stack.enter_async_context(self.hold_key(key))
+            yield
+
+    @property
+    def frame_generation(self) -> int:
+        """
+        Number of framebuffer updates applied so far, see `VncClient.frame_generation`.
+        """
+        return self._frame_counter
+
+    async def take_screenshot(
+        self,
+        incremental: bool | None = None,
+        cursor: bool = True,
+        min_generation: int | None = None,
+        timeout: float | None = None,
+        region: ScreenRegion | None = None,
+    ) -> Image:
+        """
+        Captures a screenshot of the current framebuffer state.
+
+        Args:
+            incremental: None (the default) returns the latest applied frame immediately. True
+                         waits for the next update, False requests a full refresh and waits for
+                         it.
+            cursor: Whether to draw the cursor onto the screenshot.
+            min_generation: Wait until at least this many framebuffer updates were applied, see
+                            `frame_generation`.
+            timeout: Maximum number of seconds to wait for a new frame. The latest frame is
+                     returned when it expires.
+            region: Only capture this part of the screen, see `VncClient.take_screenshot`.
+
+        Returns:
+            A `PIL.Image` object representing the screenshot.
+        """
+        region = await self._await_frame(incremental, min_generation, timeout, region)
+        if region is None:
+            if cursor:
+                return self._session.get_image_with_cursor()
+            return self._session.get_image_without_cursor()
+        return pillow.fromarray(self._get_array(cursor, region))
+
+    async def take_screenshot_array(
+        self,
+        incremental: bool | None = None,
+        cursor: bool = True,
+        min_generation: int | None = None,
+        timeout: float | None = None,
+        region: ScreenRegion | None = None,
+    ) -> NDArray[np.uint8]:
+        """
+        Same as `take_screenshot`, but returns the pixels as an array of shape (height, width, 3)
+        and skips the conversion to a `PIL.Image`.
+        """
+        region = await self._await_frame(incremental, min_generation, timeout, region)
+        if region is None:
+            screen = self.get_screen_size()
+            region = ScreenRegion(0, 0, screen.width, screen.height)
+        return self._get_array(cursor, region)
+
+    async def _await_frame(
+        self,
+        incremental: bool | None,
+        min_generation: int | None,
+        timeout: float | None,
+        region: ScreenRegion | None,
+    ) -> ScreenRegion | None:
+        """
+        Requests and waits for the frame described by the `take_screenshot` arguments.
+
+        Returns:
+            The requested region, clipped to the screen.
+        """
+        if region is not None:
+            region = region.clip(self.get_screen_size())
+            if region.width == 0 or region.height == 0:
+                raise ValueError(f"The screenshot region {region} lies outside of the screen")
+
+        if min_generation is None and incremental is None:
+            self._raise_reader_error()
+            return region
+
+        if min_generation is None:
+            min_generation = self._frame_counter + 1
+
+            # The reader task already keeps an incremental request outstanding, so only a full
+            # refresh needs an explicit request
+            if not incremental:
+                screen = self.get_screen_size()
+                request = region or ScreenRegion(0, 0, screen.width, screen.height)
+                await self._write_message(
+                    FramebufferUpdateRequest(
+                        incremental=False,
+                        x=request.x,
+                        y=request.y,
+                        width=request.width,
+                        height=request.height,
+                    )
+                )
+
+        generation = min_generation
+
+        def has_generation() -> bool:
+            if self._reader_error is not None:
+                return True
+            if self._frame_counter < generation:
+                return False
+            return region is None or any(
+                damage.intersects(region)
+                for damage in reversed(self._damage_log)
+                if damage.generation >= generation
+            )
+
+        try:
+            async with asyncio.timeout(timeout), self._updates:
+                await self._updates.wait_for(has_generation)
+        except TimeoutError:
+            pass
+        self._raise_reader_error()
+        return region
+
+    async def wait_for_screen_stable(
+        self,
+        quiet_ms: float = 150.0,
+        timeout: float = 5.0,
+        region: ScreenRegion | None = None,
+    ) -> ScreenStability:
+        """
+        Waits until the screen stops changing, i.e. until no framebuffer update touched it (or the
+        given region) for `quiet_ms` milliseconds, or until `timeout` seconds have passed. See
+        `VncClient.wait_for_screen_stable`.
+        """
+        if region is not None:
+            region = region.clip(self.get_screen_size())
+
+        start_ns = time.monotonic_ns()
+        quiet_ns = int(quiet_ms * 1_000_000)
+        deadline_ns = start_ns + int(timeout * 1_000_000_000)
+        start_generation = self._frame_counter
+
+        async with self._updates:
+            while True:
+                self._raise_reader_error()
+                updates = 0
+                last_damage_ns = None
+                for damage in self._damage_log:
+                    if damage.generation > start_generation and damage.intersects(region):
+                        updates += 1
+                        last_damage_ns = damage.timestamp_ns
+
+                quiet_since_ns = start_ns if last_damage_ns is None else last_damage_ns
+                now_ns = time.monotonic_ns()
+                stable = now_ns - quiet_since_ns >= quiet_ns
+                if stable or now_ns >= deadline_ns:
+                    return ScreenStability(
+                        stable=stable,
+                        settle_time=(quiet_since_ns - start_ns) / 1e9,
+                        elapsed=(now_ns - start_ns) / 1e9,
+                        updates=updates,
+                    )
+
+                remaining = (min(quiet_since_ns + quiet_ns, deadline_ns) - now_ns) / 1e9
+                with suppress(TimeoutError):
+                    async with asyncio.timeout(remaining):
+                        await self._updates.wait()
+
+    def _get_array(self, cursor: bool, region: ScreenRegion) -> NDArray[np.uint8]:
+        return self._session.get_array(
+            region.x, region.y, region.width, region.height, cursor=cursor
+        )
+
+    async def send_event(self, event: KeyEvent | PointerEvent) -> None:
+        """
+        Send a raw keyboard or pointer event directly to the VNC server, see
+        `VncClient.send_event`.
+        """
+        await self._send_message(event)
+
+    async def _start_reader(self) -> None:
+        """
+        Starts the reader task and the flow of framebuffer updates, see `VncClient._start_reader`.
+        """
+        self._continuous_updates_enabled = self._session.continuous_updates_supported
+
+        screen = self.get_screen_size()
+        if self._continuous_updates_enabled:
+            await self._write_message(
+                EnableContinuousUpdates(True, 0, 0, screen.width, screen.height)
+            )
+        else:
+            await self._write_message(
+                FramebufferUpdateRequest(True, 0, 0, screen.width, screen.height)
+            )
+        self._reader_task = asyncio.create_task(self._read_loop(), name="VncReader")
+
+    async def _read_loop(self) -> None:
+        """Body of the reader task."""
+        try:
+            while True:
+                message = await self._read_message()
+                if not self._continuous_updates_enabled and isinstance(message, FramebufferUpdate):
+                    screen = self.get_screen_size()
+                    await self._write_message(
+                        FramebufferUpdateRequest(True, 0, 0, screen.width, screen.height)
+                    )
+        except Exception as e:
+            _log.exception("VNC reader task failed")
+            self._reader_error = e
+            async with self._updates:
+                self._updates.notify_all()
+
+    def _raise_reader_error(self) -> None:
+        """Re-raises a failure of the reader task in the calling task."""
+        if self._reader_error is not None:
+            raise ConnectionError("The VNC reader task failed") from self._reader_error
+
+    async def _read_message(self) -> ServerMessage:
+        """
+        Reads, parses and applies the next server message, then wakes up any task waiting for a new
+        frame or a new server cut buffer.
+        """
+        data = await read_message(self._stream, self._session.frame_server_message())
+        message = self._session.parse_server_message(BytesIO(data))
+        self._session.handle_server_message(message)
+        match message:
+            case FramebufferUpdate():
+                damage = tuple(
+                    ScreenRegion(patch.x, patch.y, patch.width, patch.height)
+                    for patch in self._session.framebuffer.damage
+                )
+                self._frame_counter += 1
+                self._damage_log.append(
+                    _FrameDamage(self._frame_counter, time.monotonic_ns(), damage)
+                )
+                async with self._updates:
+                    self._updates.notify_all()
+            case ServerCutText():
+                self._cut_text_counter += 1
+                async with self._updates:
+                    self._updates.notify_all()
+            case Fence(flags=flags) if FenceFlags.REQUEST in flags:
+                await self._write_message(message.response())
+            case _:
+                pass
+        return message
+
+    async def close(self) -> None:
+        """
+        Stops the reader task and closes the underlying stream.
+        """
+        task = self._reader_task
+        self._reader_task = None
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+        with suppress(Exception):
+            if self._continuous_updates_enabled:
+                screen = self.get_screen_size()
+                await self._write_message(
+                    EnableContinuousUpdates(False, 0, 0, screen.width, screen.height)
+                )
+        with suppress(Exception):
+            await self._stream.close()
+
+    async def _send_message(
+        self,
+        message: KeyEvent | PointerEvent | SetEncodings | SetPixelFormat | ClientCutText,
+    ) -> None:
+        """
+        Sends a client message to the VNC server and updates the internal session state.
+        """
+        await self._write_message(message)
+        self._session.handle_client_message(message)
+
+    async def _write_message(
+        self,
+        message: KeyEvent
+        | PointerEvent
+        | SetEncodings
+        | SetPixelFormat
+        | ClientCutText
+        | FramebufferUpdateRequest
+        | EnableContinuousUpdates
+        | Fence,
+    ) -> None:
+        """Writes a client message to the stream."""
+        await self._stream.write(message.to_bytes())
+
+    async def __aenter__(self) -> AsyncVncClient:
+        """Enter context management for using `async with`"""
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        """Exit context management and ensure the connection is closed"""
+        await self.close()
+
+
+class AsyncWebsocketStream:
+    """
+    An `AsyncByteStream` over a WebSocket connection. Received frames are buffered like in
+    `WebsocketSyncStream`.
+    """
+
+    COMPACT_THRESHOLD: ClassVar[int] = 64 * 1024
+
+    _connection: ws_client.ClientConnection
+    _buffer: bytearray
+    _offset: int  # Start of the unread data in `_buffer`
+
+    def __init__(self, connection: ws_client.ClientConnection) -> None:
+        self._connection = connection
+        self._buffer = bytearray()
+        self._offset = 0
+
+    @classmethod
+    async def connect(cls, uri: str) -> AsyncWebsocketStream:
+        """Open a WebSocket connection and return an AsyncWebsocketStream object"""
+        return cls(
+            await ws_client.connect(
+                uri=uri,
+                ping_interval=None,  # deactivate heartbeat pings
+                additional_headers={
+                    "Sec-WebSocket-Origin": "pf-vnc-client",
+                },  # header expected by x11vnc
+            )
+        )
+
+    async def readexactly(self, n: int) -> bytes:
+        """Receive exactly "n" bytes from the WebSocket"""
+        while len(self._buffer) - self._offset < n:
+            try:
+                message = await self._connection.recv()
+            except ConnectionClosed as e:
+                raise ConnectionError("The WebSocket connection was closed") from e
+            if not isinstance(message, bytes):
+                raise ConnectionError(f"Received non-binary message: {message}")
+
+            if self._offset >= self.COMPACT_THRESHOLD and 2 * self._offset >= len(self._buffer):
+                del self._buffer[: self._offset]
+                self._offset = 0
+            self._buffer += message
+
+        with memoryview(self._buffer) as buffer:
+            result = buffer[self._offset : self._offset + n].tobytes()
+        self._offset += n
+        if self._offset == len(self._buffer):
+            self._buffer.clear()
+            self._offset = 0
+        return result
+
+    async def write(self, data: bytes) -> None:
+        """Send a binary message to the WebSocket"""
+        await self._connection.send(data)
+
+    async def close(self) -> None:
+        """Close the WebSocket connection"""
+        await self._connection.close()
+
+
+class AsyncTcpStream:
+    """
+    An `AsyncByteStream` over a TCP connection. asyncio already disables Nagle's algorithm for TCP
+    sockets, so small input events are sent right away.
+    """
+
+    # Receive buffer limit of the `asyncio.StreamReader`, before reading is paused
+    RECEIVE_BUFFER_SIZE: ClassVar[int] = 256 * 1024
+
+    _reader: asyncio.StreamReader
+    _writer: asyncio.StreamWriter
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, host: str, port: int) -> AsyncTcpStream:
+        """Open a TCP connection and return an AsyncTcpStream object"""
+        reader, writer = await asyncio.open_connection(host, port, limit=cls.RECEIVE_BUFFER_SIZE)
+        return cls(reader, writer)
+
+    async def readexactly(self, n: int) -> bytes:
+        """Read exactly `n` bytes from the socket"""
+        try:
+            return await self._reader.readexactly(n)
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionError("Socket connection closed before reading enough data") from e
+
+    async def write(self, data: bytes) -> None:
+        """Write data to the socket"""
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def close(self) -> None:
+        """Close the socket connection"""
+        self._writer.close()
+        with suppress(ConnectionError):
+            await self._writer.wait_closed()
+
+
+async def read_message(stream: AsyncByteStream, framer: MessageFramer) -> bytes:
+    """
+    Reads exactly the bytes of one message from `stream`, as delimited by `framer`.
+    """
+    chunks: list[bytes] = []
+    try:
+        num_bytes = next(framer)
+        while True:
+            chunk = await stream.readexactly(num_bytes)
+            chunks.append(chunk)
+            num_bytes = framer.send(chunk)
+    except StopIteration:
+        return b"".join(chunks)
+
+
+def _to_bytes(message: SecurityType | ClientInit) -> bytes:
+    buffer = BytesIO()
+    message.write_to(buffer)
+    return buffer.getvalue()
+
+
+_log = logging.getLogger(__name__)
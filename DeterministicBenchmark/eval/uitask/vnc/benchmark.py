@@ -0,0 +1,146 @@
+"""
+Micro-benchmarks for the client transport streams.
+
+Measures how fast server messages can be parsed from a `WebsocketSyncStream` or a `TcpSyncStream`,
+feeding it either the server side of a recording or a synthetic multi-MB `FramebufferUpdate`. The
+WebSocket stream gets frames of `--frame-size` bytes from memory, the TCP stream reads from a local
+socket pair, so the numbers reflect buffering and parsing overhead only.
+
+    uv run python -m uitask.vnc.benchmark parse [RECORDING_DIR] [--transport tcp|ws]
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from enum import StrEnum
+from pathlib import Path
+from struct import Struct
+from typing import IO, Any
+
+import typer
+
+from .client import TcpSyncStream, WebsocketSyncStream
+from .recording.replay import RfbReplayParser, RfbReplayStreams
+from .rfb_messages import Encoding, PixelFormat, ServerMessageKind, parse_server_message
+
+app = typer.Typer(help="Micro-benchmarks for the VNC client streams")
+
+_JPEG_MAGIC = b"\xff\xd8\xff\xe0\x00\x10JFIF"
+
+
+class Transport(StrEnum):
+    WS = "ws"
+    TCP = "tcp"
+
+
+class _ReplayConnection:
+    """Stands in for a `websockets` connection, returning pre-recorded frames from `recv`."""
+
+    def __init__(self, frames: list[bytes]) -> None:
+        self._frames: Iterator[bytes] = iter(frames)
+
+    def recv(self, timeout: float | None = None) -> bytes:
+        try:
+            return next(self._frames)
+        except StopIteration:
+            raise EOFError("No more frames") from None
+
+    def send(self, data: Any) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def synthetic_update(size: int, rect_size: int = 128 * 1024) -> bytes:
+    """A `FramebufferUpdate` of about `size` bytes made of Tight JPEG rectangles."""
+    num_rects = max(1, size // rect_size)
+    payload = _JPEG_MAGIC + os.urandom(rect_size - len(_JPEG_MAGIC))
+    rect = (
+        Struct("!HHHHi").pack(0, 0, 64, 64, Encoding.TIGHT.value)
+        + bytes((0x90, rect_size & 0x7F | 0x80, (rect_size >> 7) & 0x7F | 0x80, rect_size >> 14))
+        + payload
+    )
+    header = Struct("!BxH").pack(ServerMessageKind.FRAMEBUFFER_UPDATE.value, num_rects)
+    return header + rect * num_rects
+
+
+def recorded_server_messages(recording_dir: Path) -> bytes:
+    """The server side of a recording, without the handshake."""
+    with RfbReplayStreams.from_files(recording_dir) as streams:
+        RfbReplayParser(streams)
+        return streams.server_messages.read()
+
+
+def parse_throughput(data: bytes, transport: Transport, frame_size: int) -> tuple[int, float]:
+    """
+    Parses all server messages in `data`, received over the given transport.
+
+    Returns:
+        The number of messages and the number of seconds it took.
+    """
+    stream: IO[bytes]
+    if transport == Transport.WS:
+        frames = [data[i : i + frame_size] for i in range(0, len(data), frame_size)]
+        stream = WebsocketSyncStream(_ReplayConnection(frames))  # pyright: ignore [reportArgumentType]
+    else:
+        receiver, sender = socket.socketpair()
+        threading.Thread(target=_send_and_close, args=(sender, data), daemon=True).start()
+        stream = TcpSyncStream(receiver)
+    bytes_per_pixel = PixelFormat().bytes_per_pixel()
+
+    num_messages = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            parse_server_message(stream, bytes_per_pixel)
+            num_messages += 1
+    except (EOFError, ConnectionError):
+        pass
+    finally:
+        stream.close()
+    return num_messages, time.perf_counter() - start
+
+
+def _send_and_close(sock: socket.socket, data: bytes) -> None:
+    with sock:
+        sock.sendall(data)
+
+
+@app.callback()
+def main() -> None:
+    """Micro-benchmarks for the VNC client streams."""
+
+
+@app.command()
+def parse(
+    recording_dir: Path | None = typer.Argument(None, help="A recording directory to replay"),
+    transport: Transport = typer.Option(Transport.WS, help="The stream to measure"),
+    frame_size: int = typer.Option(64 * 1024, help="Size of the simulated WebSocket frames"),
+    synthetic_size: int = typer.Option(8 << 20, help="Size of the synthetic update in bytes"),
+    rect_size: int = typer.Option(128 * 1024, help="Size of the synthetic rectangles in bytes"),
+    repeat: int = typer.Option(5, help="Number of runs, the best one is reported"),
+) -> None:
+    """Measure the parse throughput of `WebsocketSyncStream` or `TcpSyncStream`."""
+    if recording_dir is not None:
+        data = recorded_server_messages(recording_dir)
+    else:
+        data = synthetic_update(synthetic_size, rect_size)
+
+    num_messages, seconds = min(
+        (parse_throughput(data, transport, frame_size) for _ in range(repeat)),
+        key=lambda run: run[1],
+    )
+    megabytes = len(data) / 1e6
+    typer.echo(
+        f"{num_messages} messages, {megabytes:.1f} MB in {seconds * 1e3:.1f} ms: "
+        f"{megabytes / seconds:.0f} MB/s"
+    )
+
+
+if __name__ == "__main__":
+    app()
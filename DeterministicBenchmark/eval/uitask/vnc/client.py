@@ -8,29 +8,50 @@ receiving frame updates.
 
 from __future__ import annotations
 
+import logging
+import select
 import socket
 import threading
 import time
-from collections.abc import Iterator
-from contextlib import ExitStack, contextmanager
+from collections import deque
+from collections.abc import Callable, Iterator
+from contextlib import ExitStack, contextmanager, suppress
 from dataclasses import dataclass, field
+from functools import partial
 from pathlib import Path
 from typing import IO, Any, ClassVar, Final
-from urllib.parse import urlparse
 
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image as pillow
 from PIL.Image import Image
 from typing_extensions import override
+from websockets.exceptions import ConnectionClosed
 from websockets.sync import client as ws_client
 
-from uitask.models.display import Position, ScreenResolution
-from uitask.utils import pick_free_port
+from uitask.models.display import Position, ScreenRegion, ScreenResolution
 
 from .keysymdef import X11Key
 from .protocol import HandshakeResult, RfbSession
-from .recording.service import VncServer
+from .recording.chunked import StreamCompression
+from .recording.decimation import DecimationPolicy
+from .recording.keyframe import build_keyframe
+from .recording.markers import ActionMarker, ActionMarkerWriter
+from .recording.replay import (
+    QueuedRfbRecordingWriter,
+    RecordingError,
+    RecordingStream,
+    RfbRecordingWriter,
+    emit_handshake_for_recording,
+)
+from .recording.segments import SegmentPolicy
 from .rfb_messages import (
+    ClientCutText,
     ClientInit,
+    EnableContinuousUpdates,
     Encoding,
+    Fence,
+    FenceFlags,
     FramebufferUpdate,
     FramebufferUpdateRequest,
     KeyEvent,
@@ -39,7 +60,9 @@ from .rfb_messages import (
     PointerEvent,
     ProtocolVersion,
     SecurityType,
+    ServerCutText,
     ServerInit,
+    ServerMessage,
     ServerSecurity,
     ServerSecurityResult,
     SetEncodings,
@@ -53,6 +76,67 @@ WS_PING_TIMEOUT_DEFAULT: Final[float] = 10.0
 # Default directory where VNC recordings are stored (overridable per call)
 RECORDINGS_ROOT_DEFAULT: Final[Path] = Path(__file__).resolve().parents[2] / "vnc_recordings"
 
+# Invoked by the background reader for every parsed server message
+ServerMessageCallback = Callable[[ServerMessage], None]
+
+# Number of recent framebuffer updates whose damaged regions are remembered
+DAMAGE_LOG_SIZE: Final[int] = 256
+
+
+def requires_shift(char: str) -> bool:
+    """
+    Some VNC servers do not handle some special X11Keys correctly. So we have to manually add a
+    key-press for `Shift_L` to simulate them. See also this issue:
+    https://forum.proxmox.com/threads/unable-to-type-special-characters-symbols-in-novnc-web-console.76136/.
+    """
+    return char in "~!@#$%^&*()_+:<>?|" or char in ["{", "}", '"']
+
+
+@dataclass(frozen=True)
+class _FrameDamage:
+    """The screen regions changed by one framebuffer update"""
+
+    generation: int
+    timestamp_ns: int
+    regions: tuple[ScreenRegion, ...]
+
+    def intersects(self, region: ScreenRegion | None) -> bool:
+        if region is None:
+            return bool(self.regions)
+        return any(damaged.intersects(region) for damaged in self.regions)
+
+
+@dataclass(frozen=True)
+class ScreenStability:
+    """Outcome of `VncClient.wait_for_screen_stable`"""
+
+    # False if the timeout expired while the screen was still changing
+    stable: bool
+    # Seconds from the call until the last update that changed the watched region (0 if none did)
+    settle_time: float
+    # Seconds spent waiting in total, i.e. `settle_time` plus the quiet period
+    elapsed: float
+    # Number of updates that changed the watched region
+    updates: int
+
+
+@dataclass(frozen=True)
+class InputLatency:
+    """How fast the screen responded to a batch of input events, see `VncClient.end_input_batch`"""
+
+    # Number of key, pointer and clipboard events in the batch
+    input_events: int
+    # Seconds from the first to the last input event of the batch
+    input_duration: float
+    # Seconds from the last input event until the first framebuffer update that changed pixels on
+    # the screen (None if no update arrived before the screen was considered stable)
+    first_update: float | None
+    # Seconds from the last input event until the screen stopped changing (None if it did not settle
+    # before the timeout)
+    settle_time: float | None
+    # The wait for the screen to settle after the batch
+    stability: ScreenStability
+
 
 @dataclass
 class VncClient:
@@ -97,31 +181,76 @@ class VncClient:
 
     PROTOCOL_VERSION: ClassVar[ProtocolVersion] = ProtocolVersion(b"RFB 003.008\n")
 
+    # Encodings requested from the server, in order of preference. The continuous updates and fence
+    # pseudo-encodings only announce support, the server confirms them with an
+    # `EndOfContinuousUpdates` / `Fence` message which is tracked by `RfbSession`.
+    ENCODINGS: ClassVar[tuple[Encoding, ...]] = (
+        Encoding.COPY_RECTANGLE,
+        Encoding.TIGHT,
+        Encoding.TIGHT_PNG,
+        Encoding.JPEG,
+        Encoding.JPEG_23,
+        Encoding.PSEUDO_CURSOR,
+        Encoding.PSEUDO_LAST_RECT,
+        Encoding.PSEUDO_FENCE,
+        Encoding.PSEUDO_CONTINUOUS_UPDATES,
+    )
+
+    # Reconnecting after the connection was lost: the number of attempts, and the delay before the
+    # second one, which doubles with every further attempt up to the maximum (seconds)
+    RECONNECT_ATTEMPTS: ClassVar[int] = 5
+    RECONNECT_BACKOFF: ClassVar[float] = 0.5
+    RECONNECT_BACKOFF_MAX: ClassVar[float] = 8.0
+
     _stream: IO[bytes] = field(repr=False)
     _session: RfbSession
 
-    _is_ws: bool = field(default=False, init=False)
-    _vnc_server: str | None = field(default=None, init=False, repr=False)
-    _recording_server: VncServer | None = field(default=None, init=False, repr=False)
-    _original_is_ws: bool | None = field(default=None, init=False, repr=False)
-    _original_vnc_server: str | None = field(default=None, init=False, repr=False)
-    _recording_active: bool = field(default=False, init=False)
-    _recording_thread: threading.Thread | None = field(default=None, init=False, repr=False)
-    _stop_recording: threading.Event = field(
-        default_factory=threading.Event, init=False, repr=False
+    # Opens a new stream to the same server, set by `connect_ws` / `connect_tcp`. Without it a lost
+    # connection is not re-established.
+    _connect: Callable[[], IO[bytes]] | None = field(default=None, init=False, repr=False)
+    _shared: bool = field(default=True, init=False, repr=False)
+    _closed: bool = field(default=False, init=False, repr=False)
+    _reconnect_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    # Incremented whenever `_stream` is replaced by a new connection
+    _connection_epoch: int = field(default=0, init=False, repr=False)
+    _reconnects: int = field(default=0, init=False, repr=False)
+    # Keys pressed and not released yet, in order. Guarded by `_frame_cv`.
+    _held_keys: list[X11Key] = field(default_factory=list, init=False, repr=False)
+    _recording_writer: RfbRecordingWriter | None = field(default=None, init=False, repr=False)
+    _marker_writer: ActionMarkerWriter | None = field(default=None, init=False, repr=False)
+
+    # Background reader: a thread blocked on the stream which parses server messages as they arrive
+    # and publishes them through `_frame_cv` and the registered message callbacks
+    _reader_thread: threading.Thread | None = field(default=None, init=False, repr=False)
+    _reader_stop: threading.Event = field(default_factory=threading.Event, init=False, repr=False)
+    _reader_error: BaseException | None = field(default=None, init=False, repr=False)
+    _continuous_updates_enabled: bool = field(default=False, init=False, repr=False)
+    _pipelined: bool = field(default=False, init=False)
+    _message_callbacks: list[ServerMessageCallback] = field(
+        default_factory=list, init=False, repr=False
     )
-    _recording_interval: float = field(default=0.2, init=False)
 
-    # Recording-related fields
     _recv_lock: threading.RLock = field(default_factory=threading.RLock, init=False, repr=False)
     _request_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
     _frame_cv: threading.Condition = field(
         default_factory=threading.Condition, init=False, repr=False
     )
     _frame_counter: int = field(default=0, init=False, repr=False)
+    _damage_log: deque[_FrameDamage] = field(
+        default_factory=lambda: deque(maxlen=DAMAGE_LOG_SIZE), init=False, repr=False
+    )
+    _cut_text_counter: int = field(default=0, init=False, repr=False)
+
+    # The batch of input events since `begin_input_batch`, and the arrival of the first update which
+    # changed the screen after the latest of them. Guarded by `_frame_cv`.
+    _input_events: int = field(default=0, init=False, repr=False)
+    _first_input_ns: int | None = field(default=None, init=False, repr=False)
+    _last_input_ns: int | None = field(default=None, init=False, repr=False)
+    _first_update_ns: int | None = field(default=None, init=False, repr=False)
+    _input_latencies: list[InputLatency] = field(default_factory=list, init=False, repr=False)
 
     @classmethod
-    def connect_ws(cls, uri: str, shared: bool = True) -> VncClient:
+    def connect_ws(cls, uri: str, shared: bool = True, pipelined: bool = False) -> VncClient:
         """
         Open a VNC connection over WebSockets
 
@@ -131,6 +260,7 @@ class VncClient:
                       connected.
                       If False, it should give exclusive access to this client by disconnecting all
                       others.
+            pipelined: Keep the framebuffer current in the background, see `create`.
 
         Example:
 
@@ -140,13 +270,14 @@ class VncClient:
             client.left_click()
         ```
         """
-        client = cls.create(WebsocketSyncStream.connect(uri), shared)
-        client._is_ws = True
-        client._vnc_server = uri
+        client = cls.create(WebsocketSyncStream.connect(uri), shared, pipelined)
+        client._connect = partial(WebsocketSyncStream.connect, uri)
         return client
 
     @classmethod
-    def connect_tcp(cls, host: str, port: int, shared: bool = True) -> VncClient:
+    def connect_tcp(
+        cls, host: str, port: int, shared: bool = True, pipelined: bool = False
+    ) -> VncClient:
         """
         Open a VNC connection over TCP
 
@@ -157,6 +288,7 @@ class VncClient:
                       connected.
                       If False, it should give exclusive access to this client by disconnecting all
                       others.
+            pipelined: Keep the framebuffer current in the background, see `create`.
 
         Example:
 
@@ -166,12 +298,12 @@ class VncClient:
             client.left_click()
         ```
         """
-        client = cls.create(TcpSyncStream.connect(host, port), shared)
-        client._vnc_server = f"{host}:{port}"
+        client = cls.create(TcpSyncStream.connect(host, port), shared, pipelined)
+        client._connect = partial(TcpSyncStream.connect, host, port)
         return client
 
     @classmethod
-    def create(cls, stream: IO[bytes], shared: bool = True) -> VncClient:
+    def create(cls, stream: IO[bytes], shared: bool = True, pipelined: bool = False) -> VncClient:
         """
         Create a VNC client instance after performing the RFB handshake.
 
@@ -181,8 +313,29 @@ class VncClient:
                       connected.
                       If False, it should give exclusive access to this client by disconnecting all
                       others.
+            pipelined: If True, a background reader keeps an incremental update request outstanding
+                       at all times (or enables continuous updates), so the framebuffer is always
+                       current and `take_screenshot()` returns without a round trip to the server.
         """
-        # Perform RFB handshake
+        # Create an `RfbSession` which will handle the state of the RFB protocol as we send and
+        # receive messages
+        client = cls(_stream=stream, _session=RfbSession(cls._handshake(stream, shared)))
+        client._shared = shared
+
+        # Set the encodings supported by the client
+        client._send_message(SetPixelFormat(PixelFormat()))
+        client._send_message(SetEncodings(encodings=cls.ENCODINGS))
+        client.take_screenshot(incremental=False)
+
+        client._pipelined = pipelined
+        if pipelined:
+            client._start_reader()
+
+        return client
+
+    @classmethod
+    def _handshake(cls, stream: IO[bytes], shared: bool) -> HandshakeResult:
+        """Performs the RFB handshake on a new connection and collects its results."""
 
         # 1. Exchange protocol versions
         server_protocol_version = ProtocolVersion.from_bytes(stream)
@@ -209,9 +362,7 @@ class VncClient:
         client_init.write_to(stream)
         server_init = ServerInit.from_bytes(stream)
 
-        # Collect the results of the handshake and create an `RfbSession` which will handle the
-        # state of the RFB protocol as we send and receive messages.
-        handshake = HandshakeResult(
+        return HandshakeResult(
             server_protocol_version=server_protocol_version,
             client_protocol_version=cls.PROTOCOL_VERSION,
             server_security=server_security,
@@ -219,26 +370,6 @@ class VncClient:
             client_init=client_init,
             server_init=server_init,
         )
-        client = cls(_stream=stream, _session=RfbSession(handshake))
-
-        # Set the encodings supported by the client
-        client._send_message(SetPixelFormat(PixelFormat()))
-        client._send_message(
-            SetEncodings(
-                encodings=(
-                    Encoding.COPY_RECTANGLE,
-                    Encoding.TIGHT,
-                    Encoding.TIGHT_PNG,
-                    Encoding.JPEG,
-                    Encoding.JPEG_23,
-                    Encoding.PSEUDO_CURSOR,
-                    Encoding.PSEUDO_LAST_RECT,
-                )
-            )
-        )
-        client.take_screenshot(incremental=False)
-
-        return client
 
     def get_screen_size(self) -> ScreenResolution:
         """
@@ -424,16 +555,117 @@ class VncClient:
             except ValueError as e:
                 raise ValueError(f"Cannot convert character {char!r} to X11 keysym: {e}")
 
-            # Some VNC servers do not handle some special X11Keys correctly. So we have to manually
-            # add a key-press for `Shift_L` to simulate them. See also this issue:
-            # https://forum.proxmox.com/threads/unable-to-type-special-characters-symbols-in-novnc-web-console.76136/.
-            if char in "~!@#$%^&*()_+:<>?|" or char in ["{", "}", '"']:
+            if requires_shift(char):
                 with self.hold_key(X11Key.Shift_L):
                     self.press_key(x11_key)
                     continue
 
             self.press_key(x11_key)
 
+    def set_clipboard(self, text: str, verify: bool = False, timeout: float = 1.0) -> bool:
+        """
+        Replaces the contents of the remote clipboard (the "cut buffer") using a `ClientCutText`
+        message.
+
+        The RFB protocol only transfers Latin-1 text; line endings are normalised to a bare
+        newline.
+
+        Args:
+            text: The text to place on the remote clipboard.
+            verify: If True, wait until the server announces the new cut buffer with a matching
+                    `ServerCutText` message. Not every server echoes the clipboard back, x11vnc
+                    does when the X selection changes.
+            timeout: How long to wait for the confirmation, in seconds.
+
+        Returns:
+            True if the clipboard was set (or `verify` is False), False if the server did not
+            confirm the new contents before `timeout`.
+
+        Raises:
+            ValueError: If the text cannot be encoded as Latin-1.
+        """
+        message = ClientCutText.from_text(text)
+        start_count = self._cut_text_counter
+        self._send_message(message)
+
+        if not verify:
+            return True
+        return self._wait_for_server_cut_text(message.text, start_count, timeout)
+
+    def paste_text(
+        self,
+        text: str,
+        verify: bool = False,
+        timeout: float = 1.0,
+        paste_keys: tuple[X11Key, ...] = (X11Key.Control_L, X11Key.v),
+    ) -> bool:
+        """
+        Enters text by placing it on the remote clipboard and pressing the paste shortcut. This is
+        much faster than `type_text` for long strings, which sends two key events per character.
+
+        Args:
+            text: The Latin-1 text to paste.
+            verify: If True, only paste once the server confirmed the new clipboard contents, see
+                    `set_clipboard`.
+            timeout: How long to wait for the clipboard confirmation, in seconds.
+            paste_keys: The key combination that triggers a paste in the focused application.
+
+        Returns:
+            True if the text was pasted, False if the clipboard could not be verified, in which
+            case no keys were pressed.
+
+        Raises:
+            ValueError: If the text cannot be encoded as Latin-1.
+        """
+        if not self.set_clipboard(text, verify=verify, timeout=timeout):
+            return False
+
+        with self.hold_keys(*paste_keys):
+            pass
+        return True
+
+    def _wait_for_server_cut_text(self, expected: bytes, start_count: int, timeout: float) -> bool:
+        """
+        Waits until a `ServerCutText` received after `start_count` matches `expected`.
+
+        While the background reader is running, it parses server messages and we only need to wait
+        for it. Otherwise, we probe the server with tiny non-incremental update requests and parse
+        the replies inline, the cut text arrives in between.
+        """
+        deadline = time.monotonic() + timeout
+
+        def confirmed() -> bool:
+            return (
+                self._cut_text_counter != start_count and self._session.server_cut_text == expected
+            )
+
+        if self._reader_thread is not None:
+            with self._frame_cv:
+                while not confirmed():
+                    self._raise_reader_error()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._frame_cv.wait(timeout=remaining)
+            return True
+
+        probe = FramebufferUpdateRequest(incremental=False, x=0, y=0, width=1, height=1)
+        while not confirmed():
+            if time.monotonic() >= deadline:
+                return False
+            epoch = self._connection_epoch
+            try:
+                self._write_message(probe)
+                while not isinstance(self._parse_inline(), FramebufferUpdate):
+                    pass
+            except ConnectionError as e:
+                # The cut text was set on the lost connection, the caller has to set it again
+                self._reconnect(epoch, e)
+                return False
+            if not confirmed():
+                time.sleep(0.05)
+        return True
+
     def press_key(self, key: X11Key) -> None:
         """
         Simulates a key press and release of a single key.
@@ -473,13 +705,45 @@ class VncClient:
                 stack.enter_context(self.hold_key(key))
             yield
 
-    def take_screenshot(self, incremental: bool = False, cursor: bool = True) -> Image:
+    @property
+    def pipelined(self) -> bool:
+        """Whether the client keeps the framebuffer current in the background, see `create`"""
+        return self._pipelined
+
+    @property
+    def frame_generation(self) -> int:
+        """
+        Number of framebuffer updates applied so far. Read it right after sending input and pass
+        `frame_generation + 1` as `min_generation` to `take_screenshot` to get the first frame
+        received after that input.
+        """
+        return self._frame_counter
+
+    def take_screenshot(
+        self,
+        incremental: bool | None = None,
+        cursor: bool = True,
+        min_generation: int | None = None,
+        timeout: float | None = None,
+        region: ScreenRegion | None = None,
+    ) -> Image:
         """
         Captures a screenshot of the current framebuffer state.
 
         Args:
             incremental: Boolean flag that determines whether to request only incremental
-                         updates. Incremental updates are *much* more efficient.
+                         updates. Incremental updates are *much* more efficient. By default (None),
+                         a pipelined client returns the latest applied frame immediately and any
+                         other client requests a full refresh, as if `incremental=False`.
+            cursor: Whether to draw the cursor onto the screenshot.
+            min_generation: Wait until at least this many framebuffer updates were applied, see
+                            `frame_generation`. Requires a pipelined client or an active recording;
+                            no update request is sent.
+            timeout: Maximum number of seconds to wait for a new frame when the background reader
+                     is running. The latest frame is returned when it expires.
+            region: Only capture this part of the screen. The update request is limited to the
+                    region, updates which do not touch it are not waited for, and only the region
+                    is converted to an image.
 
         IMPORTANT: When incremental=True, this method may block indefinitely, i.e. until there is a
                    change to the remote framebuffer. The exact behaviour depends on the VNC server,
@@ -493,54 +757,296 @@ class VncClient:
         Returns:
             A `PIL.Image` object representing the screenshot.
         """
-        # When recording is active, let the background reader parse frames and wait for the next one
-        if self._recording_active:
-            update_request = FramebufferUpdateRequest(
-                incremental=incremental,
-                x=0,
-                y=0,
-                width=self._session.handshake.server_init.screen_width,
-                height=self._session.handshake.server_init.screen_height,
-            )
-            # Serialize update requests to avoid interleaving with background loop writes
-            with self._request_lock:
-                self._stream.write(update_request.to_bytes())
+        region = self._await_frame(incremental, min_generation, timeout, region)
+        if region is None:
+            return self._get_image(cursor)
+        return pillow.fromarray(self._get_array(cursor, region))
 
-            start_count = self._frame_counter
-            # Wait until a new framebuffer update has been parsed by the background thread
-            with self._frame_cv:
-                while self._frame_counter == start_count:
-                    self._frame_cv.wait(timeout=1.0)
+    def take_screenshot_array(
+        self,
+        incremental: bool | None = None,
+        cursor: bool = True,
+        min_generation: int | None = None,
+        timeout: float | None = None,
+        region: ScreenRegion | None = None,
+    ) -> NDArray[np.uint8]:
+        """
+        Same as `take_screenshot`, but returns the pixels as an array of shape (height, width, 3)
+        and skips the conversion to a `PIL.Image`.
+        """
+        region = self._await_frame(incremental, min_generation, timeout, region)
+        if region is None:
+            region = self._full_screen_region()
+        return self._get_array(cursor, region)
 
-            return (
-                self._session.get_image_with_cursor()
-                if cursor
-                else self._session.get_image_without_cursor()
-            )
+    def _await_frame(
+        self,
+        incremental: bool | None,
+        min_generation: int | None,
+        timeout: float | None,
+        region: ScreenRegion | None,
+    ) -> ScreenRegion | None:
+        """
+        Requests and waits for the frame described by the `take_screenshot` arguments.
+
+        Returns:
+            The requested region, clipped to the screen.
+        """
+        if region is not None:
+            region = region.clip(self.get_screen_size())
+            if region.width == 0 or region.height == 0:
+                raise ValueError(f"The screenshot region {region} lies outside of the screen")
+        request_region = region or self._full_screen_region()
+
+        # When the background reader is running, let it parse frames and wait for the next one
+        if self._reader_thread is not None:
+            if min_generation is None and incremental is None and self._pipelined:
+                self._raise_reader_error()
+                return region
+
+            if min_generation is None:
+                min_generation = self._frame_counter + 1
+
+                # The reader already keeps an incremental request outstanding (or the server pushes
+                # continuous updates), so only a full refresh needs an explicit request
+                if not incremental:
+                    self._write_message(
+                        FramebufferUpdateRequest(
+                            incremental=False,
+                            x=request_region.x,
+                            y=request_region.y,
+                            width=request_region.width,
+                            height=request_region.height,
+                        )
+                    )
+
+            self._wait_for_generation(min_generation, timeout, region)
+            return region
+
+        if min_generation is not None:
+            raise RuntimeError("min_generation requires a pipelined client or an active recording")
 
         # Not recording: perform the request and parse inline (legacy path)
         update_request = FramebufferUpdateRequest(
-            incremental=incremental,
-            x=0,
-            y=0,
-            width=self._session.handshake.server_init.screen_width,
-            height=self._session.handshake.server_init.screen_height,
+            incremental=bool(incremental),
+            x=request_region.x,
+            y=request_region.y,
+            width=request_region.width,
+            height=request_region.height,
         )
-        self._stream.write(update_request.to_bytes())
         while True:
-            with self._recv_lock:
-                message = self._session.parse_server_message(self._stream)
-                self._session.handle_server_message(message)
-            if isinstance(message, FramebufferUpdate):
-                # Notify any waiters to keep behavior consistent with recording path
-                with self._frame_cv:
-                    self._frame_counter += 1
-                    self._frame_cv.notify_all()
-                return (
-                    self._session.get_image_with_cursor()
-                    if cursor
-                    else self._session.get_image_without_cursor()
+            epoch = self._connection_epoch
+            try:
+                self._write_message(update_request)
+                while not isinstance(self._parse_inline(), FramebufferUpdate):
+                    pass
+                return region
+            except ConnectionError as e:
+                # The request was lost with the connection, send it again on the new one
+                self._reconnect(epoch, e)
+
+    def _wait_for_generation(
+        self, min_generation: int, timeout: float | None, region: ScreenRegion | None = None
+    ) -> bool:
+        """
+        Waits until the background reader applied at least `min_generation` framebuffer updates.
+        With a `region`, also waits until one of those updates changed pixels inside of it.
+
+        Returns:
+            False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._frame_cv:
+            while not self._has_generation(min_generation, region):
+                self._raise_reader_error()
+                remaining = 1.0 if deadline is None else min(1.0, deadline - time.monotonic())
+                if remaining <= 0:
+                    return False
+                self._frame_cv.wait(timeout=remaining)
+        return True
+
+    def _has_generation(self, min_generation: int, region: ScreenRegion | None) -> bool:
+        """Must be called with `_frame_cv` held."""
+        if self._frame_counter < min_generation:
+            return False
+        if region is None:
+            return True
+        return any(
+            damage.intersects(region)
+            for damage in reversed(self._damage_log)
+            if damage.generation >= min_generation
+        )
+
+    def wait_for_screen_stable(
+        self,
+        quiet_ms: float = 150.0,
+        timeout: float = 5.0,
+        region: ScreenRegion | None = None,
+    ) -> ScreenStability:
+        """
+        Waits until the screen stops changing, i.e. until no framebuffer update touched it (or the
+        given region) for `quiet_ms` milliseconds, or until `timeout` seconds have passed.
+
+        With the background reader running this only waits on the updates it already receives.
+        Otherwise incremental update requests for the region are sent and parsed inline.
+
+        Args:
+            quiet_ms: How long the screen has to stay unchanged to be considered stable.
+            timeout: Maximum number of seconds to wait.
+            region: Only consider changes within this part of the screen.
+
+        Returns:
+            Whether the screen settled and how long it took.
+        """
+        if region is not None:
+            region = region.clip(self.get_screen_size())
+        request_region = region or self._full_screen_region()
+
+        start_ns = time.monotonic_ns()
+        quiet_ns = int(quiet_ms * 1_000_000)
+        deadline_ns = start_ns + int(timeout * 1_000_000_000)
+        with self._frame_cv:
+            start_generation = self._frame_counter
+
+        update_outstanding = False
+        while True:
+            with self._frame_cv:
+                self._raise_reader_error()
+                updates, last_damage_ns = self._damage_since(start_generation, region)
+                quiet_since_ns = start_ns if last_damage_ns is None else last_damage_ns
+                now_ns = time.monotonic_ns()
+                stable = now_ns - quiet_since_ns >= quiet_ns
+                if stable or now_ns >= deadline_ns:
+                    return ScreenStability(
+                        stable=stable,
+                        settle_time=(quiet_since_ns - start_ns) / 1e9,
+                        elapsed=(now_ns - start_ns) / 1e9,
+                        updates=updates,
+                    )
+                remaining = (min(quiet_since_ns + quiet_ns, deadline_ns) - now_ns) / 1e9
+                if self._reader_thread is not None:
+                    self._frame_cv.wait(timeout=remaining)
+                    continue
+
+            # No reader: keep one incremental request for the region outstanding and parse inline
+            epoch = self._connection_epoch
+            try:
+                if not update_outstanding:
+                    self._write_message(
+                        FramebufferUpdateRequest(
+                            incremental=True,
+                            x=request_region.x,
+                            y=request_region.y,
+                            width=request_region.width,
+                            height=request_region.height,
+                        )
+                    )
+                    update_outstanding = True
+                if not self._read_ready(timeout=remaining):
+                    continue
+                if isinstance(self._parse_inline(), FramebufferUpdate):
+                    update_outstanding = False
+            except ConnectionError as e:
+                self._reconnect(epoch, e)
+                update_outstanding = False
+
+    def _damage_since(self, generation: int, region: ScreenRegion | None) -> tuple[int, int | None]:
+        """
+        Counts the updates after `generation` which changed the region and finds the time of the
+        last one. Must be called with `_frame_cv` held.
+        """
+        updates = 0
+        last_damage_ns = None
+        for damage in self._damage_log:
+            if damage.generation > generation and damage.intersects(region):
+                updates += 1
+                last_damage_ns = damage.timestamp_ns
+        return updates, last_damage_ns
+
+    def begin_input_batch(self) -> None:
+        """
+        Starts measuring the latency of the input events sent from now on, until
+        `end_input_batch`.
+        """
+        with self._frame_cv:
+            self._input_events = 0
+            self._first_input_ns = None
+            self._last_input_ns = None
+            self._first_update_ns = None
+
+    def end_input_batch(
+        self,
+        quiet_ms: float = 150.0,
+        timeout: float = 5.0,
+        region: ScreenRegion | None = None,
+    ) -> InputLatency:
+        """
+        Waits for the screen to settle after the input events sent since `begin_input_batch` (see
+        `wait_for_screen_stable`), and measures how long the screen took to respond: the time from
+        the last input event to the first framebuffer update that changed pixels, and to the
+        moment the screen stopped changing.
+
+        The first update is only observed while server messages are parsed, i.e. by the background
+        reader or by the wait itself. Batches with input events are also kept for
+        `take_input_latencies`.
+        """
+        call_ns = time.monotonic_ns()
+        stability = self.wait_for_screen_stable(quiet_ms=quiet_ms, timeout=timeout, region=region)
+
+        with self._frame_cv:
+            input_events = self._input_events
+            first_input_ns = self._first_input_ns
+            last_input_ns = self._last_input_ns
+            first_update_ns = self._first_update_ns
+        self.begin_input_batch()
+
+        if last_input_ns is None or first_input_ns is None:
+            latency = InputLatency(0, 0.0, None, None, stability)
+        else:
+            first_update = None
+            if first_update_ns is not None:
+                first_update = (first_update_ns - last_input_ns) / 1e9
+            settle_time = None
+            if stability.stable:
+                settle_time = max(
+                    (call_ns - last_input_ns) / 1e9 + stability.settle_time, first_update or 0.0
                 )
+            latency = InputLatency(
+                input_events=input_events,
+                input_duration=(last_input_ns - first_input_ns) / 1e9,
+                first_update=first_update,
+                settle_time=settle_time,
+                stability=stability,
+            )
+            with self._frame_cv:
+                self._input_latencies.append(latency)
+        return latency
+
+    def take_input_latencies(self) -> list[InputLatency]:
+        """
+        Returns the latencies of the input batches with at least one input event which ended since
+        the last call, oldest first.
+        """
+        with self._frame_cv:
+            latencies = self._input_latencies
+            self._input_latencies = []
+        return latencies
+
+    def _full_screen_region(self) -> ScreenRegion:
+        screen = self.get_screen_size()
+        return ScreenRegion(0, 0, screen.width, screen.height)
+
+    def _get_image(self, cursor: bool) -> Image:
+        with self._recv_lock:
+            if cursor:
+                return self._session.get_image_with_cursor()
+            return self._session.get_image_without_cursor()
+
+    def _get_array(self, cursor: bool, region: ScreenRegion) -> NDArray[np.uint8]:
+        with self._recv_lock:
+            return self._session.get_array(
+                region.x, region.y, region.width, region.height, cursor=cursor
+            )
 
     def send_event(self, event: KeyEvent | PointerEvent) -> None:
         """
@@ -556,305 +1062,268 @@ class VncClient:
         """
         self._send_message(event)
 
-    def start_recording(self, output_dir: str | Path | None = None) -> None:
+    def start_recording(
+        self,
+        output_dir: str | Path | None = None,
+        compression: StreamCompression | None = None,
+        decimation: DecimationPolicy | None = None,
+        segments: SegmentPolicy | None = None,
+    ) -> None:
         """
-        Start recording by launching a local VNC WebSocket proxy that records traffic,
-        and reconnect this client through that proxy.
-
-        - The proxy listens on host 127.0.0.1 and a free port.
-        - The proxy forwards to the original VNC target (ws/tcp), recording the stream.
-        - This client then reconnects to ws://localhost:<proxy_port>.
+        Start recording the connection into `<output_dir>/recording`, with `compression` in the
+        compressed chunked format (see `recording.chunked`), with `decimation` without the updates
+        the policy drops (see `recording.decimation`), with `segments` split into segments (see
+        `recording.segments`).
+
+        The recording is a tee around the live stream: nothing is reconnected. The files start with
+        a synthesized handshake, the client's setup messages and a keyframe reproducing the current
+        framebuffer (see `recording.keyframe`), followed by the traffic as it is sent and parsed.
+        The background reader is started, if needed, so framebuffer updates keep flowing. Action
+        markers are written next to the files, see `add_action_marker`.
+
+        If writing the recording fails, e.g. because the disk is full, the recording stops but the
+        connection is kept: every input action raises a `RecordingError` (after it was sent) until
+        `stop_recording` is called, which raises it once more.
         """
-        if self._recording_server is not None:
+        if self._recording_writer is not None:
             return
 
-        # Determine the original VNC host/port to forward to
-        if self._vnc_server is None:
-            raise RuntimeError("VNC server details are not available for recording")
-
-        orig_host: str
-        orig_port: int
-        if self._is_ws:
-            orig_host, orig_port = self._parse_ws_host_port(self._vnc_server)
-        else:
-            orig_host, orig_port = self._parse_tcp_host_port(self._vnc_server)
-
         recordings_root = Path(output_dir) if output_dir is not None else RECORDINGS_ROOT_DEFAULT
-
-        # Choose a free local port for the recording proxy
-        proxy_port = pick_free_port()
-
-        # Launch the recording proxy
-        self._recording_server = VncServer.create(
-            host="127.0.0.1",
-            port=proxy_port,
-            vnc_host=orig_host,
-            vnc_port=orig_port,
-            output_dir=recordings_root,
+        recording_path = recordings_root / "recording"
+        recording_path.mkdir(exist_ok=True, parents=True)
+        writer = QueuedRfbRecordingWriter(
+            recording_path,
+            index=True,
+            compression=compression,
+            decimation=decimation,
+            segments=segments,
         )
-        self._recording_server.start()
 
-        # Wait for proxy to be ready to accept connections
-        self._wait_for_port("localhost", proxy_port, timeout_s=10.0)
+        # Switch streams between two messages in both directions
+        with self._recv_lock, self._request_lock:
+            emit_handshake_for_recording(self._session, self.PROTOCOL_VERSION, writer)
+            setup_messages = (SetPixelFormat(PixelFormat()), SetEncodings(encodings=self.ENCODINGS))
+            for message in setup_messages:
+                writer.record_client_bytes(message.to_bytes())
+            writer.record_server_bytes(build_keyframe(self._session.framebuffer))
 
-        # Preserve original connection info so we can restore later
-        self._original_is_ws = self._is_ws
-        self._original_vnc_server = self._vnc_server
+            self._recording_writer = writer
+            self._stream = RecordingStream(self._stream, writer)
+        self._marker_writer = ActionMarkerWriter(recording_path)
 
-        # Reconnect this client to the local recording proxy over WebSocket
-        proxy_uri = f"ws://localhost:{proxy_port}"
-        new_stream = WebsocketSyncStream.connect(proxy_uri)
-
-        # Close current stream before switching
-        try:
-            self._stream.close()
-        except Exception:
-            pass
-
-        self._reconnect_to_stream(new_stream, shared=True)
-        self._is_ws = True
-        self._vnc_server = proxy_uri
-
-        # Start background update loop so framebuffer updates are recorded by the proxy
-        self._stop_recording.clear()
-        self._recording_active = True
-        self._recording_thread = threading.Thread(
-            target=self._continuous_updates,
-            daemon=True,
-            name="VncRecordingUpdates",
-        )
-        self._recording_thread.start()
+        self._start_reader()
 
     def stop_recording(self) -> None:
         """
-        Stop recording by closing the proxy connection, stopping the proxy,
-        and reconnecting back to the original VNC server (ws/tcp).
+        Stop recording and close the recording files. The connection and the background reader are
+        left running.
         """
-        # If not recording, nothing to do
-        if self._recording_server is None:
+        writer = self._recording_writer
+        if writer is None:
             return
 
-        # Take a final screenshot to ensure we have a final frame
+        error = None
+        with self._recv_lock, self._request_lock:
+            stream = self._stream
+            if isinstance(stream, RecordingStream):
+                stream.flush_reads()
+                error = stream.error
+                self._stream = stream.unwrap()
+            self._recording_writer = None
         try:
-            self.take_screenshot(incremental=False)
-        except Exception:
-            pass
-
-        # Stop background update loop before closing the stream
-        try:
-            self._stop_recording.set()
-            if self._recording_thread and self._recording_thread.is_alive():
-                self._recording_thread.join(timeout=5.0)
+            writer.close()
         finally:
-            self._recording_thread = None
-            self._recording_active = False
+            if self._marker_writer is not None:
+                self._marker_writer.close()
+                self._marker_writer = None
+        if error is not None:
+            raise error
 
-        # Close connection to recording proxy
-        try:
-            self._stream.close()
-        except Exception:
-            pass
+    def add_action_marker(self, marker: ActionMarker) -> None:
+        """
+        Writes the marker of an action into the recording (see `recording.markers`), its times on
+        the clock of the recorded timestamps, `time.time_ns()`. Does nothing when not recording.
+        """
+        if self._marker_writer is not None:
+            self._marker_writer.add(marker)
 
-        # Stop proxy
-        try:
-            self._recording_server.stop()
-        finally:
-            self._recording_server = None
+    def add_message_callback(self, callback: ServerMessageCallback) -> None:
+        """
+        Registers a callback which is invoked for every server message parsed by the background
+        reader, after the message has been applied to the session state.
 
-        # Restore original connection
-        if self._original_vnc_server is None or self._original_is_ws is None:
-            print("Original VNC connection info missing; cannot restore")
-            raise RuntimeError("Original VNC connection info missing; cannot restore")
+        Callbacks run on the reader thread and should return quickly. Exceptions raised by a
+        callback are logged and do not stop the reader.
+        """
+        self._message_callbacks.append(callback)
 
-        if self._original_is_ws:
-            new_stream = WebsocketSyncStream.connect(self._original_vnc_server)
-        else:
-            host, port = self._parse_tcp_host_port(self._original_vnc_server)
-            new_stream = TcpSyncStream.connect(host, port)
-
-        self._reconnect_to_stream(new_stream, shared=True)
-        self._is_ws = self._original_is_ws
-        self._vnc_server = self._original_vnc_server
-        self._original_is_ws = None
-        self._original_vnc_server = None
-
-    def _reconnect_to_stream(self, stream: IO[bytes], shared: bool = True) -> None:
-        """Reconnect this client to a new stream by performing the RFB handshake again."""
-        # Perform handshake (mirrors the logic in create())
-        server_protocol_version = ProtocolVersion.from_bytes(stream)
-        stream.write(self.PROTOCOL_VERSION.to_bytes())
+    def remove_message_callback(self, callback: ServerMessageCallback) -> None:
+        """Unregisters a callback previously added with `add_message_callback`."""
+        self._message_callbacks.remove(callback)
 
-        server_security = ServerSecurity.from_bytes(stream)
-        if SecurityType.NONE not in server_security.supported:
-            raise NotImplementedError(
-                f"The client only supports SecurityType.NONE; "
-                f"available server security types: {server_security.supported}"
-            )
+    def _start_reader(self) -> None:
+        """
+        Starts the background reader thread and the flow of framebuffer updates.
 
-        security_type = SecurityType.NONE
-        security_type.write_to(stream)
-        server_security_result = ServerSecurityResult.from_bytes(stream)
-        assert server_security_result.success, server_security_result
+        If the server confirmed the ContinuousUpdates extension, it pushes updates for the whole
+        screen on its own. Otherwise the reader keeps exactly one incremental
+        `FramebufferUpdateRequest` outstanding and sends the next one as soon as an update arrives.
+        """
+        if self._reader_thread is not None:
+            return
 
-        client_init = ClientInit(shared)
-        client_init.write_to(stream)
-        server_init = ServerInit.from_bytes(stream)
+        self._reader_stop.clear()
+        self._reader_error = None
+        self._continuous_updates_enabled = self._session.continuous_updates_supported
 
-        handshake = HandshakeResult(
-            server_protocol_version=server_protocol_version,
-            client_protocol_version=self.PROTOCOL_VERSION,
-            server_security=server_security,
-            security_type=security_type,
-            client_init=client_init,
-            server_init=server_init,
-        )
+        screen = self.get_screen_size()
+        if self._continuous_updates_enabled:
+            self._write_message(EnableContinuousUpdates(True, 0, 0, screen.width, screen.height))
+        else:
+            self._write_message(FramebufferUpdateRequest(True, 0, 0, screen.width, screen.height))
 
-        # Swap underlying stream and session
-        self._stream = stream
-        self._session = RfbSession(handshake)
-
-        # Re-establish encodings and capture initial frame
-        self._send_message(SetPixelFormat(PixelFormat()))
-        self._send_message(
-            SetEncodings(
-                encodings=(
-                    Encoding.COPY_RECTANGLE,
-                    Encoding.TIGHT,
-                    Encoding.TIGHT_PNG,
-                    Encoding.JPEG,
-                    Encoding.JPEG_23,
-                    Encoding.PSEUDO_CURSOR,
-                    Encoding.PSEUDO_LAST_RECT,
-                )
-            )
+        self._reader_thread = threading.Thread(
+            target=self._read_loop,
+            daemon=True,
+            name="VncReader",
         )
-        self.take_screenshot(incremental=False)
+        self._reader_thread.start()
 
-    def _continuous_updates(self) -> None:
-        """Background loop to request and parse framebuffer updates while recording is active."""
-        try:
-            # Request a full update first
-            update_request = FramebufferUpdateRequest(
-                incremental=False,
-                x=0,
-                y=0,
-                width=self._session.handshake.server_init.screen_width,
-                height=self._session.handshake.server_init.screen_height,
-            )
-            try:
-                with self._request_lock:
-                    self._stream.write(update_request.to_bytes())
-            except Exception:
-                return
+    def _stop_reader(self, close_stream: bool) -> None:
+        """
+        Stops the background reader thread.
 
-            # Try to parse that frame
+        A reader blocked on an idle connection only wakes up when the next message arrives, so the
+        stream is closed first when it is not going to be used anymore.
+        """
+        thread = self._reader_thread
+        if thread is None:
+            return
+
+        self._reader_stop.set()
+        try:
+            if self._continuous_updates_enabled:
+                screen = self.get_screen_size()
+                self._write_message(
+                    EnableContinuousUpdates(False, 0, 0, screen.width, screen.height)
+                )
+            if close_stream:
+                self._stream.close()
+        except Exception:
+            pass
+        finally:
+            thread.join(timeout=5.0)
+            self._reader_thread = None
+            self._continuous_updates_enabled = False
+
+    def _read_loop(self) -> None:
+        """Body of the background reader thread."""
+        while not self._reader_stop.is_set():
+            epoch = self._connection_epoch
             try:
+                # Block until the next message starts arriving, without holding the receive lock
+                self._read_ready(timeout=None)
                 with self._recv_lock:
                     message = self._session.parse_server_message(self._stream)
-                    self._session.handle_server_message(message)
-                if isinstance(message, FramebufferUpdate):
-                    with self._frame_cv:
-                        self._frame_counter += 1
-                        self._frame_cv.notify_all()
-            except Exception:
-                pass
-
-            # Then incremental updates
-            while not self._stop_recording.is_set():
-                try:
-                    update_request = FramebufferUpdateRequest(
-                        incremental=True,
-                        x=0,
-                        y=0,
-                        width=self._session.handshake.server_init.screen_width,
-                        height=self._session.handshake.server_init.screen_height,
+                    self._handle_server_message(message)
+
+                # A lost connection is handled below, reconnecting sends the next request itself
+                if not self._continuous_updates_enabled and isinstance(message, FramebufferUpdate):
+                    screen = self.get_screen_size()
+                    self._write_message(
+                        FramebufferUpdateRequest(True, 0, 0, screen.width, screen.height),
+                        reconnect=False,
                     )
-                    with self._request_lock:
-                        self._stream.write(update_request.to_bytes())
-
-                    # Attempt to parse without blocking indefinitely
-                    start_wait = time.time()
-                    while not self._stop_recording.is_set():
-                        ready = False
-                        try:
-                            ready_attr = getattr(self._stream, "read_ready", None)
-                            if callable(ready_attr):
-                                ready = bool(ready_attr())
-                        except Exception:
-                            ready = False
-
-                        if ready:
-                            with self._recv_lock:
-                                try:
-                                    message = self._session.parse_server_message(self._stream)
-                                    self._session.handle_server_message(message)
-                                    if isinstance(message, FramebufferUpdate):
-                                        with self._frame_cv:
-                                            self._frame_counter += 1
-                                            self._frame_cv.notify_all()
-                                except Exception:
-                                    pass
-                            break
-
-                        if time.time() - start_wait > self._recording_interval:
-                            break
-                        time.sleep(self._recording_interval / 5)
+            except Exception as e:
+                if self._reader_stop.is_set():
+                    return
+                if isinstance(e, ConnectionError):
+                    try:
+                        self._reconnect(epoch, e)
+                        continue
+                    except Exception as reconnect_error:
+                        if self._reader_stop.is_set():
+                            return
+                        e = reconnect_error
+                _log.exception("VNC reader thread failed")
+                with self._frame_cv:
+                    self._reader_error = e
+                    self._frame_cv.notify_all()
+                return
 
+            for callback in tuple(self._message_callbacks):
+                try:
+                    callback(message)
                 except Exception:
-                    # Back off on errors, but continue until stop flag is set
-                    if not self._stop_recording.is_set():
-                        time.sleep(self._recording_interval)
-        except Exception:
-            pass
+                    _log.exception(f"VNC message callback {callback!r} failed")
 
-    @staticmethod
-    def _parse_ws_host_port(uri: str) -> tuple[str, int]:
-        parsed = urlparse(uri)
-        if not parsed.hostname or not parsed.port:
-            raise ValueError(f"Invalid WebSocket URI: {uri}")
-        return parsed.hostname, int(parsed.port)
-
-    @staticmethod
-    def _parse_tcp_host_port(host_port: str) -> tuple[str, int]:
-        if ":" not in host_port:
-            raise ValueError(f"Invalid host:port string: {host_port}")
-        host, port_s = host_port.rsplit(":", 1)
-        return host, int(port_s)
-
-    @staticmethod
-    def _wait_for_port(host: str, port: int, timeout_s: float = 5.0) -> None:
-        deadline = time.time() + timeout_s
-        last_err: Exception | None = None
-        while time.time() < deadline:
-            try:
-                with socket.create_connection((host, port), timeout=0.25):
-                    return
-            except Exception as e:
-                last_err = e
-                time.sleep(0.05)
-        if last_err is not None:
-            raise ConnectionError(
-                f"Timed out waiting for {host}:{port} to accept connections: {last_err}"
-            )
+    def _raise_reader_error(self) -> None:
+        """Re-raises a failure of the background reader in the calling thread."""
+        if self._reader_error is not None:
+            raise ConnectionError("The VNC reader thread failed") from self._reader_error
+
+    def _read_ready(self, timeout: float | None) -> bool:
+        """
+        Waits up to `timeout` seconds (forever if None) for data to be readable on the stream.
+        Streams that cannot report readiness are treated as always ready, i.e. the next read blocks.
+        """
+        read_ready = getattr(self._stream, "read_ready", None)
+        if not callable(read_ready):
+            return True
+        return bool(read_ready(timeout=timeout))
 
     def close(self) -> None:
         """
         Closes the underlying stream and releases resources.
         Also stops any active recording.
         """
+        self._closed = True
         try:
             self.stop_recording()
         except Exception:
             pass
 
+        self._stop_reader(close_stream=True)
         try:
             self._stream.close()
         except Exception:
             pass
 
+    def _handle_server_message(self, message: ServerMessage) -> None:
+        """
+        Applies a parsed server message to the session state and wakes up any threads waiting for
+        a new frame or a new server cut buffer. Must be called with `_recv_lock` held.
+
+        Args:
+            message: The server message to handle
+        """
+        self._session.handle_server_message(message)
+        match message:
+            case FramebufferUpdate():
+                damage = tuple(
+                    ScreenRegion(patch.x, patch.y, patch.width, patch.height)
+                    for patch in self._session.framebuffer.damage
+                )
+                now_ns = time.monotonic_ns()
+                with self._frame_cv:
+                    self._frame_counter += 1
+                    self._damage_log.append(_FrameDamage(self._frame_counter, now_ns, damage))
+                    if damage and self._last_input_ns is not None and self._first_update_ns is None:
+                        self._first_update_ns = now_ns
+                    self._frame_cv.notify_all()
+            case ServerCutText():
+                with self._frame_cv:
+                    self._cut_text_counter += 1
+                    self._frame_cv.notify_all()
+            case Fence(flags=flags) if FenceFlags.REQUEST in flags:
+                # The receive lock is held, a lost connection is handled by the caller
+                self._write_message(message.response(), reconnect=False)
+            case _:
+                pass
+
     def _send_message(
         self,
-        message: KeyEvent | PointerEvent | SetEncodings | SetPixelFormat,
+        message: KeyEvent | PointerEvent | SetEncodings | SetPixelFormat | ClientCutText,
     ) -> None:
         """
         Sends a client message to the VNC server and updates the internal session state.
@@ -865,9 +1334,186 @@ class VncClient:
 
         Args:
             message: The client message to send
+
+        Raises:
+            `RecordingError` if the recording failed, see `start_recording`. The message was sent.
         """
-        self._stream.write(message.to_bytes())
+        self._write_message(message)
         self._session.handle_client_message(message)
+        if isinstance(message, KeyEvent | PointerEvent | ClientCutText):
+            now_ns = time.monotonic_ns()
+            with self._frame_cv:
+                if isinstance(message, KeyEvent):
+                    if message.key in self._held_keys:
+                        self._held_keys.remove(message.key)
+                    if message.is_down:
+                        self._held_keys.append(message.key)
+                self._input_events += 1
+                if self._first_input_ns is None:
+                    self._first_input_ns = now_ns
+                self._last_input_ns = now_ns
+                self._first_update_ns = None
+
+        stream = self._stream
+        if isinstance(stream, RecordingStream) and stream.error is not None:
+            raise RecordingError("The recording stopped, see stop_recording") from stream.error
+
+    def _write_message(
+        self,
+        message: KeyEvent
+        | PointerEvent
+        | SetEncodings
+        | SetPixelFormat
+        | ClientCutText
+        | FramebufferUpdateRequest
+        | EnableContinuousUpdates
+        | Fence,
+        reconnect: bool = True,
+    ) -> None:
+        """
+        Writes a client message to the stream. Writes are serialized so messages sent from the
+        background loop never interleave with messages sent by the caller.
+
+        If the connection was lost, it is re-established (see `_reconnect`) and the message is
+        written to the new one, unless `reconnect` is False.
+        """
+        data = message.to_bytes()
+        while True:
+            epoch = self._connection_epoch
+            try:
+                with self._request_lock:
+                    self._stream.write(data)
+                return
+            except ConnectionError as e:
+                if not reconnect:
+                    raise
+                self._reconnect(epoch, e)
+
+    def _parse_inline(self) -> ServerMessage:
+        """Parses and handles the next server message in the calling thread."""
+        with self._recv_lock:
+            message = self._session.parse_server_message(self._stream)
+            self._handle_server_message(message)
+        return message
+
+    @property
+    def reconnects(self) -> int:
+        """How often the connection was lost and re-established"""
+        return self._reconnects
+
+    def _reconnect(self, epoch: int, error: Exception) -> None:
+        """
+        Replaces the lost connection by a new one to the same server, unless another thread already
+        did so since it read `_connection_epoch` as `epoch`. Must not be called with `_recv_lock` or
+        `_request_lock` held.
+
+        The handshake is run again with backoff between failed attempts. The framebuffer is kept,
+        only the Tight zlib streams are restarted like the server does, so the next update request
+        can stay incremental; changes the new connection does not report need a full refresh with
+        `take_screenshot(incremental=False)`. The pointer position, pressed buttons and held keys
+        are replayed, and an active recording continues with a keyframe.
+
+        Raises:
+            `error` if the client cannot reconnect (not opened with `connect_ws` / `connect_tcp`, or
+            closed), or a `ConnectionError` once all attempts failed.
+        """
+        if self._connect is None or self._closed:
+            raise error
+
+        with self._reconnect_lock:
+            if self._connection_epoch != epoch:
+                return
+            _log.warning(f"Lost the connection to the VNC server, reconnecting: {error!r}")
+
+            # Wake up any thread still blocked on the old connection, without flushing a partial
+            # message into the recording
+            old_stream = self._stream
+            with suppress(Exception):
+                if isinstance(old_stream, RecordingStream):
+                    old_stream.unwrap().close()
+                else:
+                    old_stream.close()
+
+            stream, handshake = self._open_connection(error)
+            with self._recv_lock, self._request_lock:
+                self._resume(old_stream, stream, handshake)
+                self._connection_epoch += 1
+                self._reconnects += 1
+            _log.info(f"Reconnected to the VNC server after {self._reconnects} reconnect(s)")
+
+    def _open_connection(self, error: Exception) -> tuple[IO[bytes], HandshakeResult]:
+        """Connects to the server again and performs the handshake, with exponential backoff."""
+        assert self._connect is not None
+        delay = self.RECONNECT_BACKOFF
+        for attempt in range(1, self.RECONNECT_ATTEMPTS + 1):
+            if self._closed:
+                raise error
+            stream = None
+            try:
+                stream = self._connect()
+                return stream, self._handshake(stream, self._shared)
+            except Exception as e:
+                if stream is not None:
+                    with suppress(Exception):
+                        stream.close()
+                if attempt == self.RECONNECT_ATTEMPTS:
+                    raise ConnectionError(
+                        f"Failed to reconnect to the VNC server after {attempt} attempts"
+                    ) from e
+                _log.warning(f"Reconnect attempt {attempt} failed, retrying in {delay:.1f}s: {e!r}")
+                time.sleep(delay)
+                delay = min(2 * delay, self.RECONNECT_BACKOFF_MAX)
+        raise AssertionError("unreachable")
+
+    def _resume(self, old_stream: IO[bytes], stream: IO[bytes], handshake: HandshakeResult) -> None:
+        """
+        Switches the session over to a new connection, see `_reconnect`. Must be called with
+        `_recv_lock` and `_request_lock` held.
+        """
+        framebuffer = self._session.framebuffer
+        server_init = handshake.server_init
+        same_size = (server_init.screen_width, server_init.screen_height) == (
+            framebuffer.width,
+            framebuffer.height,
+        )
+        if same_size:
+            self._session.handshake = handshake
+            framebuffer.reset_zlib_streams()
+        else:
+            pointer = self._session.pointer
+            self._session = RfbSession(handshake)
+            self._session.pointer = pointer
+
+        # Switched before anything is written, so a failure leaves the new connection to be closed
+        # by the next reconnect
+        if isinstance(old_stream, RecordingStream):
+            old_stream.discard_reads()
+            stream = old_stream.rewrap(stream)
+        self._stream = stream
+        if isinstance(stream, RecordingStream):
+            # The recorded server bytes restart with a keyframe, the partial message read from the
+            # old connection is dropped
+            stream.record_server_bytes(build_keyframe(self._session.framebuffer))
+
+        messages: list[
+            SetPixelFormat | SetEncodings | PointerEvent | KeyEvent | EnableContinuousUpdates
+        ] = [SetPixelFormat(PixelFormat()), SetEncodings(encodings=self.ENCODINGS)]
+        pointer = self._session.pointer
+        messages.append(PointerEvent(pointer.buttons, pointer.x, pointer.y))
+        with self._frame_cv:
+            messages.extend(KeyEvent(key, is_down=True) for key in self._held_keys)
+        for message in messages:
+            stream.write(message.to_bytes())
+            self._session.handle_client_message(message)
+
+        # Restart the flow of updates of the background reader
+        if self._reader_thread is not None:
+            screen = self.get_screen_size()
+            if self._continuous_updates_enabled:
+                message = EnableContinuousUpdates(True, 0, 0, screen.width, screen.height)
+            else:
+                message = FramebufferUpdateRequest(same_size, 0, 0, screen.width, screen.height)
+            stream.write(message.to_bytes())
 
     def __enter__(self) -> VncClient:
         """Enter context management for using `with`"""
@@ -880,15 +1526,25 @@ class VncClient:
 
 class WebsocketSyncStream(IO[bytes]):
     """
-    A synchronous WebSocket stream that implements the IO[bytes] interface.
+    A synchronous WebSocket stream that implements the IO[bytes] interface. A closed or failed
+    connection raises a `ConnectionError`, like `TcpSyncStream`.
+
+    Received frames are appended to a single `bytearray`, reads advance an offset into it. The
+    consumed prefix is dropped once it makes up at least half of the buffer (and more than
+    `COMPACT_THRESHOLD` bytes), so each received byte is moved a bounded number of times no matter
+    how small the reads are.
     """
 
+    COMPACT_THRESHOLD: ClassVar[int] = 64 * 1024
+
     _connection: ws_client.ClientConnection
-    _buffer: bytes
+    _buffer: bytearray
+    _offset: int  # Start of the unread data in `_buffer`
 
     def __init__(self, connection: ws_client.ClientConnection) -> None:
         self._connection = connection
-        self._buffer = b""
+        self._buffer = bytearray()
+        self._offset = 0
 
     @classmethod
     def connect(cls, uri: str) -> WebsocketSyncStream:
@@ -906,63 +1562,87 @@ class WebsocketSyncStream(IO[bytes]):
     @override
     def write(self, data: bytes) -> int:  # pyright: ignore [reportIncompatibleMethodOverride]
         """Send a binary message to the WebSocket"""
-        self._connection.send(data)
+        try:
+            self._connection.send(data)
+        except (ConnectionClosed, OSError) as e:
+            raise ConnectionError(f"Failed to write data: {e}") from e
         return len(data)
 
     @override
     def read(self, n: int = 1) -> bytes:
         """Receive exactly "n" bytes from the WebSocket"""
-        # If the buffer already contains enough data, return the requested number of bytes
-        if len(self._buffer) >= n:
-            result, self._buffer = self._buffer[:n], self._buffer[n:]
-            return result
-
-        chunks = [self._buffer]
-        bytes_collected = len(self._buffer)
-
-        while bytes_collected < n:
-            message = self._connection.recv()
-
-            if not isinstance(message, bytes):
-                raise ConnectionError("Received non-binary message")
-
-            chunks.append(message)
-            bytes_collected += len(message)
-
-        # Combine all chunks into one
-        data = b"".join(chunks)
-
-        # Return the requested "n" bytes and store any excess in the buffer
-        result, self._buffer = data[:n], data[n:]
+        self._fill(n)
+        with memoryview(self._buffer) as buffer:
+            result = buffer[self._offset : self._offset + n].tobytes()
+        self._consume(n)
         return result
 
-    def read_ready(self) -> bool:
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # pyright: ignore [reportIncompatibleMethodOverride]
+        """Receive exactly `len(buffer)` bytes from the WebSocket into `buffer`"""
+        with memoryview(buffer) as destination, destination.cast("B") as target:
+            n = len(target)
+            self._fill(n)
+            with memoryview(self._buffer) as source:
+                target[:] = source[self._offset : self._offset + n]
+        self._consume(n)
+        return n
+
+    def read_ready(self, timeout: float | None = 0) -> bool:
         """
-        Checks if there is data available to be read from the WebSocket connection without
-        blocking
+        Checks if there is data available to be read from the WebSocket connection, waiting up to
+        `timeout` seconds for it to arrive (no waiting by default, forever if None)
 
         Returns:
             bool: True if there is data available to be read, False otherwise.
                   Data may be available either in the internal buffer or from the WebSocket
                   connection.
         """
-        if len(self._buffer) > 0:
+        if len(self._buffer) > self._offset:
             return True
 
         try:
-            message = self._connection.recv(timeout=0)
-            if not isinstance(message, bytes):
-                raise ConnectionError(f"Received non-binary message: {message}")
-
-            self._buffer = message
-            return len(self._buffer) > 0
+            self._append(self._recv(timeout=timeout))
+            return len(self._buffer) > self._offset
         except TimeoutError:
             return False
 
+    def _fill(self, n: int) -> None:
+        """Receives frames until at least `n` unread bytes are buffered."""
+        while len(self._buffer) - self._offset < n:
+            self._append(self._recv())
+
+    def _recv(self, timeout: float | None = None) -> str | bytes:
+        """Receives the next message, a `TimeoutError` if none arrived within `timeout` seconds."""
+        try:
+            return self._connection.recv(timeout=timeout)
+        except TimeoutError:
+            raise
+        except (ConnectionClosed, OSError) as e:
+            raise ConnectionError(f"Failed to receive data: {e}") from e
+
+    def _append(self, message: str | bytes) -> None:
+        if not isinstance(message, bytes):
+            raise ConnectionError(f"Received non-binary message: {message}")
+
+        if self._offset >= self.COMPACT_THRESHOLD and 2 * self._offset >= len(self._buffer):
+            del self._buffer[: self._offset]
+            self._offset = 0
+        self._buffer += message
+
+    def _consume(self, n: int) -> None:
+        self._offset += n
+        if self._offset == len(self._buffer):
+            # Everything was read, start over without moving any bytes
+            self._buffer.clear()
+            self._offset = 0
+
     @override
     def close(self) -> None:
         """Close the WebSocket connection"""
-        self._connection.close()
+        try:
+            self._connection.close()
+        except OSError as e:
+            raise ConnectionError(f"Failed to close the WebSocket connection: {e}") from e
 
     def __enter__(self) -> WebsocketSyncStream:
         """Enter context management for using `with`"""
@@ -977,12 +1657,28 @@ class TcpSyncStream(IO[bytes]):
     """
     A synchronous TCP stream class that implements the IO[bytes] interface,
     providing methods for reading and writing bytes over a TCP socket.
+
+    Reads are served from a preallocated receive buffer which is refilled with `recv_into`, taking
+    in as much as the socket has available, so parsing a message with many small header reads only
+    costs a few system calls. `read_ready` and `fileno` let the stream be used with `select`-style
+    loops; check `read_ready()` before waiting on the file descriptor since data may already be
+    buffered.
     """
 
+    RECEIVE_BUFFER_SIZE: ClassVar[int] = 256 * 1024
+
     _connection: socket.socket
+    _buffer: bytearray
+    _view: memoryview  # Of `_buffer`, which is replaced but never resized
+    _start: int  # Start of the unread data in `_buffer`
+    _end: int  # End of the unread data in `_buffer`
 
     def __init__(self, connection: socket.socket):
         self._connection = connection
+        self._buffer = bytearray(self.RECEIVE_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
 
     @classmethod
     def connect(cls, host: str, port: int) -> TcpSyncStream:
@@ -990,6 +1686,8 @@ class TcpSyncStream(IO[bytes]):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             sock.connect((host, port))
+            # Input events are tiny messages which should not wait for Nagle's algorithm
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except (socket.error, socket.timeout) as e:
             sock.close()
             raise ConnectionError(f"Failed to connect to {host}:{port}: {e}")
@@ -1007,24 +1705,82 @@ class TcpSyncStream(IO[bytes]):
     @override
     def read(self, n: int = 1) -> bytes:
         """Read exactly "n" bytes from the socket, blocking until all bytes are received"""
-        chunks = []
-        bytes_received = 0
+        self._fill(n)
+        result = self._view[self._start : self._start + n].tobytes()
+        self._consume(n)
+        return result
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # pyright: ignore [reportIncompatibleMethodOverride]
+        """Read exactly `len(buffer)` bytes from the socket into `buffer`"""
+        with memoryview(buffer) as destination, destination.cast("B") as target:
+            n = len(target)
+            self._fill(n)
+            target[:] = self._view[self._start : self._start + n]
+        self._consume(n)
+        return n
+
+    def read_ready(self, timeout: float | None = 0) -> bool:
+        """
+        Checks if there is data available to be read, either already buffered or from the socket,
+        waiting up to `timeout` seconds for it to arrive (no waiting by default, forever if None)
+        """
+        if self._end > self._start:
+            return True
         try:
-            while bytes_received < n:
-                chunk = self._connection.recv(n - bytes_received)
-                if chunk == b"":  # Empty byte string indicates connection closed
+            readable, _, _ = select.select([self._connection], [], [], timeout)
+        except (ValueError, OSError) as e:  # ValueError: the socket was closed
+            raise ConnectionError(f"Failed to wait for data: {e}")
+        return len(readable) > 0
+
+    @override
+    def fileno(self) -> int:
+        return self._connection.fileno()
+
+    def _fill(self, n: int) -> None:
+        """Receives from the socket until at least `n` unread bytes are buffered."""
+        if self._end - self._start >= n:
+            return
+
+        # Make room for `n` bytes after `_start`: grow the buffer for large reads, otherwise move
+        # the unread bytes to the front
+        if len(self._buffer) < n:
+            buffer = bytearray(max(n, 2 * len(self._buffer)))
+            buffer[: self._end - self._start] = self._view[self._start : self._end]
+            self._view.release()
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+            self._end -= self._start
+            self._start = 0
+        elif len(self._buffer) - self._start < n:
+            self._buffer[: self._end - self._start] = self._buffer[self._start : self._end]
+            self._end -= self._start
+            self._start = 0
+
+        try:
+            while self._end - self._start < n:
+                received = self._connection.recv_into(self._view[self._end :])
+                if received == 0:  # Indicates connection closed
                     raise ConnectionError("Socket connection closed before reading enough data")
-                chunks.append(chunk)
-                bytes_received += len(chunk)
-            buffer = b"".join(chunks)
-            assert len(buffer) == n, (len(buffer), n)
-            return buffer
+                self._end += received
+        except ConnectionError:
+            raise
         except (socket.error, socket.timeout) as e:
             raise ConnectionError(f"Failed to read exactly {n} bytes: {e}")
 
+    def _consume(self, n: int) -> None:
+        self._start += n
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+
     @override
     def close(self) -> None:
         """Close the socket connection"""
+        try:
+            # Shut down first so that a thread blocked in `recv` wakes up
+            self._connection.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
         try:
             self._connection.close()
         except socket.error as e:
@@ -1037,3 +1793,6 @@ class TcpSyncStream(IO[bytes]):
     def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
         """Exit context management and ensure socket closure"""
         self.close()
+
+
+_log = logging.getLogger(__name__)
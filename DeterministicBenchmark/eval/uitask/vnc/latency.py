@@ -0,0 +1,116 @@
+"""
+This file aggregates the input-to-photon latencies measured by `VncClient.end_input_batch` into
+per-action records and histograms, which the agent writes next to `execution.json`.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import math
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Final
+
+from .client import InputLatency
+
+# Upper bounds (inclusive) of the histogram buckets in milliseconds, a last bucket collects the rest
+LATENCY_BUCKETS_MS: Final[tuple[float, ...]] = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Histograms over all actions are reported under this name
+ALL_ACTIONS: Final[str] = "all"
+
+
+@dataclass
+class LatencyHistogram:
+    """A histogram of latencies in milliseconds, which also keeps the samples for percentiles"""
+
+    bounds_ms: tuple[float, ...] = LATENCY_BUCKETS_MS
+    samples_ms: list[float] = field(default_factory=list)
+
+    def add(self, latency_ms: float) -> None:
+        self.samples_ms.append(latency_ms)
+
+    def counts(self) -> list[int]:
+        """Number of samples per bucket, the last entry counts the samples above all bounds"""
+        counts = [0] * (len(self.bounds_ms) + 1)
+        for sample in self.samples_ms:
+            counts[bisect.bisect_left(self.bounds_ms, sample)] += 1
+        return counts
+
+    def percentile(self, q: float) -> float | None:
+        """The `q`-th percentile (0 to 100) with the nearest-rank method, None without samples"""
+        if not self.samples_ms:
+            return None
+        ordered = sorted(self.samples_ms)
+        rank = max(1, math.ceil(q / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": len(self.samples_ms),
+            "buckets": [
+                {"le_ms": bound, "count": count}
+                for bound, count in zip((*self.bounds_ms, None), self.counts())
+            ],
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": max(self.samples_ms, default=None),
+        }
+
+
+@dataclass
+class LatencyReport:
+    """
+    The latencies of the actions of a run: one record per input batch, plus histograms of the time
+    to the first screen update and to a stable screen, per action name and over all actions.
+    """
+
+    actions: list[dict[str, Any]] = field(default_factory=list)
+    first_update: dict[str, LatencyHistogram] = field(default_factory=dict)
+    settle: dict[str, LatencyHistogram] = field(default_factory=dict)
+
+    def add(self, action: str, step: int, latency: InputLatency) -> None:
+        """
+        Records the latency of an input batch of `action`, the `step`-th action of the run.
+        """
+        first_update_ms = _to_ms(latency.first_update)
+        settle_ms = _to_ms(latency.settle_time)
+        self.actions.append(
+            {
+                "step": step,
+                "action": action,
+                "input_events": latency.input_events,
+                "input_duration_ms": latency.input_duration * 1e3,
+                "first_update_ms": first_update_ms,
+                "settle_ms": settle_ms,
+                "stable": latency.stability.stable,
+                "screen_updates": latency.stability.updates,
+            }
+        )
+        for histograms, value_ms in (
+            (self.first_update, first_update_ms),
+            (self.settle, settle_ms),
+        ):
+            if value_ms is None:
+                continue
+            for name in (action, ALL_ACTIONS):
+                histograms.setdefault(name, LatencyHistogram()).add(value_ms)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "actions": self.actions,
+            "histograms": {
+                "first_update": {name: h.to_dict() for name, h in self.first_update.items()},
+                "settle": {name: h.to_dict() for name, h in self.settle.items()},
+            },
+        }
+
+    def write(self, path: Path) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+
+def _to_ms(seconds: float | None) -> float | None:
+    return None if seconds is None else seconds * 1e3
@@ -7,10 +7,11 @@ from __future__ import annotations
 
 import logging
 import zlib
+from collections.abc import Callable
 from dataclasses import dataclass
 from enum import Enum
 from io import BytesIO
-from typing import IO, Any
+from typing import IO, Any, Final
 
 import numpy as np
 from numpy._typing import NDArray
@@ -22,8 +23,11 @@ from .rfb_messages import (
     ClientMessage,
     CopyRect,
     Encoding,
+    EndOfContinuousUpdates,
+    Fence,
     FramebufferUpdate,
     FramebufferUpdateRect,
+    MessageFramer,
     MouseButtons,
     PixelFormat,
     PointerEvent,
@@ -37,16 +41,20 @@ from .rfb_messages import (
     RawRect,
     Rectangle,
     SecurityType,
+    ServerCutText,
     ServerInit,
     ServerMessage,
     ServerSecurity,
     ServerSecurityResult,
+    SetEncodings,
     SetPixelFormat,
     TightRect,
     TightRectCopyFilter,
     TightRectFill,
     TightRectJpeg,
     TightRectPaletteFilter,
+    frame_server_message,
+    parse_client_message,
     parse_server_message,
 )
 
@@ -54,6 +62,9 @@ from .rfb_messages import (
 # `Decompress` or `_Decompress` doesn't seem to work :-/
 ZlibReadStream = Any
 
+# Size of the deflate window, i.e. how far back a zlib stream can refer to previous output
+ZLIB_WINDOW_SIZE = 32768
+
 
 class HandshakeState(Enum):
     """
@@ -148,6 +159,23 @@ class HandshakeStateMachine:
                 )
         return None
 
+    def frame_server_message(self) -> MessageFramer:
+        """
+        Frames the server message expected in the current state, the one `parse_server_message`
+        parses next. See `MessageFramer`.
+        """
+        match self.state:
+            case HandshakeState.PROTOCOL_VERSION_HANDSHAKE_SERVER:
+                return ProtocolVersion.frame()
+            case HandshakeState.SECURITY_HANDSHAKE_SERVER:
+                return ServerSecurity.frame()
+            case HandshakeState.SECURITY_RESULT_SERVER:
+                return ServerSecurityResult.frame()
+            case HandshakeState.INIT_SERVER:
+                return ServerInit.frame()
+            case _:
+                raise RuntimeError(f"No server message is expected in state {self.state}")
+
     def _get_connected_session(self) -> RfbSession:
         assert (
             self.server_protocol_version is not None
@@ -191,6 +219,17 @@ class RfbSession:
     framebuffer: FramebufferState
     pointer: PointerState
 
+    # Latest contents of the server's cut buffer, as announced by `ServerCutText`
+    server_cut_text: bytes | None
+
+    # Extensions the server confirmed, see `Encoding.PSEUDO_CONTINUOUS_UPDATES` and
+    # `Encoding.PSEUDO_FENCE`
+    continuous_updates_supported: bool
+    fence_supported: bool
+
+    # Encodings the client asked for with `SetEncodings`, the server may also use raw
+    encodings: tuple[Encoding, ...]
+
     def __init__(self, handshake: HandshakeResult) -> None:
         self.handshake = handshake
         self.framebuffer = FramebufferState(
@@ -199,6 +238,10 @@ class RfbSession:
             pixel_format=handshake.server_init.pixel_format,
         )
         self.pointer = PointerState(x=0, y=0, buttons=MouseButtons(0))
+        self.server_cut_text = None
+        self.continuous_updates_supported = False
+        self.fence_supported = False
+        self.encodings = ()
 
     def parse_server_message(self, message: IO[bytes]) -> ServerMessage:
         """
@@ -212,6 +255,13 @@ class RfbSession:
         """
         return parse_server_message(message, self.framebuffer._pixel_format.bytes_per_pixel())
 
+    def frame_server_message(self) -> MessageFramer:
+        """
+        Frames the next server message, i.e. finds how many bytes `parse_server_message` will
+        consume. See `MessageFramer`.
+        """
+        return frame_server_message(self.framebuffer._pixel_format.bytes_per_pixel())
+
     def handle_client_message(self, message: ClientMessage) -> None:
         """
         Processes a client message and updates the session state accordingly.
@@ -222,6 +272,8 @@ class RfbSession:
         match message:
             case SetPixelFormat(pixel_format=pixel_format):
                 self.framebuffer.set_pixel_format(pixel_format)
+            case SetEncodings(encodings=encodings):
+                self.encodings = encodings
             case PointerEvent():
                 self.pointer.handle_update(message)
             case _:
@@ -237,6 +289,12 @@ class RfbSession:
         match message:
             case FramebufferUpdate():
                 self.framebuffer.handle_update(message)
+            case ServerCutText(text=text):
+                self.server_cut_text = text
+            case EndOfContinuousUpdates():
+                self.continuous_updates_supported = True
+            case Fence():
+                self.fence_supported = True
             case _:
                 pass
 
@@ -249,6 +307,179 @@ class RfbSession:
     def get_image_without_cursor(self) -> Image:
         return self.framebuffer.get_image_without_cursor()
 
+    def get_array(self, x: int, y: int, width: int, height: int, cursor: bool) -> NDArray[np.uint8]:
+        pointer_position = (self.pointer.x, self.pointer.y) if cursor else None
+        return self.framebuffer.get_array(x, y, width, height, pointer_position)
+
+
+_CLIENT_HANDSHAKE_STATES: Final[frozenset[HandshakeState]] = frozenset(
+    (
+        HandshakeState.PROTOCOL_VERSION_HANDSHAKE_CLIENT,
+        HandshakeState.SECURITY_HANDSHAKE_CLIENT,
+        HandshakeState.INIT_CLIENT,
+    )
+)
+
+
+class SessionMirror:
+    """
+    Follows an RFB connection, fed with the bytes of both directions, and splits them into
+    messages. Only headers are parsed, unless `decode`.
+
+    The handshake is followed in lockstep. Afterwards, client messages are applied as they arrive
+    (only `SetPixelFormat` matters, it changes how the following updates are framed) and server
+    messages are delimited with `RfbSession.frame_server_message`. With `decode`, they are also
+    parsed and applied to the `RfbSession`, which keeps the framebuffer up to date.
+
+    The proxy in `ws.py` follows its sessions with a mirror, and the recording writers use one to
+    index the messages they record.
+
+    A connection the mirror cannot follow, e.g. one with an unsupported security type, marks it
+    `failed`, after which the server bytes are returned as they come.
+    """
+
+    def __init__(self, decode: bool = True) -> None:
+        self.decode = decode
+        self.failed = False
+        self.handshake = HandshakeStateMachine()
+        self.session: RfbSession | None = None
+        # Number of messages each side sent during the handshake, so far
+        self.client_handshake_messages = 0
+        self.server_handshake_messages = 0
+        self._client_buffer = bytearray()
+        self._server_buffer = bytearray()
+        # Messages completed but not returned yet
+        self._client_messages: list[bytes] = []
+        self._messages: list[bytes] = []
+
+        # The server message being framed: its framer, the number of bytes it asked for next and
+        # the number of buffered bytes it already consumed
+        self._framer: MessageFramer | None = None
+        self._num_bytes = 0
+        self._framed = 0
+
+    @property
+    def pending(self) -> bool:
+        """Whether bytes of an incomplete server message are buffered."""
+        return bool(self._server_buffer)
+
+    @property
+    def client_pending(self) -> bool:
+        """Whether bytes of an incomplete client message are buffered."""
+        return bool(self._client_buffer)
+
+    def feed_client(self, data: bytes) -> list[bytes]:
+        """
+        Returns:
+            The client messages completed by `data`, including those of the handshake. Nothing once
+            the mirror `failed`.
+        """
+        if self.failed:
+            return []
+        self._client_buffer += data
+        self._follow()
+        messages, self._client_messages = self._client_messages, []
+        return messages
+
+    def feed_server(self, data: bytes) -> list[bytes]:
+        """
+        Returns:
+            The server messages completed by `data`, including those of the handshake. Once the
+            mirror `failed`, the bytes not returned before.
+        """
+        if self.failed:
+            return [data]
+        self._server_buffer += data
+        self._follow()
+        messages, self._messages = self._messages, []
+        return messages
+
+    def take_pending(self) -> bytes:
+        """Returns the bytes of the incomplete server message, e.g. when the connection ends."""
+        data = bytes(self._server_buffer)
+        self._server_buffer.clear()
+        self._framer = None
+        return data
+
+    def _follow(self) -> None:
+        try:
+            self._advance()
+        except Exception as e:
+            _log.warning(
+                f"Cannot follow the RFB session, it is no longer split into messages: {e!r}"
+            )
+            self.failed = True
+            self._client_buffer.clear()
+            if self._server_buffer:
+                self._messages.append(self.take_pending())
+
+    def _advance(self) -> None:
+        while True:
+            if self.session is None and self.handshake.state in _CLIENT_HANDSHAKE_STATES:
+                if not self._parse_client(self.handshake.parse_client_message):
+                    return
+                # The messages of other security types are not framed by the handshake
+                security_type = self.handshake.security_type
+                if security_type is not None and security_type != SecurityType.NONE:
+                    raise ValueError(f"Unsupported security type {security_type}")
+                continue
+            if self.session is not None:
+                while self._parse_client(self._handle_client_message):
+                    pass
+
+            message = self._frame_server()
+            if message is None:
+                return
+            if self.session is None:
+                self.session = self.handshake.parse_server_message(BytesIO(message))
+                self.server_handshake_messages += 1
+            elif self.decode:
+                self.session.handle_server_message(
+                    self.session.parse_server_message(BytesIO(message))
+                )
+            self._messages.append(message)
+
+    def _handle_client_message(self, stream: IO[bytes]) -> None:
+        assert self.session is not None
+        self.session.handle_client_message(parse_client_message(stream))
+
+    def _parse_client(self, parse: Callable[[IO[bytes]], Any]) -> bool:
+        """Parses the next buffered client message, returns False if it is not complete yet."""
+        if not self._client_buffer:
+            return False
+        stream = BytesIO(self._client_buffer)
+        try:
+            parse(stream)
+        except EOFError:
+            return False
+        if self.session is None:
+            self.client_handshake_messages += 1
+        self._client_messages.append(bytes(self._client_buffer[: stream.tell()]))
+        del self._client_buffer[: stream.tell()]
+        return True
+
+    def _frame_server(self) -> bytes | None:
+        """Returns the next server message once it is buffered completely."""
+        if self._framer is None:
+            if self.session is None:
+                self._framer = self.handshake.frame_server_message()
+            else:
+                self._framer = self.session.frame_server_message()
+            self._num_bytes = next(self._framer)
+            self._framed = 0
+
+        while len(self._server_buffer) - self._framed >= self._num_bytes:
+            chunk = bytes(self._server_buffer[self._framed : self._framed + self._num_bytes])
+            self._framed += self._num_bytes
+            try:
+                self._num_bytes = self._framer.send(chunk)
+            except StopIteration:
+                message = bytes(self._server_buffer[: self._framed])
+                del self._server_buffer[: self._framed]
+                self._framer = None
+                return message
+        return None
+
 
 @dataclass
 class PointerState:
@@ -275,14 +506,22 @@ class FramebufferState:
     _pixel_format: PixelFormat
     _led_state: QemuLedState | None
 
-    _zlib_streams: tuple[ZlibReadStream, ...]
+    _zlib_streams: list[ZlibReadStream]
+    # The last `ZLIB_WINDOW_SIZE` bytes decompressed by each stream, None if it was not used since
+    # it was (re)started
+    _zlib_histories: list[bytes | None]
+
+    # Rectangles whose pixels were changed by the last update
+    damage: tuple[Rectangle, ...]
 
     def __init__(self, width: int, height: int, pixel_format: PixelFormat) -> None:
         self._image = np.zeros(shape=(height, width, 3), dtype="u1")
         self._cursor = None
         self._pixel_format = pixel_format
 
-        self._zlib_streams = tuple(zlib.decompressobj() for _ in range(TightRect.NUM_ZLIB_STREAMS))
+        self._zlib_streams = [zlib.decompressobj() for _ in range(TightRect.NUM_ZLIB_STREAMS)]
+        self._zlib_histories = [None] * TightRect.NUM_ZLIB_STREAMS
+        self.damage = ()
 
     def handle_update(self, message: FramebufferUpdate) -> None:
         """
@@ -291,8 +530,46 @@ class FramebufferState:
         Args:
             message: The framebuffer update message.
         """
+        damage: list[Rectangle] = []
         for rectangle in message.rectangles:
             self._handle_rect(rectangle)
+            if isinstance(rectangle, RawRect | CopyRect | TightRect):
+                damage.append(rectangle.patch)
+        self.damage = tuple(damage)
+
+    @property
+    def width(self) -> int:
+        return self._image.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self._image.shape[0]
+
+    @property
+    def cursor(self) -> Image | None:
+        """The RGBA cursor image, None if the server did not set one"""
+        return self._cursor
+
+    @property
+    def pixel_format(self) -> PixelFormat:
+        """The pixel format of the updates, as last set by the client"""
+        return self._pixel_format
+
+    def zlib_history(self, stream_id: int) -> bytes | None:
+        """
+        The tail of the output of a Tight zlib stream. Feeding these bytes to a fresh decompressor
+        brings it into a state equivalent to the live one. Returns None when the stream was not used
+        since it was last reset.
+        """
+        return self._zlib_histories[stream_id]
+
+    def reset_zlib_streams(self) -> None:
+        """
+        Restarts all Tight zlib streams, as a server does for a new connection. The pixels are
+        kept.
+        """
+        for stream_id in range(TightRect.NUM_ZLIB_STREAMS):
+            self._reset_zlib_stream(stream_id)
 
     def set_pixel_format(self, pixel_format: PixelFormat) -> None:
         """
@@ -319,6 +596,43 @@ class FramebufferState:
         pil_image = pillow.fromarray(self._image).convert("RGBA")
         return pil_image.convert("RGB")
 
+    def get_array(
+        self,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        pointer_position: tuple[int, int] | None = None,
+    ) -> NDArray[np.uint8]:
+        """
+        Copies a region of the framebuffer, with the cursor drawn at `pointer_position` if given.
+        Only the part of the cursor overlapping the region is composed, the rest of the screen is
+        never converted.
+
+        Returns:
+            An array of shape (height, width, 3).
+        """
+        crop = self._image[y : y + height, x : x + width].copy()
+        if pointer_position is None or self._cursor is None:
+            return crop
+
+        # Intersection of the cursor and the region, in screen coordinates
+        cursor_x, cursor_y = pointer_position
+        cursor_width, cursor_height = self._cursor.size
+        left, top = max(x, cursor_x), max(y, cursor_y)
+        right = min(x + crop.shape[1], cursor_x + cursor_width)
+        bottom = min(y + crop.shape[0], cursor_y + cursor_height)
+        if left >= right or top >= bottom:
+            return crop
+
+        patch = pillow.fromarray(crop[top - y : bottom - y, left - x : right - x]).convert("RGBA")
+        patch.alpha_composite(
+            self._cursor,
+            source=(left - cursor_x, top - cursor_y, right - cursor_x, bottom - cursor_y),
+        )
+        crop[top - y : bottom - y, left - x : right - x] = np.asarray(patch.convert("RGB"))
+        return crop
+
     def _handle_rect(self, rect: FramebufferUpdateRect) -> None:
         """
         Processes different types of rectangles in a framebuffer update.
@@ -380,8 +694,9 @@ class FramebufferState:
         Args:
             rect: The copy rectangle message.
         """
-        source = _patch_coordinates(rect.patch)
-        dest = _patch_coordinates(
+        # The rectangle header gives the destination, the payload the source position
+        dest = _patch_coordinates(rect.patch)
+        source = _patch_coordinates(
             Rectangle(
                 x=rect.source_x,
                 y=rect.source_y,
@@ -405,13 +720,17 @@ class FramebufferState:
         patch = _patch_coordinates(rect.patch)
         new_rect: NDArray[np.uint8] | None = None
 
+        for stream_id, reset in enumerate(rect.reset_streams):
+            if reset:
+                self._reset_zlib_stream(stream_id)
+
         match rect.content:
             case TightRectJpeg(data):
                 new_rect = np.array(pillow.open(BytesIO(data)))
             case TightRectFill((red, green, blue)):
                 new_rect = np.array((red, green, blue), dtype=np.uint8)
             case TightRectCopyFilter(stream_id, compressed_data):
-                compressed_pixel_data = self._zlib_streams[stream_id].decompress(compressed_data)
+                compressed_pixel_data = self._decompress(stream_id, compressed_data)
                 new_rect = np.frombuffer(buffer=compressed_pixel_data, dtype=np.uint8).reshape(
                     rect.patch.height, rect.patch.width, 3
                 )[:, :, :3]
@@ -421,6 +740,20 @@ class FramebufferState:
         if new_rect is not None:
             self._image[patch.y_start : patch.y_end, patch.x_start : patch.x_end] = new_rect
 
+    def _reset_zlib_stream(self, stream_id: int) -> None:
+        self._zlib_streams[stream_id] = zlib.decompressobj()
+        self._zlib_histories[stream_id] = None
+
+    def _decompress(self, stream_id: int, data: bytes) -> bytes:
+        """Decompresses data from one of the Tight zlib streams, keeping track of its history."""
+        output = self._zlib_streams[stream_id].decompress(data)
+        history = self._zlib_histories[stream_id] or b""
+        if len(output) >= ZLIB_WINDOW_SIZE:
+            self._zlib_histories[stream_id] = output[-ZLIB_WINDOW_SIZE:]
+        else:
+            self._zlib_histories[stream_id] = (history + output)[-ZLIB_WINDOW_SIZE:]
+        return output
+
     def _handle_tight_rect_pallete_filter(
         self,
         palette_filter: TightRectPaletteFilter,
@@ -428,7 +761,7 @@ class FramebufferState:
     ) -> NDArray[np.uint8] | None:
         raw_color_ids = palette_filter.data
         if palette_filter.compressed:
-            raw_color_ids = self._zlib_streams[palette_filter.stream_id].decompress(raw_color_ids)
+            raw_color_ids = self._decompress(palette_filter.stream_id, raw_color_ids)
 
         color_ids = np.frombuffer(raw_color_ids, dtype=np.uint8)
         if color_ids.shape == (0,):
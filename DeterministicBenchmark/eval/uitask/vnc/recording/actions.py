@@ -288,12 +288,15 @@ Action = (
 class ActionReplayStep:
     """A replay step that can hold lower-level Rfb events and higher-level actions."""
 
+    # Timestamp of the recorded step the action starts at, in nanoseconds
+    timestamp_ns: int
     # Relative timestamp in format HH:MM:SS.mmm (milliseconds), aligned to video.webp
     timestamp: str
     event: Action
 
     def to_dict(self) -> dict[str, object]:
         return {
+            "timestamp_ns": self.timestamp_ns,
             "timestamp": self.timestamp,
             "event": self.event.to_dict(),
         }
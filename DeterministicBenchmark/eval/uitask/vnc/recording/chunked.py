@@ -0,0 +1,296 @@
+"""
+This file implements the compressed format of the recorded message streams (`client.rfb.bin` and
+`server.rfb.bin`): the stream is cut into fixed-size chunks, each compressed on its own with zlib
+or lzma, and a chunk table at the end of the file locates them. A reader seeking into the stream
+only decompresses the chunk it lands in.
+
+Layout, integers are big-endian:
+
+    header       "RFBZ", version u8, codec u8, reserved u16, chunk size u32
+    chunks       per chunk: compressed size u32, raw size u32, compressed data
+    chunk table  per chunk: offset u64 of the compressed data, compressed size u32, raw size u32
+    trailer      offset u64 of the chunk table, number of chunks u32, raw size u64, "RFBZ"
+
+Every chunk but the last holds `chunk size` raw bytes. A file without trailer, because its writer
+was not closed, is read by walking the chunk headers: the chunks written so far are kept.
+
+An uncompressed stream starts with the `ProtocolVersion` "RFB 0", so `open_message_stream` tells
+both formats apart by the magic and the file names stay the same.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import lzma
+import zlib
+from enum import StrEnum
+from pathlib import Path
+from struct import Struct
+from typing import IO, Final, cast
+
+MAGIC: Final[bytes] = b"RFBZ"
+VERSION: Final[int] = 1
+
+# Raw bytes per chunk, the unit of random access
+CHUNK_SIZE: Final[int] = 1 << 20
+
+
+class StreamCompression(StrEnum):
+    ZLIB = "zlib"
+    LZMA = "lzma"
+
+
+def is_chunked(path: Path) -> bool:
+    """Whether the message stream at `path` is stored in the compressed format."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def open_message_stream(path: Path) -> IO[bytes]:
+    """
+    Opens the message stream at `path` for reading, whether it is compressed or not. The stream is
+    seekable either way.
+    """
+    file = open(path, "rb")
+    try:
+        if file.read(len(MAGIC)) != MAGIC:
+            file.seek(0)
+            return file
+        reader = ChunkedStreamReader(file)
+    except BaseException:
+        file.close()
+        raise
+    return cast(IO[bytes], io.BufferedReader(reader, buffer_size=64 << 10))
+
+
+class ChunkedStreamWriter(io.BufferedIOBase):
+    """
+    Writes a message stream in the compressed format. Bytes are buffered until a chunk is full, so
+    `flush` only flushes the chunks compressed so far. `close` compresses the last chunk and
+    writes the chunk table.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        compression: StreamCompression = StreamCompression.ZLIB,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        super().__init__()
+        self._file = open(path, "wb")
+        self._compression = compression
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        # (offset, compressed size, raw size) per chunk
+        self._table: list[tuple[int, int, int]] = []
+        self._raw_size = 0
+        self._finished = False
+        self._file.write(_HEADER.pack(MAGIC, VERSION, _CODEC_IDS[compression], 0, chunk_size))
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes | bytearray | memoryview) -> int:  # pyright: ignore [reportIncompatibleMethodOverride]
+        if self._finished:
+            raise ValueError("The chunked stream is finished")
+        num_bytes = len(memoryview(data))
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            view = memoryview(self._buffer)
+            start = 0
+            while len(self._buffer) - start >= self._chunk_size:
+                self._write_chunk(view[start : start + self._chunk_size])
+                start += self._chunk_size
+            view.release()
+            del self._buffer[:start]
+        return num_bytes
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def flush(self) -> None:
+        if not self._file.closed:
+            self._file.flush()
+
+    def finish(self) -> None:
+        """Compresses the buffered bytes and writes the chunk table, the file stays open."""
+        if self._finished:
+            return
+        self._finished = True
+        if self._buffer:
+            self._write_chunk(self._buffer)
+            self._buffer.clear()
+        table_offset = self._file.tell()
+        self._file.write(b"".join(_TABLE_ENTRY.pack(*entry) for entry in self._table))
+        self._file.write(_TRAILER.pack(table_offset, len(self._table), self._raw_size, MAGIC))
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        try:
+            self.finish()
+        finally:
+            self._file.close()
+            super().close()
+
+    def _write_chunk(self, raw: bytes | bytearray | memoryview) -> None:
+        raw_size = len(memoryview(raw))
+        compressed = _compress(self._compression, raw)
+        self._file.write(_CHUNK_HEADER.pack(len(compressed), raw_size))
+        self._table.append((self._file.tell(), len(compressed), raw_size))
+        self._file.write(compressed)
+        self._raw_size += raw_size
+
+
+class ChunkedStreamReader(io.RawIOBase):
+    """
+    A seekable raw stream over a message stream in the compressed format, see
+    `open_message_stream`. The most recently read chunks are kept decompressed.
+    """
+
+    # Decompressed chunks kept for seeks back and forth, e.g. by `read_input_event`
+    CACHED_CHUNKS: Final[int] = 4
+
+    def __init__(self, file: IO[bytes]) -> None:
+        super().__init__()
+        self._file = file
+        file.seek(0)
+        magic, version, codec, _, self._chunk_size = _HEADER.unpack(_read_at(file, _HEADER.size))
+        if magic != MAGIC or version != VERSION or codec not in _CODECS:
+            raise ValueError(f"Not a supported chunked stream: {magic!r} v{version} codec {codec}")
+        self._compression = _CODECS[codec]
+        self._table = _read_table(file) or _scan_chunks(file)
+        self._size = sum(raw_size for _, _, raw_size in self._table)
+        self._position = 0
+        self._cache: dict[int, bytes] = {}
+
+    @property
+    def compression(self) -> StreamCompression:
+        return self._compression
+
+    @property
+    def size(self) -> int:
+        """The size of the raw stream"""
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        match whence:
+            case io.SEEK_SET:
+                position = offset
+            case io.SEEK_CUR:
+                position = self._position + offset
+            case io.SEEK_END:
+                position = self._size + offset
+            case _:
+                raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # pyright: ignore [reportIncompatibleMethodOverride]
+        if self._position >= self._size:
+            return 0
+        index, start = divmod(self._position, self._chunk_size)
+        chunk = self._chunk(index)
+        with memoryview(buffer) as view:
+            num_bytes = min(len(view), len(chunk) - start)
+            view[:num_bytes] = chunk[start : start + num_bytes]
+        self._position += num_bytes
+        return num_bytes
+
+    def close(self) -> None:
+        try:
+            self._file.close()
+        finally:
+            self._cache.clear()
+            super().close()
+
+    def _chunk(self, index: int) -> bytes:
+        chunk = self._cache.get(index)
+        if chunk is not None:
+            return chunk
+
+        offset, compressed_size, raw_size = self._table[index]
+        self._file.seek(offset)
+        chunk = _decompress(self._compression, _read_at(self._file, compressed_size))
+        if len(chunk) != raw_size:
+            raise ValueError(f"Chunk {index} decompressed to {len(chunk)} instead of {raw_size}")
+
+        if len(self._cache) >= self.CACHED_CHUNKS:
+            del self._cache[next(iter(self._cache))]
+        self._cache[index] = chunk
+        return chunk
+
+
+def _compress(compression: StreamCompression, data: bytes | bytearray | memoryview) -> bytes:
+    if compression == StreamCompression.ZLIB:
+        return zlib.compress(data)
+    return lzma.compress(data)
+
+
+def _decompress(compression: StreamCompression, data: bytes) -> bytes:
+    if compression == StreamCompression.ZLIB:
+        return zlib.decompress(data)
+    return lzma.decompress(data)
+
+
+def _read_at(file: IO[bytes], num_bytes: int) -> bytes:
+    data = file.read(num_bytes)
+    if len(data) != num_bytes:
+        raise EOFError(f"Expected {num_bytes} bytes, got {len(data)}")
+    return data
+
+
+def _read_table(file: IO[bytes]) -> list[tuple[int, int, int]] | None:
+    """The chunk table of a closed chunked stream, None without trailer."""
+    end = file.seek(0, io.SEEK_END)
+    if end < _HEADER.size + _TRAILER.size:
+        return None
+    file.seek(end - _TRAILER.size)
+    table_offset, num_chunks, _, magic = _TRAILER.unpack(file.read(_TRAILER.size))
+    if magic != MAGIC or table_offset + num_chunks * _TABLE_ENTRY.size != end - _TRAILER.size:
+        return None
+    file.seek(table_offset)
+    return list(_TABLE_ENTRY.iter_unpack(_read_at(file, num_chunks * _TABLE_ENTRY.size)))
+
+
+def _scan_chunks(file: IO[bytes]) -> list[tuple[int, int, int]]:
+    """The chunks of a chunked stream whose writer was not closed, by walking the chunk headers."""
+    end = file.seek(0, io.SEEK_END)
+    offset = _HEADER.size
+    table = []
+    while offset + _CHUNK_HEADER.size <= end:
+        file.seek(offset)
+        compressed_size, raw_size = _CHUNK_HEADER.unpack(file.read(_CHUNK_HEADER.size))
+        offset += _CHUNK_HEADER.size
+        if offset + compressed_size > end:
+            break
+        table.append((offset, compressed_size, raw_size))
+        offset += compressed_size
+    _log.warning(f"{file.name} has no chunk table, found {len(table)} complete chunks")
+    return table
+
+
+_HEADER: Final[Struct] = Struct("!4sBBHI")
+_CHUNK_HEADER: Final[Struct] = Struct("!II")
+_TABLE_ENTRY: Final[Struct] = Struct("!QII")
+_TRAILER: Final[Struct] = Struct("!QIQ4s")
+
+_CODEC_IDS: Final[dict[StreamCompression, int]] = {
+    StreamCompression.ZLIB: 1,
+    StreamCompression.LZMA: 2,
+}
+_CODECS: Final[dict[int, StreamCompression]] = {v: k for k, v in _CODEC_IDS.items()}
+_log = logging.getLogger(__name__)
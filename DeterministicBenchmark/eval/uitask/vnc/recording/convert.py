@@ -0,0 +1,143 @@
+"""
+This file converts the message streams of existing recordings to and from the compressed chunked
+format (see `recording.chunked`). Readers handle both formats, so a recording can be converted at
+any time after it was written:
+
+    convert-recording compress runs/ --codec lzma
+    convert-recording decompress runs/task-1/recording
+
+It also writes the columnar event logs of recordings (see `recording.eventlog`):
+
+    convert-recording events runs/
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO
+
+import typer
+
+from .chunked import (
+    CHUNK_SIZE,
+    ChunkedStreamWriter,
+    StreamCompression,
+    is_chunked,
+    open_message_stream,
+)
+from .eventlog import write_event_log
+from .segments import MANIFEST_FILENAME
+
+app = typer.Typer(help="Converts recordings to and from the compressed chunked format")
+
+
+@app.command()
+def compress(
+    paths: list[Path],
+    codec: StreamCompression = typer.Option(StreamCompression.ZLIB, help="Compression codec"),
+    chunk_size: int = typer.Option(CHUNK_SIZE, help="Uncompressed bytes per chunk"),
+) -> None:
+    """Compresses the message streams of the recordings in PATHS, searched recursively."""
+    for stream_path in _find_message_streams(paths):
+        if is_chunked(stream_path):
+            continue
+        converted_path = _converted_path(stream_path)
+        try:
+            with (
+                open(stream_path, "rb") as source,
+                ChunkedStreamWriter(converted_path, codec, chunk_size) as destination,
+            ):
+                shutil.copyfileobj(source, destination, chunk_size)
+            _replace(stream_path, converted_path)
+        finally:
+            converted_path.unlink(missing_ok=True)
+
+
+@app.command()
+def decompress(paths: list[Path]) -> None:
+    """Uncompresses the message streams of the recordings in PATHS, searched recursively."""
+    for stream_path in _find_message_streams(paths):
+        if not is_chunked(stream_path):
+            continue
+        converted_path = _converted_path(stream_path)
+        try:
+            with (
+                open_message_stream(stream_path) as source,
+                open(converted_path, "wb") as destination,
+            ):
+                shutil.copyfileobj(source, destination, CHUNK_SIZE)
+            _replace(stream_path, converted_path)
+        finally:
+            converted_path.unlink(missing_ok=True)
+
+
+@app.command()
+def events(paths: list[Path]) -> None:
+    """Writes the event logs of the recordings in PATHS, searched recursively."""
+    for recording_path in _find_recordings(paths):
+        try:
+            input_events, actions = write_event_log(recording_path)
+        except Exception as e:
+            _log.error(f"Cannot write the event log of {recording_path}: {e!r}")
+            continue
+        typer.echo(f"{recording_path}: {len(input_events)} events, {len(actions)} actions")
+
+
+def _find_recordings(paths: list[Path]) -> Iterator[Path]:
+    """
+    The recordings in `paths`, directories are searched recursively. A segmented recording is
+    found once, not its segments.
+    """
+    for path in paths:
+        segmented = {p.parent for p in path.rglob(MANIFEST_FILENAME)}
+        recordings = segmented | {
+            p.parent for p in path.rglob("server.time.bin") if p.parent.parent not in segmented
+        }
+        if not recordings:
+            _log.warning(f"No recordings found in {path}")
+        yield from sorted(recordings)
+
+
+def _find_message_streams(paths: list[Path]) -> Iterator[Path]:
+    """The message streams of the recordings in `paths`, directories are searched recursively."""
+    for path in paths:
+        recordings = sorted(p.parent for p in path.rglob("server.time.bin"))
+        if not recordings:
+            _log.warning(f"No recordings found in {path}")
+        for recording in recordings:
+            for name in ("client.rfb.bin", "server.rfb.bin"):
+                if (recording / name).exists():
+                    yield recording / name
+
+
+def _converted_path(stream_path: Path) -> Path:
+    return stream_path.with_name(f"{stream_path.name}.converting")
+
+
+def _replace(stream_path: Path, converted_path: Path) -> None:
+    """Replaces the stream by its converted version, once both read back the same bytes."""
+    with open_message_stream(stream_path) as a, open_message_stream(converted_path) as b:
+        if not _same_contents(a, b):
+            raise RuntimeError(f"Converting {stream_path} changed its contents")
+    size = stream_path.stat().st_size
+    os.replace(converted_path, stream_path)
+    typer.echo(f"{stream_path}: {size} -> {stream_path.stat().st_size} bytes")
+
+
+def _same_contents(a: IO[bytes], b: IO[bytes]) -> bool:
+    while True:
+        block = a.read(CHUNK_SIZE)
+        if block != b.read(CHUNK_SIZE):
+            return False
+        if not block:
+            return True
+
+
+_log = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,367 @@
+"""
+This file decimates the framebuffer updates of a recording while it is written: updates which
+arrive faster than a maximum frame rate, or which change too little of the screen, are not stored.
+The client stream, and thereby every input event, is stored unchanged.
+
+The decimator follows the live session with a `SessionMirror` and decodes its updates. Dropped
+updates are held back until the next stored one, which brings the decoder of the stored stream
+into the live state with the cheapest of: the dropped updates as they were, a repaint of the
+regions they changed (which also primes the Tight zlib streams they used, see
+`recording.keyframe.build_repaint`), or a keyframe. Pending updates are always resolved before an
+input event is recorded and when the recording ends, so the screen at every input event is the
+live one.
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Final
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..protocol import FramebufferState, SessionMirror
+from ..rfb_messages import Rectangle, ServerMessageKind, TightRect
+from .index import INPUT_EVENT_KINDS
+from .keyframe import build_keyframe, build_repaint
+
+# A recorded chunk: client side?, data, timestamp (nanoseconds)
+Record = tuple[bool, bytes, int]
+
+
+@dataclass(frozen=True)
+class DecimationPolicy:
+    """
+    Which framebuffer updates a recording keeps. An update is stored when both limits allow it,
+    otherwise its changes are carried over to the next stored update.
+    """
+
+    # At most this many stored updates per second, None for no limit
+    max_fps: float | None = None
+
+    # The screen changed since the last stored update must cover at least this fraction of the
+    # tiles of `tile_size` pixels
+    min_changed_fraction: float = 0.0
+    tile_size: int = 64
+
+
+@dataclass
+class DecimationStats:
+    """Counters of an `UpdateDecimator`"""
+
+    # Updates received and stored, a keyframe counts as one
+    updates: int = 0
+    stored_updates: int = 0
+
+    # Server bytes received and stored
+    num_bytes: int = 0
+    stored_bytes: int = 0
+
+    # How often dropped updates were replaced by a repaint of the regions they changed, or by a
+    # keyframe
+    repaints: int = 0
+    keyframes: int = 0
+
+
+class UpdateDecimator:
+    """
+    Filters the recorded chunks of both streams according to `policy`, see `filter`.
+    """
+
+    def __init__(self, policy: DecimationPolicy) -> None:
+        self.policy = policy
+        self.stats = DecimationStats()
+        # Frames the server messages, which are decoded one at a time
+        self._mirror = SessionMirror(decode=False)
+        # Chunks of the server message being received, and the number of messages received
+        self._incomplete: list[tuple[bytes, int]] = []
+        self._server_messages = 0
+        # Set once an update could not be decoded, everything is stored from then on
+        self._failed = False
+
+        # Updates dropped since the last stored one: whether there are any, their chunks as long
+        # as they are smaller than a keyframe (None once they are not), and the time of the last
+        self._has_dropped = False
+        self._dropped: list[tuple[bytes, int]] | None = []
+        self._dropped_updates = 0
+        self._dropped_bytes = 0
+        self._dropped_at = 0
+        # The Tight zlib histories before the first dropped update, those of the stored stream
+        self._stored_histories: tuple[bytes | None, ...] = ()
+        # Size of the last keyframe
+        self._keyframe_size: int | None = None
+
+        # Tiles and rectangles changed since the last stored update (the latter None once there
+        # are too many to repaint them one by one), and its time
+        self._changed_tiles: NDArray[np.bool_] | None = None
+        self._changed_rects: set[tuple[int, int, int, int]] | None = set()
+        self._stored_at: int | None = None
+
+    def filter(self, client: bool, data: bytes, timestamp_ns: int) -> list[Record]:
+        """
+        Returns:
+            The chunks to store in place of a recorded one, in order.
+        """
+        if client:
+            return self._filter_client(data, timestamp_ns)
+        return self._filter_server(data, timestamp_ns)
+
+    def finish(self) -> list[Record]:
+        """Returns the chunks still to store when the recording ends."""
+        records = self._resolve_dropped()
+        records.extend(self._store(self._incomplete, 0))
+        self._incomplete = []
+        if self.stats.updates:
+            _log.info(
+                f"Stored {self.stats.stored_updates} of {self.stats.updates} updates, "
+                f"{self.stats.stored_bytes} of {self.stats.num_bytes} server bytes, "
+                f"with {self.stats.repaints} repaints and {self.stats.keyframes} keyframes"
+            )
+        return records
+
+    def _filter_client(self, data: bytes, timestamp_ns: int) -> list[Record]:
+        messages = self._mirror.feed_client(data)
+        records = []
+        # The screen at an input event is the live one
+        if self._mirror.session is not None and any(
+            message[0] in INPUT_EVENT_KINDS for message in messages
+        ):
+            records = self._resolve_dropped()
+        records.append((True, data, timestamp_ns))
+        return records
+
+    def _filter_server(self, data: bytes, timestamp_ns: int) -> list[Record]:
+        self.stats.num_bytes += len(data)
+        messages = self._mirror.feed_server(data)
+        self._incomplete.append((data, timestamp_ns))
+
+        records = []
+        for message in messages:
+            chunks = self._split_incomplete(len(message))
+            self._server_messages += 1
+            session = self._mirror.session
+            if (
+                self._mirror.failed
+                or self._failed
+                or session is None
+                or self._server_messages <= self._mirror.server_handshake_messages
+            ):
+                records.extend(self._resolve_dropped())
+                records.extend(self._store(chunks, 0))
+                continue
+
+            framebuffer = session.framebuffer
+            cursor = framebuffer.cursor
+            histories = _zlib_histories(framebuffer)
+            try:
+                session.handle_server_message(session.parse_server_message(BytesIO(message)))
+            except Exception as e:
+                _log.warning(
+                    f"Cannot decode the recorded session, it is no longer decimated: {e!r}"
+                )
+                self._failed = True
+                records.extend(self._resolve_dropped())
+                records.extend(self._store(chunks, 0))
+                continue
+            if message[0] != ServerMessageKind.FRAMEBUFFER_UPDATE.value:
+                # Other messages are stored as they are
+                records.extend(self._resolve_dropped())
+                records.extend(self._store(chunks, 0))
+                continue
+
+            self.stats.updates += 1
+            timestamp = chunks[0][1]
+            changed = self._mark_changed(framebuffer.width, framebuffer.height, framebuffer.damage)
+            # Cursor shapes are always stored
+            cursor_changed = framebuffer.cursor is not cursor
+            if cursor_changed or self._keeps(timestamp, changed):
+                records.extend(self._resolve_dropped(chunks, cursor_changed))
+                self._stored_at = timestamp
+            else:
+                self._drop(chunks, histories)
+        return records
+
+    def _keeps(self, timestamp: int, changed: float) -> bool:
+        max_fps = self.policy.max_fps
+        if (
+            max_fps is not None
+            and self._stored_at is not None
+            and timestamp - self._stored_at < 1e9 / max_fps
+        ):
+            return False
+        return changed >= self.policy.min_changed_fraction
+
+    def _drop(self, chunks: list[tuple[bytes, int]], histories: tuple[bytes | None, ...]) -> None:
+        if not self._has_dropped:
+            self._stored_histories = histories
+        self._has_dropped = True
+        self._dropped_at = chunks[-1][1]
+        if self._dropped is None:
+            return
+        self._dropped.extend(chunks)
+        self._dropped_updates += 1
+        self._dropped_bytes += sum(len(data) for data, _ in chunks)
+        if self._keyframe_size is None:
+            self._keyframe_size = len(self._build_keyframe())
+        if self._dropped_bytes > self._keyframe_size:
+            # A keyframe will be smaller than the dropped updates, which are not needed anymore
+            self._dropped = None
+
+    def _resolve_dropped(
+        self, chunks: list[tuple[bytes, int]] | None = None, cursor_changed: bool = False
+    ) -> list[Record]:
+        """
+        The chunks which bring the stored stream up to date, ending with the `chunks` of the update
+        just decoded if it is stored.
+        """
+        if not self._has_dropped:
+            self._changed_tiles = None
+            self._changed_rects = set()
+            return self._store(chunks or [], 1 if chunks else 0)
+
+        # A repaint or a keyframe reproduces the state after the decoded update, and replaces it.
+        # The repaint is not built when its pixels alone are larger than a keyframe.
+        regions = self._changed_regions()
+        repaint: bytes | None = None
+        if self._keyframe_size is None or _raw_size(regions) <= self._keyframe_size:
+            repaint = self._build_repaint(regions, cursor_changed)
+        held_bytes = self._dropped_bytes + sum(len(data) for data, _ in chunks or [])
+        timestamp = chunks[0][1] if chunks else self._dropped_at
+        if self._dropped is not None and (repaint is None or held_bytes <= len(repaint)):
+            # Cheaper than a repaint, the dropped updates are written after all
+            dropped = self._dropped + (chunks or [])
+            records = self._store(dropped, self._dropped_updates + (1 if chunks else 0))
+        elif repaint is not None and (
+            self._keyframe_size is None or len(repaint) <= self._keyframe_size
+        ):
+            records = self._store([(repaint, timestamp)], 1)
+            self.stats.repaints += 1
+        else:
+            keyframe = self._build_keyframe()
+            self._keyframe_size = len(keyframe)
+            records = self._store([(keyframe, timestamp)], 1)
+            self.stats.keyframes += 1
+
+        self._has_dropped = False
+        self._changed_tiles = None
+        self._changed_rects = set()
+        self._dropped = []
+        self._dropped_updates = 0
+        self._dropped_bytes = 0
+        return records
+
+    def _build_repaint(self, regions: list[tuple[int, int, int, int]], cursor: bool) -> bytes:
+        """A repaint of `regions`, which primes the zlib streams the dropped updates moved on."""
+        assert self._mirror.session is not None
+        framebuffer = self._mirror.session.framebuffer
+        histories = _zlib_histories(framebuffer)
+        stale_streams = [
+            stream_id
+            for stream_id, history in enumerate(histories)
+            if history is not self._stored_histories[stream_id]
+        ]
+        return build_repaint(framebuffer, regions, stale_streams, cursor)
+
+    def _build_keyframe(self) -> bytes:
+        assert self._mirror.session is not None
+        return build_keyframe(self._mirror.session.framebuffer)
+
+    def _store(self, chunks: list[tuple[bytes, int]], updates: int) -> list[Record]:
+        self.stats.stored_updates += updates
+        self.stats.stored_bytes += sum(len(data) for data, _ in chunks)
+        return [(False, data, timestamp) for data, timestamp in chunks]
+
+    def _split_incomplete(self, num_bytes: int) -> list[tuple[bytes, int]]:
+        """
+        Takes the chunks holding the first `num_bytes` bytes of `_incomplete`, a chunk which
+        continues is split.
+        """
+        chunks = []
+        while num_bytes:
+            data, timestamp = self._incomplete.pop(0)
+            if len(data) > num_bytes:
+                self._incomplete.insert(0, (data[num_bytes:], timestamp))
+                data = data[:num_bytes]
+            chunks.append((data, timestamp))
+            num_bytes -= len(data)
+        return chunks
+
+    def _mark_changed(self, width: int, height: int, damage: tuple[Rectangle, ...]) -> float:
+        """
+        Adds `damage` to the tiles and rectangles changed since the last stored update, and returns
+        the fraction of the screen the tiles cover.
+        """
+        tile_size = self.policy.tile_size
+        shape = (-(-height // tile_size), -(-width // tile_size))
+        if self._changed_tiles is None or self._changed_tiles.shape != shape:
+            self._changed_tiles = np.zeros(shape, dtype=np.bool_)
+        for rect in damage:
+            if rect.width and rect.height:
+                self._changed_tiles[
+                    rect.y // tile_size : -(-(rect.y + rect.height) // tile_size),
+                    rect.x // tile_size : -(-(rect.x + rect.width) // tile_size),
+                ] = True
+                if self._changed_rects is not None:
+                    self._changed_rects.add((rect.x, rect.y, rect.width, rect.height))
+        if self._changed_rects is not None and len(self._changed_rects) > _MAX_CHANGED_RECTS:
+            self._changed_rects = None
+        return float(self._changed_tiles.mean())
+
+    def _changed_regions(self) -> list[tuple[int, int, int, int]]:
+        """
+        The regions changed since the last stored update: the changed rectangles which do not lie
+        within another one, or runs of changed tiles once there are too many rectangles.
+        """
+        if self._changed_rects is not None:
+            rects = self._changed_rects
+            return [
+                rect
+                for rect in rects
+                if not any(other != rect and _contains(other, rect) for other in rects)
+            ]
+
+        assert self._mirror.session is not None and self._changed_tiles is not None
+        framebuffer = self._mirror.session.framebuffer
+        tile_size = self.policy.tile_size
+        regions = []
+        for row, tiles in enumerate(self._changed_tiles):
+            y = row * tile_size
+            height = min(tile_size, framebuffer.height - y)
+            # Runs of changed tiles start where a tile differs from its left neighbour
+            edges = np.flatnonzero(np.diff(tiles, prepend=False, append=False))
+            for start, end in zip(edges[::2], edges[1::2]):
+                x = int(start) * tile_size
+                width = min(int(end) * tile_size, framebuffer.width) - x
+                regions.append((x, y, width, height))
+        return regions
+
+
+def _zlib_histories(framebuffer: FramebufferState) -> tuple[bytes | None, ...]:
+    return tuple(
+        framebuffer.zlib_history(stream_id) for stream_id in range(TightRect.NUM_ZLIB_STREAMS)
+    )
+
+
+def _raw_size(regions: list[tuple[int, int, int, int]]) -> int:
+    """The size of the pixels of `regions` as raw rectangles, 4 bytes per pixel."""
+    return sum(width * height * 4 for _, _, width, height in regions)
+
+
+def _contains(outer: tuple[int, int, int, int], inner: tuple[int, int, int, int]) -> bool:
+    """Whether the rectangle `inner` (x, y, width, height) lies within `outer`."""
+    x, y, width, height = outer
+    inner_x, inner_y, inner_width, inner_height = inner
+    return (
+        x <= inner_x
+        and y <= inner_y
+        and inner_x + inner_width <= x + width
+        and inner_y + inner_height <= y + height
+    )
+
+
+# Changed rectangles a repaint sends one by one, more are merged into runs of tiles
+_MAX_CHANGED_RECTS: Final[int] = 64
+
+_log = logging.getLogger(__name__)
@@ -0,0 +1,258 @@
+"""
+This file converts the input events of a recording, and the actions derived from them (see
+`RfbTraceToRawActionsProcessor`), into columnar event logs: numpy structured arrays saved next to
+the recording as `events.npy` and `actions.npy`.
+
+The logs are memory-mappable, so queries across many recordings, e.g. click positions or typing
+speed, are vectorized operations instead of replays:
+
+    events = np.load(recording_path / EVENTS_FILENAME, mmap_mode="r")
+    clicks = events[(events["kind"] == POINTER_EVENT) & (events["buttons"] != 0)]
+
+Only the client stream is parsed, the server stream is read up to the end of the handshake.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from io import BytesIO
+from pathlib import Path
+from typing import Final
+
+import numpy as np
+
+from uitask.models.display import ScrollActionDirection
+
+from ..keysymdef import X11Key
+from ..protocol import SessionMirror
+from ..rfb_messages import (
+    ClientMessageKind,
+    KeyEvent,
+    MouseButtons,
+    PointerEvent,
+    QemuExtendedKeyEvent,
+    parse_client_message,
+)
+from .actions import (
+    ActionReplayStep,
+    KeyboardShortcutAction,
+    KeyPressAction,
+    MouseClickAction,
+    MouseDoubleClickAction,
+    MouseDragAction,
+    MouseMoveAction,
+    MouseScrollAction,
+    MouseTripleClickAction,
+    TypeAction,
+)
+from .chunked import open_message_stream
+from .process_rfb import RfbTraceToRawActionsProcessor
+from .replay import RfbReplayEvent
+from .segments import segment_paths
+
+EVENTS_FILENAME: Final[str] = "events.npy"
+ACTIONS_FILENAME: Final[str] = "actions.npy"
+
+# `kind` of the events, the RFB message type
+KEY_EVENT: Final[int] = ClientMessageKind.KEY_EVENT.value
+POINTER_EVENT: Final[int] = ClientMessageKind.POINTER_EVENT.value
+
+# An input event: a pointer event has `x`, `y` and `buttons`, a key event `keysym` and `is_down`
+EVENT_DTYPE: Final[np.dtype] = np.dtype(
+    [
+        ("ts_ns", "<u8"),
+        ("kind", "u1"),
+        ("x", "<u2"),
+        ("y", "<u2"),
+        ("buttons", "u1"),
+        ("keysym", "<u4"),
+        ("is_down", "?"),
+    ]
+)
+
+# An action, `kind` is its `ActionKind` value. Mouse actions have a position (a drag's start, its
+# end in `end_x`, `end_y`) and `buttons`, a scroll the button of its direction and `num_repeats`, a
+# key press `keysym`, typing and shortcuts the number of keys in `num_keys`.
+ACTION_DTYPE: Final[np.dtype] = np.dtype(
+    [
+        ("ts_ns", "<u8"),
+        ("kind", "S16"),
+        ("x", "<u2"),
+        ("y", "<u2"),
+        ("end_x", "<u2"),
+        ("end_y", "<u2"),
+        ("buttons", "u1"),
+        ("keysym", "<u4"),
+        ("num_repeats", "<u4"),
+        ("num_keys", "<u4"),
+    ]
+)
+
+
+def read_input_events(recording_path: Path) -> np.ndarray:
+    """
+    The input events of the recording in `recording_path` in order, across the segments of a
+    segmented recording, as an `EVENT_DTYPE` array. Their timestamps are those the replay gives
+    them; bytes written without timestamp, by a writer which did not close, are left out. The
+    `PointerEvent` a segment starts with is left out too when it only puts the pointer back where
+    the previous segment left it (see `RecordingSegmenter.start_segment`).
+    """
+    events = [np.zeros(0, EVENT_DTYPE)]
+    pointer: tuple[int, int, int] | None = None  # x, y, buttons of the last pointer event
+    for i, path in enumerate(segment_paths(recording_path)):
+        segment_events = _read_segment_input_events(path)
+        pointers = segment_events[segment_events["kind"] == POINTER_EVENT][["x", "y", "buttons"]]
+        if not len(pointers):
+            events.append(segment_events)
+            continue
+        first = np.flatnonzero(segment_events["kind"] == POINTER_EVENT)[0]
+        if i > 0 and pointers[0].tolist() == pointer:
+            segment_events = np.delete(segment_events, first)
+        pointer = pointers[-1].tolist()
+        events.append(segment_events)
+    return np.concatenate(events)
+
+
+def derive_actions(events: np.ndarray) -> list[ActionReplayStep]:
+    """The actions of the input events in `events` (an `EVENT_DTYPE` array)."""
+    processor = RfbTraceToRawActionsProcessor()
+    actions: list[ActionReplayStep] = []
+    for ts_ns, kind, x, y, buttons, keysym, is_down in events.tolist():
+        if kind == KEY_EVENT:
+            event: KeyEvent | PointerEvent = KeyEvent(key=X11Key(keysym), is_down=is_down)
+        else:
+            event = PointerEvent(buttons=MouseButtons(buttons), x=x, y=y)
+        actions.extend(processor.feed(RfbReplayEvent(timestamp=ts_ns, event=event)))
+    actions.extend(processor.flush())
+    return actions
+
+
+def actions_to_array(actions: Iterable[ActionReplayStep]) -> np.ndarray:
+    """The actions as an `ACTION_DTYPE` array."""
+    actions = list(actions)
+    array = np.zeros(len(actions), dtype=ACTION_DTYPE)
+    array["ts_ns"] = [action.timestamp_ns for action in actions]
+    array["kind"] = [action.event.action_kind.value.encode() for action in actions]
+    for i, action in enumerate(actions):
+        event = action.event
+        match event:
+            case KeyPressAction():
+                array["keysym"][i] = event.key.value
+            case TypeAction() | KeyboardShortcutAction():
+                array["num_keys"][i] = len(event.keys)
+            case MouseMoveAction():
+                array["x"][i], array["y"][i] = event.position.x, event.position.y
+            case MouseClickAction() | MouseDoubleClickAction() | MouseTripleClickAction():
+                array["x"][i], array["y"][i] = event.position.x, event.position.y
+                array["buttons"][i] = event.buttons.value
+            case MouseDragAction():
+                array["x"][i], array["y"][i] = event.start_x, event.start_y
+                array["end_x"][i], array["end_y"][i] = event.end_x, event.end_y
+                array["buttons"][i] = event.buttons.value
+            case MouseScrollAction():
+                array["x"][i], array["y"][i] = event.position.x, event.position.y
+                array["buttons"][i] = _SCROLL_BUTTONS[event.direction].value
+                array["num_repeats"][i] = event.num_repeats
+    return array
+
+
+def write_event_log(recording_path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Writes the input events and the actions of the recording in `recording_path` into
+    `EVENTS_FILENAME` and `ACTIONS_FILENAME` next to it.
+
+    Returns:
+        The events and the actions.
+    """
+    events = read_input_events(recording_path)
+    actions = actions_to_array(derive_actions(events))
+    np.save(recording_path / EVENTS_FILENAME, events)
+    np.save(recording_path / ACTIONS_FILENAME, actions)
+    return events, actions
+
+
+def load_event_log(recording_path: Path) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Maps the input events and the actions written by `write_event_log` into memory, None if the
+    recording has no event log.
+    """
+    events_path = recording_path / EVENTS_FILENAME
+    actions_path = recording_path / ACTIONS_FILENAME
+    if not events_path.exists() or not actions_path.exists():
+        return None
+    return np.load(events_path, mmap_mode="r"), np.load(actions_path, mmap_mode="r")
+
+
+def _read_segment_input_events(recording_path: Path) -> np.ndarray:
+    """The input events of a recording which is not segmented, see `read_input_events`."""
+    handshake_length = _client_handshake_length(recording_path)
+    with open_message_stream(recording_path / "client.rfb.bin") as f:
+        f.seek(handshake_length)
+        client_messages = BytesIO(f.read())
+
+    offsets = []
+    rows = []
+    while True:
+        offset = client_messages.tell()
+        try:
+            message = parse_client_message(client_messages)
+        except EOFError:
+            break
+        match message:
+            case PointerEvent():
+                rows.append((0, POINTER_EVENT, message.x, message.y, message.buttons.value, 0, 0))
+            case KeyEvent():
+                rows.append((0, KEY_EVENT, 0, 0, 0, message.key.value, message.is_down))
+            case QemuExtendedKeyEvent():
+                rows.append((0, KEY_EVENT, 0, 0, 0, message.keysym.value, message.is_down))
+            case _:
+                continue
+        offsets.append(handshake_length + offset)
+
+    # Like the replay, a message gets the timestamp of the chunk its first byte was recorded in
+    timestamps, lengths = _read_timestamps(recording_path / "client.time.bin")
+    chunks = np.searchsorted(lengths, np.array(offsets, dtype=np.uint64), side="right")
+    annotated = chunks < len(lengths)
+    events = np.array(rows, dtype=EVENT_DTYPE)[annotated]
+    events["ts_ns"] = timestamps[chunks[annotated]]
+    return events
+
+
+def _client_handshake_length(recording_path: Path) -> int:
+    """The number of bytes the handshake takes at the start of `client.rfb.bin`."""
+    mirror = SessionMirror(decode=False)
+    with (
+        open_message_stream(recording_path / "client.rfb.bin") as client,
+        open_message_stream(recording_path / "server.rfb.bin") as server,
+    ):
+        client_messages = mirror.feed_client(client.read(_HANDSHAKE_READ_SIZE))
+        while mirror.session is None and not mirror.failed:
+            data = server.read(_HANDSHAKE_READ_SIZE)
+            if not data:
+                break
+            mirror.feed_server(data)
+        client_messages += mirror.feed_client(b"")
+    if mirror.session is None:
+        raise ValueError(f"Cannot follow the handshake of the recording in {recording_path}")
+    return sum(len(message) for message in client_messages[: mirror.client_handshake_messages])
+
+
+def _read_timestamps(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The timestamps and cumulative lengths of the annotations in a `<source>.time.bin`, see
+    `TimestampAnnotation`. An annotation cut off at the end of the file is ignored.
+    """
+    data = path.read_bytes()
+    annotations = np.frombuffer(data, dtype=">u8", count=len(data) // 16 * 2).reshape(-1, 2)
+    return annotations[:, 0].astype(np.uint64), annotations[:, 1].astype(np.uint64)
+
+
+# The handshake takes a few dozen bytes, the streams are read in steps of this size until it ended
+_HANDSHAKE_READ_SIZE: Final[int] = 256
+
+_SCROLL_BUTTONS: Final[dict[ScrollActionDirection, MouseButtons]] = {
+    ScrollActionDirection.UP: MouseButtons.SCROLL_UP,
+    ScrollActionDirection.DOWN: MouseButtons.SCROLL_DOWN,
+    ScrollActionDirection.LEFT: MouseButtons.SCROLL_LEFT,
+    ScrollActionDirection.RIGHT: MouseButtons.SCROLL_RIGHT,
+}
@@ -0,0 +1,252 @@
+"""
+This file writes and reads the message index of a recording: the position, kind and timestamp of
+every RFB message of both streams after the handshake, written while the session is recorded (see
+`RfbRecordingWriter(index=True)`).
+
+Post-processing finds the framebuffer updates and input events of a recording in the index, and
+reads single messages at their offsets, instead of parsing and decoding the streams to discover
+them.
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import threading
+from collections.abc import Iterator
+from dataclasses import dataclass
+from enum import IntEnum
+from io import BytesIO
+from pathlib import Path
+from struct import Struct
+from typing import IO, ClassVar, Final
+
+from ..protocol import SessionMirror
+from ..rfb_messages import (
+    ClientMessageKind,
+    KeyEvent,
+    PointerEvent,
+    QemuExtendedKeyEvent,
+    ServerMessageKind,
+    parse_client_message,
+)
+
+MESSAGE_INDEX_FILENAME: Final[str] = "messages.index.bin"
+
+# The message-type bytes of the client messages which are input events, see `read_input_event`
+INPUT_EVENT_KINDS: Final[frozenset[int]] = frozenset(
+    (
+        ClientMessageKind.KEY_EVENT.value,
+        ClientMessageKind.POINTER_EVENT.value,
+        ClientMessageKind.QEMU.value,
+    )
+)
+
+
+class MessageSource(IntEnum):
+    CLIENT = 0
+    SERVER = 1
+
+
+@dataclass(frozen=True)
+class MessageIndexEntry:
+    """
+    An RFB message of a recording.
+    """
+
+    # The timestamp of the recorded chunk which contains the first byte of the message, the one
+    # `RfbReplayStreams` replays the message at
+    timestamp: int  # u64, nanoseconds
+
+    source: MessageSource  # u8
+
+    # The message-type byte
+    kind: int  # u8
+
+    # Position and size of the message in `<source>.rfb.bin`
+    offset: int  # u64
+    length: int  # u32
+
+    # Serialized format
+    _STRUCT: ClassVar[Struct] = Struct("!QBBQI")
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.length
+
+    @property
+    def is_framebuffer_update(self) -> bool:
+        return (
+            self.source == MessageSource.SERVER
+            and self.kind == ServerMessageKind.FRAMEBUFFER_UPDATE.value
+        )
+
+    @property
+    def is_input_event(self) -> bool:
+        """Whether the message is a key or pointer event, see `read_input_event`."""
+        return self.source == MessageSource.CLIENT and self.kind in INPUT_EVENT_KINDS
+
+    def to_bytes(self) -> bytes:
+        return self._STRUCT.pack(self.timestamp, self.source, self.kind, self.offset, self.length)
+
+
+@dataclass
+class MessageIndex:
+    """
+    The message index of a recording, see `MessageIndexWriter`.
+    """
+
+    entries: list[MessageIndexEntry]
+
+    @classmethod
+    def from_file(cls, recording_path: Path) -> MessageIndex | None:
+        """
+        Reads the index of the recording in `recording_path`, None if it was recorded without one.
+        """
+        path = recording_path / MESSAGE_INDEX_FILENAME
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        entry_struct = MessageIndexEntry._STRUCT
+        num_bytes = len(data) - len(data) % entry_struct.size
+        return cls(
+            [
+                MessageIndexEntry(timestamp, MessageSource(source), kind, offset, length)
+                for timestamp, source, kind, offset, length in entry_struct.iter_unpack(
+                    data[:num_bytes]
+                )
+            ]
+        )
+
+    def iter_replay_order(self) -> Iterator[MessageIndexEntry]:
+        """
+        Iterates the messages in the order `RfbReplayStreams` replays them: the streams are
+        merged by timestamp, a client message goes first on equal timestamps.
+        """
+
+        def stream(source: MessageSource) -> Iterator[tuple[int, int, int, MessageIndexEntry]]:
+            # Like the replay, the merge only compares the next message of each stream
+            priority = 0 if source == MessageSource.CLIENT else 1
+            return (
+                (entry.timestamp, priority, i, entry)
+                for i, entry in enumerate(self.entries)
+                if entry.source == source
+            )
+
+        for *_, entry in heapq.merge(stream(MessageSource.CLIENT), stream(MessageSource.SERVER)):
+            yield entry
+
+    def iter_replay_steps(self) -> Iterator[MessageIndexEntry]:
+        """
+        Iterates the messages `RfbReplayParser.iter_steps(continuous=True)` yields steps for, in
+        the same order.
+        """
+        for entry in self.iter_replay_order():
+            if entry.is_framebuffer_update or entry.is_input_event:
+                yield entry
+
+
+def read_input_event(
+    client_messages: IO[bytes], entry: MessageIndexEntry
+) -> KeyEvent | PointerEvent:
+    """
+    Reads the input event of `entry` from `client.rfb.bin`. A `QemuExtendedKeyEvent` is converted
+    to a `KeyEvent` like `RfbReplayParser.iter_steps` does.
+    """
+    assert entry.is_input_event
+    client_messages.seek(entry.offset)
+    message = parse_client_message(BytesIO(client_messages.read(entry.length)))
+    match message:
+        case QemuExtendedKeyEvent():
+            return KeyEvent(key=message.keysym, is_down=message.is_down)
+        case KeyEvent() | PointerEvent():
+            return message
+        case _:
+            raise ValueError(f"Not an input event at client offset {entry.offset}: {message}")
+
+
+class MessageIndexWriter:
+    """
+    Indexes the messages of a recording while its bytes are recorded. A `SessionMirror` without
+    `decode` follows the session, so only message headers are parsed.
+
+    If the mirror loses track of the session, the index is deleted on `close` and post-processing
+    parses the streams instead.
+    """
+
+    def __init__(self, output_dir: Path) -> None:
+        self._path = output_dir / MESSAGE_INDEX_FILENAME
+        self._file = open(self._path, "wb")
+        self._mirror = SessionMirror(decode=False)
+        self._streams = {source: _IndexedStream() for source in MessageSource}
+        # The writers record the client and the server stream on different threads
+        self._lock = threading.Lock()
+
+    def add(self, source: MessageSource, data: bytes, timestamp_ns: int) -> None:
+        """Indexes the messages completed by `data`, recorded at `timestamp_ns`."""
+        with self._lock:
+            if self._mirror.failed:
+                return
+            stream = self._streams[source]
+            if stream.recorded == stream.indexed:
+                stream.pending_since = timestamp_ns
+            stream.recorded += len(data)
+
+            if source == MessageSource.CLIENT:
+                messages = self._mirror.feed_client(data)
+            else:
+                messages = self._mirror.feed_server(data)
+            if self._mirror.failed:
+                return
+
+            entries = []
+            num_handshake_messages = _handshake_messages(self._mirror, source)
+            for i, message in enumerate(messages):
+                # The handshake is not indexed, replay parses it anyway
+                if self._mirror.session is not None and stream.messages >= num_handshake_messages:
+                    entries.append(
+                        MessageIndexEntry(
+                            # Only the first message can have started in an earlier chunk
+                            timestamp=stream.pending_since if i == 0 else timestamp_ns,
+                            source=source,
+                            kind=message[0],
+                            offset=stream.indexed,
+                            length=len(message),
+                        ).to_bytes()
+                    )
+                stream.messages += 1
+                stream.indexed += len(message)
+            if messages:
+                stream.pending_since = timestamp_ns
+            self._file.write(b"".join(entries))
+
+    def fsync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+        if self._mirror.failed:
+            _log.warning(f"Deleting the message index {self._path}, the session was not followed")
+            self._path.unlink(missing_ok=True)
+
+
+@dataclass
+class _IndexedStream:
+    # Bytes recorded, bytes of complete messages and their number
+    recorded: int = 0
+    indexed: int = 0
+    messages: int = 0
+    # The timestamp of the chunk with the first byte of the incomplete message
+    pending_since: int = 0
+
+
+def _handshake_messages(mirror: SessionMirror, source: MessageSource) -> int:
+    if source == MessageSource.CLIENT:
+        return mirror.client_handshake_messages
+    return mirror.server_handshake_messages
+
+
+_log = logging.getLogger(__name__)
@@ -0,0 +1,190 @@
+"""
+This file synthesizes keyframes: server messages which bring a freshly connected RFB session into
+the state of a live one, so a recording can start in the middle of a connection.
+
+A keyframe is a single `FramebufferUpdate` with
+
+1. the whole screen as Tight rectangles (copy filter, zlib stream 0),
+2. for every Tight zlib stream in use, a "priming" rectangle whose zlib data decompresses to the
+   tail of the stream's output, so that back-references in later server data resolve exactly as
+   in the live decompressor (the window of a decompressor only depends on its output, so the
+   priming data itself is compressed),
+3. raw rectangles repainting the screen area the priming rectangles drew over,
+4. the cursor shape, if the server set one.
+
+A repaint (`build_repaint`) is the same without the screen: it only sends the regions which
+changed, and primes only the zlib streams which moved on, for a session that fell behind a little.
+"""
+
+from __future__ import annotations
+
+import math
+import zlib
+from collections.abc import Iterable
+from struct import Struct
+from typing import Final
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..protocol import ZLIB_WINDOW_SIZE, FramebufferState
+from ..rfb_messages import Encoding, ServerMessageKind, TightRect
+
+# Tight rectangles can be at most 2048 pixels wide
+TIGHT_MAX_WIDTH: Final[int] = 2048
+
+# Uncompressed size of the Tight rectangles the screen is split into
+KEYFRAME_BAND_SIZE: Final[int] = 1 << 20
+
+_HEADER_STRUCT: Final[Struct] = Struct("!BxH")
+_RECT_STRUCT: Final[Struct] = Struct("!HHHHi")
+
+# Tight compression control: basic compression (copy filter) on a stream / fill compression
+_TIGHT_BASIC: Final[int] = 0x00
+_TIGHT_FILL: Final[int] = 0x80
+
+
+def build_keyframe(framebuffer: FramebufferState) -> bytes:
+    """
+    Serializes a `FramebufferUpdate` which reproduces `framebuffer` (pixels, cursor and Tight zlib
+    streams) in a session that has not received any update yet, or any earlier state.
+
+    Returns:
+        The message, including the message-type byte.
+    """
+    width, height = framebuffer.width, framebuffer.height
+    pixels = framebuffer.get_array(0, 0, width, height)
+    rects: list[bytes] = []
+
+    # 1. The screen, in bands of full rows, through zlib stream 0 which is reset first
+    all_streams = (1 << TightRect.NUM_ZLIB_STREAMS) - 1
+    compressor = zlib.compressobj()
+    for x in range(0, width, TIGHT_MAX_WIDTH):
+        band_width = min(TIGHT_MAX_WIDTH, width - x)
+        band_height = max(1, KEYFRAME_BAND_SIZE // (band_width * 3))
+        for y in range(0, height, band_height):
+            band = pixels[y : y + band_height, x : x + band_width]
+            data = compressor.compress(band.tobytes()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            control = _TIGHT_BASIC | (all_streams if not rects else 0)
+            rects.append(_tight_rect(x, y, band.shape[1], band.shape[0], control, data))
+
+    # 2. Prime the zlib streams used by the server, over the top left corner of the screen, and
+    # 3. repaint what the priming rectangles drew over, and reset the streams the server did not
+    # use yet (stream 0 still holds the screen data)
+    rects.extend(_sync_zlib_streams(framebuffer, range(TightRect.NUM_ZLIB_STREAMS)))
+
+    # 4. The cursor shape
+    if framebuffer.cursor is not None:
+        rects.append(_cursor_rect(np.asarray(framebuffer.cursor)))
+
+    header = _HEADER_STRUCT.pack(ServerMessageKind.FRAMEBUFFER_UPDATE.value, len(rects))
+    return header + b"".join(rects)
+
+
+def build_repaint(
+    framebuffer: FramebufferState,
+    regions: Iterable[tuple[int, int, int, int]],
+    stale_streams: Iterable[int],
+    cursor: bool = False,
+) -> bytes:
+    """
+    Serializes a `FramebufferUpdate` which brings a session into the state of `framebuffer` when
+    they only differ in the pixels of `regions` (x, y, width, height), the Tight zlib streams
+    `stale_streams` and, with `cursor`, the cursor shape. The regions are sent as raw rectangles,
+    so this is much smaller than a keyframe when little of the screen changed.
+
+    Returns:
+        The message, including the message-type byte.
+    """
+    rects = _sync_zlib_streams(framebuffer, stale_streams)
+    for x, y, width, height in regions:
+        rects.append(_raw_rect(x, y, framebuffer.get_array(x, y, width, height)))
+    if cursor and framebuffer.cursor is not None:
+        rects.append(_cursor_rect(np.asarray(framebuffer.cursor)))
+
+    header = _HEADER_STRUCT.pack(ServerMessageKind.FRAMEBUFFER_UPDATE.value, len(rects))
+    return header + b"".join(rects)
+
+
+def _sync_zlib_streams(framebuffer: FramebufferState, stream_ids: Iterable[int]) -> list[bytes]:
+    """
+    Tight rectangles which bring the zlib streams `stream_ids` into their state in `framebuffer`:
+    a stream in use is primed with its history over the top left corner of the screen, which is
+    repainted afterwards, the others are reset.
+    """
+    width, height = framebuffer.width, framebuffer.height
+    prime_width = min(width, TIGHT_MAX_WIDTH)
+    prime_rows = math.ceil(ZLIB_WINDOW_SIZE / (prime_width * 3))
+    rects: list[bytes] = []
+    unused_streams = 0
+    for stream_id in stream_ids:
+        history = framebuffer.zlib_history(stream_id)
+        if history is None:
+            unused_streams |= 1 << stream_id
+            continue
+        rects.extend(_priming_rects(stream_id, history, prime_width, prime_rows, height))
+
+    if rects:
+        restore = framebuffer.get_array(0, 0, prime_width, min(prime_rows, height))
+        rects.append(_raw_rect(0, 0, restore))
+    if unused_streams:
+        fill_control = _TIGHT_FILL | unused_streams
+        pixel = framebuffer.get_array(0, 0, 1, 1)[0, 0]
+        rects.append(_tight_rect(0, 0, 1, 1, fill_control, pixel.tobytes(), fill=True))
+    return rects
+
+
+def _priming_rects(
+    stream_id: int, history: bytes, width: int, rows: int, screen_height: int
+) -> list[bytes]:
+    """
+    Tight rectangles which restart zlib stream `stream_id` and fill its window with `history`.
+    Covers `rows` full rows of `width` pixels, split to fit the screen.
+    """
+    size = rows * width * 3
+    window = history[-size:].rjust(size, b"\x00")
+    compressor = zlib.compressobj()
+    rects = []
+    offset = 0
+    for y in range(0, rows, screen_height):
+        band_rows = min(screen_height, rows - y)
+        chunk = window[offset : offset + band_rows * width * 3]
+        offset += len(chunk)
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        control = _TIGHT_BASIC | (stream_id << 4) | (1 << stream_id if y == 0 else 0)
+        rects.append(_tight_rect(0, 0, width, band_rows, control, data))
+    return rects
+
+
+def _tight_rect(
+    x: int, y: int, width: int, height: int, control: int, data: bytes, fill: bool = False
+) -> bytes:
+    header = _RECT_STRUCT.pack(x, y, width, height, Encoding.TIGHT.value)
+    if fill:
+        return header + bytes((control,)) + data
+    return header + bytes((control,)) + _encode_varint(len(data)) + data
+
+
+def _raw_rect(x: int, y: int, pixels: NDArray[np.uint8]) -> bytes:
+    """A raw rectangle in the client's pixel format (32 bits per pixel, RGB in the low bytes)."""
+    height, width = pixels.shape[:2]
+    padded = np.zeros((height, width, 4), dtype=np.uint8)
+    padded[:, :, :3] = pixels
+    return _RECT_STRUCT.pack(x, y, width, height, Encoding.RAW.value) + padded.tobytes()
+
+
+def _cursor_rect(cursor: NDArray[np.uint8]) -> bytes:
+    """A cursor pseudo-rectangle for an RGBA cursor, opaque pixels make up the bitmask."""
+    height, width = cursor.shape[:2]
+    mask = np.packbits(cursor[:, :, 3] == 255, axis=1)
+    header = _RECT_STRUCT.pack(0, 0, width, height, Encoding.PSEUDO_CURSOR.value)
+    return header + np.ascontiguousarray(cursor).tobytes() + mask.tobytes()
+
+
+def _encode_varint(value: int) -> bytes:
+    """Inverse of `rfb_messages._decode_varint`, the compact length of Tight data."""
+    if value < 0x80:
+        return bytes((value,))
+    if value < 0x4000:
+        return bytes((value & 0x7F | 0x80, value >> 7))
+    return bytes((value & 0x7F | 0x80, (value >> 7) & 0x7F | 0x80, value >> 14))
@@ -0,0 +1,81 @@
+"""
+This file writes and reads the action markers of a recording: for every action an agent performs,
+its position in the action history (`execution.json`), its name and when it started and ended, on
+the clock of the recorded timestamps (`time.time_ns()`).
+
+Post-processing aligns the screenshots of an action with its marker, instead of reconstructing the
+actions from the recorded input events and matching them against the action history by order.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from struct import Struct
+from typing import ClassVar, Final
+
+MARKERS_FILENAME: Final[str] = "markers.bin"
+
+
+@dataclass(frozen=True)
+class ActionMarker:
+    """
+    An action of the agent, as recorded.
+    """
+
+    # Position of the action in the action history
+    index: int  # u32
+
+    # When the action started and ended
+    start: int  # u64, nanoseconds
+    end: int  # u64, nanoseconds
+
+    # The name of the action, e.g. "mouse_click"
+    name: str  # u8 length, UTF-8
+
+    # Serialized format, followed by the name
+    _STRUCT: ClassVar[Struct] = Struct("!IQQB")
+
+    def to_bytes(self) -> bytes:
+        name = self.name.encode("utf-8")[:255]
+        return self._STRUCT.pack(self.index, self.start, self.end, len(name)) + name
+
+
+def read_action_markers(recording_path: Path) -> list[ActionMarker] | None:
+    """
+    Reads the action markers of the recording in `recording_path`, None if it was recorded
+    without them. A marker cut off at the end of the file is ignored.
+    """
+    try:
+        data = (recording_path / MARKERS_FILENAME).read_bytes()
+    except FileNotFoundError:
+        return None
+    markers = []
+    header = ActionMarker._STRUCT
+    offset = 0
+    while offset + header.size <= len(data):
+        index, start, end, name_length = header.unpack_from(data, offset)
+        offset += header.size
+        if offset + name_length > len(data):
+            break
+        name = data[offset : offset + name_length].decode("utf-8", errors="replace")
+        offset += name_length
+        markers.append(ActionMarker(index=index, start=start, end=end, name=name))
+    return markers
+
+
+class ActionMarkerWriter:
+    """
+    Appends action markers to the recording in `recording_path`. Every marker is flushed as it is
+    added, actions are few and the file stays readable if the agent crashes.
+    """
+
+    def __init__(self, recording_path: Path) -> None:
+        self._file = open(recording_path / MARKERS_FILENAME, "wb")
+
+    def add(self, marker: ActionMarker) -> None:
+        self._file.write(marker.to_bytes())
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
@@ -1,12 +1,18 @@
 import json
 import logging
 import math
-from collections.abc import Iterable
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, field
 from enum import IntEnum
 from pathlib import Path
 from typing import Any, Final
 
+from PIL.Image import Image
+
 from uitask.models.display import Position, ScrollActionDirection
 from uitask.models.pointer import MouseClickType
 
@@ -24,7 +30,11 @@ from .actions import (
     MouseTripleClickAction,
     TypeAction,
 )
-from .replay import RfbReplayParser, RfbReplayStep, RfbReplayStreams
+from .chunked import open_message_stream
+from .index import MessageIndex, read_input_event
+from .markers import ActionMarker, read_action_markers
+from .replay import RfbReplayEvent, RfbReplayParser, RfbReplayStreams
+from .segments import segment_paths
 
 # Minimum delay to pick the "after" screenshot to allow UI to render (in ns)
 _MIN_AFTER_DELAY_NS: Final[int] = 1_000_000_000  # 1000 ms
@@ -36,6 +46,14 @@ _WAIT_AFTER_BUFFER_NS: Final[int] = 1_000_000_000  # 1000 ms
 _MULTI_CLICK_MAX_INTERVAL_NS: Final[int] = 50_000_000  # 50 ms
 _MULTI_CLICK_MAX_MOVE_PX: Final[int] = 4
 
+# Recordings with fewer server bytes are decoded in the exporting process by default, starting
+# the worker processes would take longer
+_PARALLEL_DECODE_MIN_BYTES: Final[int] = 64 << 20
+
+# Rendered screens waiting to be, or being, resized and encoded, at most. The replay waits for the
+# encoder threads beyond.
+_MAX_PENDING_FRAMES: Final[int] = 16
+
 
 _MODIFIER_KEYS: Final[set[X11Key]] = {
     X11Key.Alt_L,
@@ -96,7 +114,7 @@ class KeyboardState:
 @dataclass
 class ShortcutState:
     keys: list[X11Key] = field(default_factory=list)
-    first_modifier_step: RfbReplayStep | None = None  # TODO: Replace with timestamp
+    first_modifier_step: RfbReplayEvent | None = None  # TODO: Replace with timestamp
     currently_typing: bool = False
 
     def pop(self, key: X11Key) -> None:
@@ -181,6 +199,10 @@ class RfbTraceToRawActionsProcessor:
         - Mouse scrolls
         - Mouse moves
 
+    The steps are either pushed one at a time with `feed` and `flush`, which return the actions
+    as soon as they are final and only hold those later steps can still change, or all processed
+    by `run`.
+
     TODO:
         - Tests (round trip from recording)
     """
@@ -196,7 +218,7 @@ class RfbTraceToRawActionsProcessor:
     _last_event_type: LastEventType | None
     _start_timestamp_ns: int | None
 
-    def __init__(self, replay: Iterable[RfbReplayStep]) -> None:
+    def __init__(self, replay: Iterable[RfbReplayEvent] = ()) -> None:
         self.replay = replay
 
         self._processed_replay: list[ActionReplayStep] = []
@@ -214,29 +236,65 @@ class RfbTraceToRawActionsProcessor:
         self._start_timestamp_ns = None
 
     def run(self) -> list[ActionReplayStep]:
+        """Processes the steps of `replay`, returns all the actions."""
+        actions: list[ActionReplayStep] = []
         for step in self.replay:
-            if self._start_timestamp_ns is None:
-                self._start_timestamp_ns = step.timestamp
-            match step.event:
-                case None:
-                    pass
+            actions.extend(self.feed(step))
+        actions.extend(self.flush())
+        return actions
 
-                case KeyEvent(key=key, is_down=is_down):
-                    self._process_key_event(key=key, is_down=is_down, step=step)
-                    self._last_event_type = LastEventType.KEY_EVENT
+    def feed(self, step: RfbReplayEvent) -> list[ActionReplayStep]:
+        """
+        Processes the next step of the replay.
 
-                case PointerEvent(buttons=buttons, x=x, y=y):
-                    self._process_pointer_event(buttons=buttons, x=x, y=y, step=step)
-                    self._last_event_type = LastEventType.POINTER_EVENT
+        Returns:
+            The actions which became final with this step, in order.
+        """
+        if self._start_timestamp_ns is None:
+            self._start_timestamp_ns = step.timestamp
+        match step.event:
+            case None:
+                pass
+
+            case KeyEvent(key=key, is_down=is_down):
+                self._process_key_event(key=key, is_down=is_down, step=step)
+                self._last_event_type = LastEventType.KEY_EVENT
+
+            case PointerEvent(buttons=buttons, x=x, y=y):
+                self._process_pointer_event(buttons=buttons, x=x, y=y, step=step)
+                self._last_event_type = LastEventType.POINTER_EVENT
+
+        return self._take_final_actions()
 
+    def flush(self) -> list[ActionReplayStep]:
+        """
+        Ends the replay: completes the pending actions.
+
+        Returns:
+            The remaining actions, in order.
+        """
         self._check_and_process_type_action()
         self._check_and_process_mouse_move_action()
         self._check_and_process_mouse_click_action()
         self._flush_pending_scroll_action()
 
-        return self._processed_replay
+        actions = self._processed_replay
+        self._processed_replay = []
+        return actions
 
-    def _process_key_event(self, key: X11Key, is_down: bool, step: RfbReplayStep) -> None:
+    def _take_final_actions(self) -> list[ActionReplayStep]:
+        # Only the last action can still change: typing continues it, a click at its position
+        # replaces a mouse move
+        num_final = len(self._processed_replay)
+        if num_final and isinstance(
+            self._processed_replay[-1].event, (TypeAction, MouseMoveAction)
+        ):
+            num_final -= 1
+        actions = self._processed_replay[:num_final]
+        del self._processed_replay[:num_final]
+        return actions
+
+    def _process_key_event(self, key: X11Key, is_down: bool, step: RfbReplayEvent) -> None:
         if self._mouse_state.buttons != MouseButtons(0):
             raise ValueError("Can't do keyboard action while a mouse button is pressed.")
 
@@ -266,7 +324,7 @@ class RfbTraceToRawActionsProcessor:
         key: X11Key,
         is_down: bool,
         first_modifier_key: X11Key,
-        step: RfbReplayStep,
+        step: RfbReplayEvent,
     ) -> None:
         if is_down:
             if self._shortcut_state.is_typing_with_shift() and key >= 127:
@@ -301,6 +359,7 @@ class RfbTraceToRawActionsProcessor:
 
                         self._processed_replay.append(
                             ActionReplayStep(
+                                timestamp_ns=self._shortcut_state.first_modifier_step.timestamp,
                                 timestamp=self._format_relative_timestamp(
                                     self._shortcut_state.first_modifier_step.timestamp
                                 ),
@@ -322,7 +381,7 @@ class RfbTraceToRawActionsProcessor:
         self,
         key: X11Key,
         is_down: bool,
-        step: RfbReplayStep,
+        step: RfbReplayEvent,
     ) -> None:
         if is_down:
             if self._is_printable_unicode_key(key):
@@ -337,6 +396,7 @@ class RfbTraceToRawActionsProcessor:
 
                 self._processed_replay.append(
                     ActionReplayStep(
+                        timestamp_ns=step.timestamp,
                         timestamp=self._format_relative_timestamp(step.timestamp),
                         event=KeyPressAction(key=key),
                     )
@@ -345,7 +405,7 @@ class RfbTraceToRawActionsProcessor:
         else:
             pass
 
-    def _process_modifier_key_event(self, key: X11Key, is_down: bool, step: RfbReplayStep) -> None:
+    def _process_modifier_key_event(self, key: X11Key, is_down: bool, step: RfbReplayEvent) -> None:
         if is_down:
             self._check_and_process_type_action()
 
@@ -358,13 +418,14 @@ class RfbTraceToRawActionsProcessor:
 
     def _check_and_process_type_action(self) -> None:
         if self._typing_state.keys:
-            if isinstance(self._processed_replay[-1].event, TypeAction):
+            if self._processed_replay and isinstance(self._processed_replay[-1].event, TypeAction):
                 previous_typing_action = self._processed_replay.pop()
 
                 assert isinstance(previous_typing_action.event, TypeAction)
 
                 self._processed_replay.append(
                     ActionReplayStep(
+                        timestamp_ns=previous_typing_action.timestamp_ns,
                         timestamp=previous_typing_action.timestamp,
                         event=TypeAction(
                             keys=previous_typing_action.event.keys + self._typing_state.keys,
@@ -384,6 +445,7 @@ class RfbTraceToRawActionsProcessor:
 
                 self._processed_replay.append(
                     ActionReplayStep(
+                        timestamp_ns=self._typing_state.start_timestamp,
                         timestamp=self._format_relative_timestamp(
                             self._typing_state.start_timestamp
                         ),
@@ -397,20 +459,21 @@ class RfbTraceToRawActionsProcessor:
             self._typing_state.text = ""
             self._typing_state.start_timestamp = None
 
-    def _check_and_process_type_action_at_pointer_event(self, step: RfbReplayStep) -> None:
+    def _check_and_process_type_action_at_pointer_event(self, step: RfbReplayEvent) -> None:
         self._check_and_process_type_action()
 
         if self._last_event_type == LastEventType.KEY_EVENT:
             self._mouse_state.current_action.start_timestamp = step.timestamp
 
     def _process_type_with_shift_action(self) -> None:
-        if isinstance(self._processed_replay[-1].event, TypeAction):
+        if self._processed_replay and isinstance(self._processed_replay[-1].event, TypeAction):
             previous_typing_action = self._processed_replay.pop()
 
             assert isinstance(previous_typing_action.event, TypeAction)
 
             self._processed_replay.append(
                 ActionReplayStep(
+                    timestamp_ns=previous_typing_action.timestamp_ns,
                     timestamp=previous_typing_action.timestamp,
                     event=TypeAction(
                         keys=previous_typing_action.event.keys + self._shortcut_state.keys[1:],
@@ -432,6 +495,7 @@ class RfbTraceToRawActionsProcessor:
 
             self._processed_replay.append(
                 ActionReplayStep(
+                    timestamp_ns=self._shortcut_state.first_modifier_step.timestamp,
                     timestamp=self._format_relative_timestamp(
                         self._shortcut_state.first_modifier_step.timestamp
                     ),
@@ -479,7 +543,7 @@ class RfbTraceToRawActionsProcessor:
         buttons: MouseButtons,
         x: int,
         y: int,
-        step: RfbReplayStep,
+        step: RfbReplayEvent,
     ) -> None:
         if self._keyboard_state.any_key_pressed():
             if buttons == MouseButtons(0) and buttons == self._mouse_state.buttons:
@@ -546,7 +610,7 @@ class RfbTraceToRawActionsProcessor:
         buttons: MouseButtons,
         x: int,
         y: int,
-        step: RfbReplayStep,
+        step: RfbReplayEvent,
     ) -> None:
         # If there is a pending single-click candidate, decide whether to flush it now
         if self._mouse_state.current_action.kind == CurrentMouseActionKind.CLICK_OR_DBL_CLICK:
@@ -670,7 +734,7 @@ class RfbTraceToRawActionsProcessor:
         self,
         x: int,
         y: int,
-        step: RfbReplayStep,
+        step: RfbReplayEvent,
     ) -> None:
         if self._mouse_state.current_action.kind == CurrentMouseActionKind.DRAG:
             self._process_mouse_drag_action(x=x, y=y)
@@ -813,6 +877,7 @@ class RfbTraceToRawActionsProcessor:
 
         self._processed_replay.append(
             ActionReplayStep(
+                timestamp_ns=ts_ns_move,
                 timestamp=self._format_relative_timestamp(ts_ns_move),
                 event=MouseMoveAction(position=Position(x=x, y=y)),
             )
@@ -856,6 +921,7 @@ class RfbTraceToRawActionsProcessor:
             ts_ns = self._mouse_state.current_action.start_timestamp
         self._processed_replay.append(
             ActionReplayStep(
+                timestamp_ns=ts_ns,
                 timestamp=self._format_relative_timestamp(ts_ns),
                 event=action(buttons=self._mouse_click_state.buttons, position=Position(x=x, y=y)),
             )
@@ -896,46 +962,11 @@ class RfbTraceToRawActionsProcessor:
             return
 
         # Check if timestamps are very close (within 50ms)
-        # Convert timestamps back to nanoseconds for comparison
         MAX_CONSOLIDATION_GAP_NS = 50_000_000  # 50ms
 
-        # Parse the timestamp format "HH:MM:SS.mmm" back to nanoseconds
-        move_timestamp_str = previous_action.timestamp
-        click_timestamp_str = self._processed_replay[-1].timestamp
-
-        # If timestamps are identical or very close, consolidate
-        if move_timestamp_str == click_timestamp_str:
+        if abs(click_ts_ns - previous_action.timestamp_ns) <= MAX_CONSOLIDATION_GAP_NS:
             # Remove the MouseMove event, keep only the MouseClick
             self._processed_replay.pop(-2)
-        else:
-            # For different timestamps, parse and check the time difference
-            try:
-                move_ns = self._parse_timestamp_to_ns(move_timestamp_str)
-                click_ns = self._parse_timestamp_to_ns(click_timestamp_str)
-
-                if abs(click_ns - move_ns) <= MAX_CONSOLIDATION_GAP_NS:
-                    # Remove the MouseMove event, keep only the MouseClick
-                    self._processed_replay.pop(-2)
-            except (ValueError, IndexError):
-                # If timestamp parsing fails, don't consolidate
-                pass
-
-    def _parse_timestamp_to_ns(self, timestamp_str: str) -> int:
-        """Parse timestamp string 'HH:MM:SS.mmm' back to nanoseconds relative to start."""
-        if self._start_timestamp_ns is None:
-            return 0
-
-        parts = timestamp_str.split(":")
-        hours = int(parts[0])
-        minutes = int(parts[1])
-        sec_parts = parts[2].split(".")
-        seconds = int(sec_parts[0])
-        milliseconds = int(sec_parts[1])
-
-        total_ns = (
-            hours * 3600 + minutes * 60 + seconds
-        ) * 1_000_000_000 + milliseconds * 1_000_000
-        return total_ns
 
     def _check_and_process_mouse_click_action(self) -> None:
         if self._mouse_state.current_action.kind == CurrentMouseActionKind.CLICK_OR_DBL_CLICK:
@@ -971,6 +1002,7 @@ class RfbTraceToRawActionsProcessor:
         ):
             self._processed_replay.append(
                 ActionReplayStep(
+                    timestamp_ns=self._mouse_state.current_action.start_timestamp,
                     timestamp=self._format_relative_timestamp(
                         self._mouse_state.current_action.start_timestamp
                     ),
@@ -987,6 +1019,7 @@ class RfbTraceToRawActionsProcessor:
         else:
             self._processed_replay.append(
                 ActionReplayStep(
+                    timestamp_ns=self._mouse_state.current_action.start_timestamp,
                     timestamp=self._format_relative_timestamp(
                         self._mouse_state.current_action.start_timestamp
                     ),
@@ -1014,6 +1047,7 @@ class RfbTraceToRawActionsProcessor:
         assert self._mouse_state.current_action.start_timestamp is not None
         self._processed_replay.append(
             ActionReplayStep(
+                timestamp_ns=self._mouse_state.current_action.start_timestamp,
                 timestamp=self._format_relative_timestamp(
                     self._mouse_state.current_action.start_timestamp
                 ),
@@ -1054,7 +1088,7 @@ class RfbTraceToRawActionsProcessor:
         buttons: MouseButtons,
         x: int,
         y: int,
-        step: RfbReplayStep,
+        step: RfbReplayEvent,
     ) -> None:
         self._mouse_state.update(buttons=buttons, x=x, y=y)
 
@@ -1099,6 +1133,9 @@ def export_action_screenshots(
     Artifacts:
       - action_screenshots.json
       - action_screenshots/<index>_before.png, <index>_after.png
+
+    The frames are planned like `export_action_screenshots_from_path` does, then rendered in a
+    single replay of `streams`, which are rewound for it and must be seekable.
     """
     # Load reenact_execution.json if present, else execution.json
     reenact_trace = output_dir / "reenact_execution.json"
@@ -1125,73 +1162,14 @@ def export_action_screenshots(
 
     execution_actions = [a for a in execution_actions if a.get("action") != "finish"]
 
-    # First pass: scan steps to establish base timestamp and collect lightweight index timeline
-    replay_parser = RfbReplayParser(streams)
-    base_ts_ns: int | None = None
-    step_timestamps: list[int] = []
-    step_kinds: list[int] = []  # 0 = fb update, 1 = event
-    # Do not store images; just build a compact timeline
-    for step in replay_parser.iter_steps(continuous=True):
-        if base_ts_ns is None:
-            base_ts_ns = step.timestamp
-        step_timestamps.append(step.timestamp)
-        step_kinds.append(0 if step.event is None else 1)
-    if base_ts_ns is None:
+    # First pass: the timeline of the replay, without rendering screens
+    replay_steps = list(RfbReplayParser(streams).iter_events())
+    if not replay_steps:
         _log.warning("No replay steps; skipping action screenshot export")
         return
-
-    # Build indices for the most recent framebuffer image before an index
-    # A step with event=None corresponds to a FramebufferUpdate
-    framebuffer_indices: list[int] = [i for i, kind in enumerate(step_kinds) if kind == 0]
-    if not framebuffer_indices:
-        framebuffer_indices = list(range(len(step_timestamps)))
-
-    # Process raw actions to get approximate timestamps for agent operations
-    # Re-run a lightweight iterator to derive processed action timestamps without keeping images
-    replay_parser_actions = RfbReplayParser(streams)
-    processed_actions = RfbTraceToRawActionsProcessor(
-        replay_parser_actions.iter_steps(continuous=True)
-    ).run()
-    processed_ts_ns: list[int] = []
-    for pa in processed_actions:
-        # Convert relative timestamp string back to absolute ns using base
-        try:
-            hh, mm, rest = pa.timestamp.split(":")
-            ss, mmm = rest.split(".")
-            rel_ns = (int(hh) * 3600 + int(mm) * 60 + int(ss)) * 1_000_000_000 + int(
-                mmm
-            ) * 1_000_000
-            processed_ts_ns.append(base_ts_ns + rel_ns)
-        except Exception:
-            # Fallback: use base
-            processed_ts_ns.append(base_ts_ns)
-
-    # Helper to find the latest framebuffer index at or before a timestamp
-    def find_before_index(ts_ns: int) -> int:
-        idx = 0
-        # binary search over framebuffer_indices
-        lo, hi = 0, len(framebuffer_indices) - 1
-        while lo <= hi:
-            mid = (lo + hi) // 2
-            if step_timestamps[framebuffer_indices[mid]] <= ts_ns:
-                idx = mid
-                lo = mid + 1
-            else:
-                hi = mid - 1
-        return framebuffer_indices[idx]
-
-    # Helper to find the first framebuffer index strictly after a timestamp
-    def find_after_index(ts_ns: int) -> int:
-        lo, hi = 0, len(framebuffer_indices) - 1
-        ans = framebuffer_indices[-1]
-        while lo <= hi:
-            mid = (lo + hi) // 2
-            if step_timestamps[framebuffer_indices[mid]] > ts_ns:
-                ans = framebuffer_indices[mid]
-                hi = mid - 1
-            else:
-                lo = mid + 1
-        return ans
+    step_timestamps = [st.timestamp for st in replay_steps]
+    base_ts_ns = step_timestamps[0]
+    frames = _plan_action_frames(replay_steps, execution_actions, markers={})
 
     # Prepare output dir for images
     images_dir = output_dir / "action_screenshots"
@@ -1203,54 +1181,14 @@ def export_action_screenshots(
     out_json = open(mapping_path, "wt", encoding="utf-8")
     out_json.write("[\n")
     first_record = True
-    processed_idx = 0
-    last_ts_for_wait = base_ts_ns
-
-    for i, action in enumerate(execution_actions, start=1):
-        action_name = str(action.get("action", "")).strip()
-
-        # Determine an approximate timestamp anchor for this action
-        if action_name == "wait":
-            duration_s = 0.0
-            try:
-                duration_s = float(action.get("params", {}).get("duration", 0.0))
-            except Exception:
-                duration_s = 0.0
-            start_ts_ns = last_ts_for_wait
-            end_ts_ns = start_ts_ns + int(duration_s * 1_000_000_000)
-            before_idx = find_before_index(start_ts_ns)
-            # For waits, still ensure we go a bit past the end to capture UI settle
-            after_idx = find_after_index(end_ts_ns + _MIN_AFTER_DELAY_NS + _WAIT_AFTER_BUFFER_NS)
-            last_ts_for_wait = step_timestamps[after_idx]
-        else:
-            if processed_idx >= len(processed_ts_ns):
-                # Fallback to latest known
-                start_ts_ns = last_ts_for_wait
-            else:
-                start_ts_ns = processed_ts_ns[processed_idx]
-                processed_idx += 1
-            before_idx = find_before_index(start_ts_ns)
-            # pick an after index at least _MIN_AFTER_DELAY_NS after start
-            after_idx = find_after_index(start_ts_ns + _MIN_AFTER_DELAY_NS)
-            last_ts_for_wait = step_timestamps[after_idx]
+    index_to_paths: dict[int, list[Path]] = {}
 
-        # Second pass: open a new parser and advance to the needed indices to grab images only
-        # Grab before image
+    for i, (action, (before_idx, after_idx)) in enumerate(zip(execution_actions, frames), start=1):
+        # Only finish has no after frame, and it is not exported
+        assert after_idx is not None
         before_ts_ns = step_timestamps[before_idx]
         after_ts_ns = step_timestamps[after_idx]
 
-        # Extract and save only the two frames we need
-        def save_frame_at(index: int, out_path: Path) -> None:
-            rp = RfbReplayParser(streams)
-            for i, st in enumerate(rp.iter_steps(continuous=True)):
-                if i == index:
-                    img = st.screen
-                    if max_output_width is not None and img.width > max_output_width:
-                        ratio = max_output_width / img.width
-                        img = img.resize((max_output_width, max(1, int(img.height * ratio))))
-                    img.save(out_path, format=image_format, quality=image_quality)
-                    break
-
         before_name = (
             f"{i:04d}_before.jpg"
             if image_format.upper() == "JPEG"
@@ -1264,8 +1202,8 @@ def export_action_screenshots(
         before_path = images_dir / before_name
         after_path = images_dir / after_name
 
-        save_frame_at(before_idx, before_path)
-        save_frame_at(after_idx, after_path)
+        index_to_paths.setdefault(before_idx, []).append(before_path)
+        index_to_paths.setdefault(after_idx, []).append(after_path)
 
         record = {
             "index": i,
@@ -1291,6 +1229,10 @@ def export_action_screenshots(
     out_json.write("\n]\n")
     out_json.close()
 
+    # Second pass: replay once more to save all planned frames, rendering only those
+    streams.rewind()
+    _save_frames(streams, index_to_paths, max_output_width, image_format, image_quality)
+
     # Also write an HTML viewer by loading a template and injecting JSON
     try:
         if inline_json:
@@ -1309,84 +1251,68 @@ def export_action_screenshots(
         _log.error("Failed to write action_screenshots.html: %s", e)
 
 
-def postprocess_output_dir(output_dir: Path) -> None:
+def postprocess_output_dir(output_dir: Path, workers: int | None = None) -> None:
     """
     Given an output directory containing `execution.json` and a `recording/` folder
     with client/server capture, generate `action_screenshots.json`, the
     per-action before/after images, and `action_screenshots.html`.
+
+    The segments of a segmented recording are decoded by up to `workers` processes, see
+    `export_action_screenshots_from_path`.
     """
     recording_path = output_dir / "recording"
     if not recording_path.exists():
         _log.error("Recording directory not found at %s", recording_path)
         return
 
-    export_action_screenshots_from_path(recording_path, output_dir)
+    export_action_screenshots_from_path(recording_path, output_dir, workers=workers)
 
 
-def export_action_screenshots_from_path(recording_path: Path, output_dir: Path) -> None:
+def export_action_screenshots_from_path(
+    recording_path: Path, output_dir: Path, workers: int | None = None
+) -> None:
+    """
+    Exports the action screenshots of the recording in `recording_path` into `output_dir`, see
+    `postprocess_output_dir`. The segments of a segmented recording (see `recording.segments`) are
+    replayed and rendered concurrently by a pool of up to `workers` processes, by default one per
+    CPU for recordings of at least `_PARALLEL_DECODE_MIN_BYTES`.
+
+    Actions with a marker (see `recording.markers`) are aligned by its timestamps, the actions are
+    only reconstructed from the input events for those without one.
+    """
     # Defaults for image export (memory-efficient settings)
     max_output_width = 1600
     image_format = "JPEG"
     image_quality = 80
 
-    # First pass: build compact timeline (timestamps and kinds)
-    step_timestamps: list[int] = []
-    step_kinds: list[int] = []  # 0 = framebuffer update, 1 = event
-    base_ts_ns: int | None = None
-    with RfbReplayStreams.from_files(recording_path) as streams_a:
-        rp_a = RfbReplayParser(streams_a)
-        for st in rp_a.iter_steps(continuous=True):
-            if base_ts_ns is None:
-                base_ts_ns = st.timestamp
-            step_timestamps.append(st.timestamp)
-            step_kinds.append(0 if st.event is None else 1)
-    if base_ts_ns is None:
+    # First pass: build compact timeline (timestamps and kinds). The steps of a segmented
+    # recording are numbered across its segments, in order.
+    segments = segment_paths(recording_path)
+    if workers is None and _server_bytes(segments) < _PARALLEL_DECODE_MIN_BYTES:
+        workers = 1
+    segment_steps: list[list[RfbReplayEvent] | None] = []
+    for segment in segments:
+        # The index written during capture lists the steps, only input events are read
+        index = MessageIndex.from_file(segment)
+        segment_steps.append(None if index is None else _replay_events_from_index(segment, index))
+    # Segments without index are replayed, concurrently
+    unindexed = [i for i, steps in enumerate(segment_steps) if steps is None]
+    replayed = _map_segments(_replay_segment_events, [(segments[i],) for i in unindexed], workers)
+    for i, steps in zip(unindexed, replayed):
+        segment_steps[i] = steps
+
+    replay_steps: list[RfbReplayEvent] = []
+    segment_starts: list[int] = []
+    for steps in segment_steps:
+        assert steps is not None
+        segment_starts.append(len(replay_steps))
+        replay_steps.extend(steps)
+    input_steps = _without_resumed_pointers([steps for steps in segment_steps if steps is not None])
+    step_timestamps = [st.timestamp for st in replay_steps]
+    if not replay_steps:
         _log.warning("No replay steps; skipping action screenshot export")
         return
-
-    framebuffer_indices: list[int] = [i for i, k in enumerate(step_kinds) if k == 0]
-    if not framebuffer_indices:
-        framebuffer_indices = list(range(len(step_timestamps)))
-
-    # Second pass: compute processed actions to align with execution
-    with RfbReplayStreams.from_files(recording_path) as streams_b:
-        rp_b = RfbReplayParser(streams_b)
-        processed_actions = RfbTraceToRawActionsProcessor(rp_b.iter_steps(continuous=True)).run()
-    processed_ts_ns: list[int] = []
-    for pa in processed_actions:
-        try:
-            hh, mm, rest = pa.timestamp.split(":")
-            ss, mmm = rest.split(".")
-            rel_ns = (int(hh) * 3600 + int(mm) * 60 + int(ss)) * 1_000_000_000 + int(
-                mmm
-            ) * 1_000_000
-            processed_ts_ns.append(base_ts_ns + rel_ns)
-        except Exception:
-            processed_ts_ns.append(base_ts_ns)
-
-    def find_before_index(ts_ns: int) -> int:
-        idx = 0
-        lo, hi = 0, len(framebuffer_indices) - 1
-        while lo <= hi:
-            mid = (lo + hi) // 2
-            if step_timestamps[framebuffer_indices[mid]] <= ts_ns:
-                idx = mid
-                lo = mid + 1
-            else:
-                hi = mid - 1
-        return framebuffer_indices[idx]
-
-    def find_after_index(ts_ns: int) -> int:
-        lo, hi = 0, len(framebuffer_indices) - 1
-        ans = framebuffer_indices[-1]
-        while lo <= hi:
-            mid = (lo + hi) // 2
-            if step_timestamps[framebuffer_indices[mid]] > ts_ns:
-                ans = framebuffer_indices[mid]
-                hi = mid - 1
-            else:
-                lo = mid + 1
-        return ans
+    base_ts_ns = step_timestamps[0]
 
     # Load reenact_execution.json if present, else execution.json
     reenact_trace = output_dir / "reenact_execution.json"
@@ -1417,37 +1343,11 @@ def export_action_screenshots_from_path(recording_path: Path, output_dir: Path)
     index_to_paths: dict[int, list[Path]] = {}
     records: list[dict[str, Any]] = []
 
-    processed_idx = 0
-    last_ts_for_wait = base_ts_ns
-
-    for i, action in enumerate(execution_actions, start=1):
-        action_name = str(action.get("action", "")).strip()
-
-        if action_name == "wait":
-            try:
-                duration_s = float(action.get("params", {}).get("duration", 0.0))
-            except Exception:
-                duration_s = 0.0
-            start_ts_ns = last_ts_for_wait
-            end_ts_ns = start_ts_ns + int(duration_s * 1_000_000_000)
-            before_idx = find_before_index(start_ts_ns)
-            after_idx = find_after_index(end_ts_ns + _MIN_AFTER_DELAY_NS + _WAIT_AFTER_BUFFER_NS)
-            last_ts_for_wait = step_timestamps[after_idx]
-        elif action_name == "finish":
-            # Only capture a before frame for finish, no after
-            start_ts_ns = last_ts_for_wait
-            before_idx = find_before_index(start_ts_ns)
-            after_idx = None
-        else:
-            if processed_idx >= len(processed_ts_ns):
-                start_ts_ns = last_ts_for_wait
-            else:
-                start_ts_ns = processed_ts_ns[processed_idx]
-                processed_idx += 1
-            before_idx = find_before_index(start_ts_ns)
-            after_idx = find_after_index(start_ts_ns + _MIN_AFTER_DELAY_NS)
-            last_ts_for_wait = step_timestamps[after_idx]
+    # Actions with a marker are aligned by it, the others with the reconstructed actions
+    markers = {marker.index: marker for marker in read_action_markers(recording_path) or []}
+    frames = _plan_action_frames(replay_steps, execution_actions, markers, input_steps)
 
+    for i, (action, (before_idx, after_idx)) in enumerate(zip(execution_actions, frames), start=1):
         before_ts_ns = step_timestamps[before_idx]
         after_ts_ns = step_timestamps[after_idx] if after_idx is not None else None
 
@@ -1478,23 +1378,22 @@ def export_action_screenshots_from_path(recording_path: Path, output_dir: Path)
             }
         records.append(record)
 
-    # Single pass to save all planned frames
-    with RfbReplayStreams.from_files(recording_path) as streams_c:
-        rp_c = RfbReplayParser(streams_c)
-        for i, st in enumerate(rp_c.iter_steps(continuous=True)):
-            targets = index_to_paths.get(i)
-            if not targets:
-                continue
-            img = st.screen
-            if max_output_width is not None and img.width > max_output_width:
-                ratio = max_output_width / img.width
-                img = img.resize((max_output_width, max(1, int(img.height * ratio))))
-            for out_path in targets:
-                img.save(
-                    out_path,
-                    format=None if image_format.upper() == "PNG" else image_format,
-                    quality=image_quality,
-                )
+    # Single pass over each segment to save all planned frames, rendering only those. Segments
+    # are rendered concurrently, and share the CPUs for encoding their frames.
+    segment_ends = segment_starts[1:] + [len(step_timestamps)]
+    segment_targets = [
+        {i - start: paths for i, paths in index_to_paths.items() if start <= i < end}
+        for start, end in zip(segment_starts, segment_ends)
+    ]
+    num_jobs = sum(1 for targets in segment_targets if targets)
+    num_cpus = os.cpu_count() or 1
+    encoders = max(1, num_cpus // max(1, min(num_jobs, workers or num_cpus)))
+    jobs = [
+        (segment, targets, max_output_width, image_format, image_quality, encoders)
+        for segment, targets in zip(segments, segment_targets)
+        if targets
+    ]
+    _map_segments(_save_segment_frames, jobs, workers)
 
     with open(mapping_path, "wt", encoding="utf-8") as out_json:
         json.dump(records, out_json, ensure_ascii=False, indent=2)
@@ -1507,6 +1406,245 @@ def export_action_screenshots_from_path(recording_path: Path, output_dir: Path)
         _log.error("Failed to write action_screenshots.html: %s", e)
 
 
+def _plan_action_frames(
+    replay_steps: list[RfbReplayEvent],
+    execution_actions: list[dict[str, Any]],
+    markers: dict[int, ActionMarker],
+    input_steps: list[RfbReplayEvent] | None = None,
+) -> list[tuple[int, int | None]]:
+    """
+    The indices of the steps of `replay_steps` whose screens are taken before and after each of
+    `execution_actions`, None after `finish`. An action is aligned by its marker in `markers` (by
+    position in `execution_actions`), the others in order with the actions reconstructed from the
+    input events of `input_steps` (by default `replay_steps`).
+    """
+    step_timestamps = [st.timestamp for st in replay_steps]
+    framebuffer_indices = [i for i, st in enumerate(replay_steps) if st.event is None]
+    if not framebuffer_indices:
+        framebuffer_indices = list(range(len(step_timestamps)))
+
+    def find_before_index(ts_ns: int) -> int:
+        idx = 0
+        lo, hi = 0, len(framebuffer_indices) - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if step_timestamps[framebuffer_indices[mid]] <= ts_ns:
+                idx = mid
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return framebuffer_indices[idx]
+
+    def find_after_index(ts_ns: int) -> int:
+        lo, hi = 0, len(framebuffer_indices) - 1
+        ans = framebuffer_indices[-1]
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if step_timestamps[framebuffer_indices[mid]] > ts_ns:
+                ans = framebuffer_indices[mid]
+                hi = mid - 1
+            else:
+                lo = mid + 1
+        return ans
+
+    # Computed on the first action without marker
+    processed_ts_ns: list[int] | None = None
+    processed_idx = 0
+    last_ts_for_wait = step_timestamps[0]
+    # End of the last action aligned by its marker, the reconstructed actions up to it belong to
+    # the actions with markers
+    last_marker_end: int | None = None
+
+    frames: list[tuple[int, int | None]] = []
+    for i, action in enumerate(execution_actions):
+        action_name = str(action.get("action", "")).strip()
+        after_idx: int | None
+        marker = markers.get(i)
+        if marker is not None and marker.name != action_name:
+            marker = None
+
+        if marker is not None:
+            # The marker tells when the action ran, the after frame is taken once it ended
+            before_idx = find_before_index(marker.start)
+            last_marker_end = marker.end
+            if action_name == "finish":
+                after_idx = None
+            else:
+                after_idx = find_after_index(marker.end + _MIN_AFTER_DELAY_NS)
+                last_ts_for_wait = step_timestamps[after_idx]
+        elif action_name == "wait":
+            try:
+                duration_s = float(action.get("params", {}).get("duration", 0.0))
+            except Exception:
+                duration_s = 0.0
+            start_ts_ns = last_ts_for_wait
+            end_ts_ns = start_ts_ns + int(duration_s * 1_000_000_000)
+            before_idx = find_before_index(start_ts_ns)
+            # For waits, still ensure we go a bit past the end to capture UI settle
+            after_idx = find_after_index(end_ts_ns + _MIN_AFTER_DELAY_NS + _WAIT_AFTER_BUFFER_NS)
+            last_ts_for_wait = step_timestamps[after_idx]
+        elif action_name == "finish":
+            # Only capture a before frame for finish, no after
+            before_idx = find_before_index(last_ts_for_wait)
+            after_idx = None
+        else:
+            if processed_ts_ns is None:
+                processed_actions = RfbTraceToRawActionsProcessor(
+                    replay_steps if input_steps is None else input_steps
+                ).run()
+                processed_ts_ns = [pa.timestamp_ns for pa in processed_actions]
+            if last_marker_end is not None:
+                while (
+                    processed_idx < len(processed_ts_ns)
+                    and processed_ts_ns[processed_idx] <= last_marker_end
+                ):
+                    processed_idx += 1
+            if processed_idx >= len(processed_ts_ns):
+                # Fallback to latest known
+                start_ts_ns = last_ts_for_wait
+            else:
+                start_ts_ns = processed_ts_ns[processed_idx]
+                processed_idx += 1
+            before_idx = find_before_index(start_ts_ns)
+            # pick an after index at least _MIN_AFTER_DELAY_NS after start
+            after_idx = find_after_index(start_ts_ns + _MIN_AFTER_DELAY_NS)
+            last_ts_for_wait = step_timestamps[after_idx]
+        frames.append((before_idx, after_idx))
+    return frames
+
+
+def _replay_events_from_index(recording_path: Path, index: MessageIndex) -> list[RfbReplayEvent]:
+    """
+    The steps `RfbReplayParser.iter_steps(continuous=True)` yields for the recording, without
+    the screens. Only the input events are read from the recording, at their indexed offsets.
+    """
+    with open_message_stream(recording_path / "client.rfb.bin") as client_messages:
+        return [
+            RfbReplayEvent(
+                timestamp=entry.timestamp,
+                event=read_input_event(client_messages, entry) if entry.is_input_event else None,
+            )
+            for entry in index.iter_replay_steps()
+        ]
+
+
+def _without_resumed_pointers(segment_steps: list[list[RfbReplayEvent]]) -> list[RfbReplayEvent]:
+    """
+    The steps of the segments in order, without the `PointerEvent` a segment starts with when it
+    only puts the pointer back where the previous segment left it (see
+    `RecordingSegmenter.start_segment`). The actions would take it for a move.
+    """
+    steps: list[RfbReplayEvent] = []
+    pointer: PointerEvent | None = None
+    for i, segment in enumerate(segment_steps):
+        resumed = i > 0
+        for step in segment:
+            if not isinstance(step.event, PointerEvent):
+                steps.append(step)
+                continue
+            if not (resumed and step.event == pointer):
+                steps.append(step)
+            resumed = False
+            pointer = step.event
+    return steps
+
+
+def _map_segments[T](
+    function: Callable[..., T], jobs: list[tuple[Any, ...]], workers: int | None
+) -> list[T]:
+    """
+    `function(*job)` for each of the `jobs`, in order. Several jobs are run by a pool of up to
+    `workers` processes (one per CPU if None), unless this process cannot have children, e.g. it
+    is a Dask worker.
+    """
+    num_workers = min(len(jobs), workers or os.cpu_count() or 1)
+    if num_workers <= 1 or multiprocessing.current_process().daemon:
+        return [function(*job) for job in jobs]
+    # Spawned rather than forked, the caller may run threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as pool:
+        return list(pool.map(function, *zip(*jobs)))
+
+
+def _server_bytes(segments: list[Path]) -> int:
+    return sum((segment / "server.rfb.bin").stat().st_size for segment in segments)
+
+
+def _replay_segment_events(segment: Path) -> list[RfbReplayEvent]:
+    """The steps of `RfbReplayParser.iter_steps(continuous=True)` for a segment, without screens."""
+    with RfbReplayStreams.from_files(segment) as streams:
+        return list(RfbReplayParser(streams).iter_events())
+
+
+def _save_segment_frames(
+    segment: Path,
+    index_to_paths: dict[int, list[Path]],
+    max_output_width: int | None,
+    image_format: str,
+    image_quality: int,
+    encoders: int | None = None,
+) -> None:
+    """Saves the screens of the steps of a segment at their indices in `index_to_paths`."""
+    with RfbReplayStreams.from_files(segment) as streams:
+        _save_frames(
+            streams, index_to_paths, max_output_width, image_format, image_quality, encoders
+        )
+
+
+def _save_frames(
+    streams: RfbReplayStreams,
+    index_to_paths: dict[int, list[Path]],
+    max_output_width: int | None,
+    image_format: str,
+    image_quality: int,
+    encoders: int | None = None,
+) -> None:
+    """
+    Saves the screens of the steps of `streams` at their indices in `index_to_paths`. The screens
+    are resized and encoded by up to `encoders` threads (one per CPU if None) while the replay
+    continues, Pillow releases the GIL meanwhile. Every rendered screen is a new image, none is
+    shared with the replay. Once `_MAX_PENDING_FRAMES` are pending, the replay waits for the
+    oldest, which also raises the first error of the encoders.
+    """
+    pending: deque[Future[None]] = deque()
+    with ThreadPoolExecutor(
+        max_workers=min(encoders or os.cpu_count() or 1, _MAX_PENDING_FRAMES)
+    ) as pool:
+        for i, img in RfbReplayParser(streams).iter_screens_at(index_to_paths):
+            if len(pending) >= _MAX_PENDING_FRAMES:
+                pending.popleft().result()
+            pending.append(
+                pool.submit(
+                    _save_frame,
+                    img,
+                    index_to_paths[i],
+                    max_output_width,
+                    image_format,
+                    image_quality,
+                )
+            )
+        for future in pending:
+            future.result()
+
+
+def _save_frame(
+    img: Image,
+    out_paths: list[Path],
+    max_output_width: int | None,
+    image_format: str,
+    image_quality: int,
+) -> None:
+    if max_output_width is not None and img.width > max_output_width:
+        ratio = max_output_width / img.width
+        img = img.resize((max_output_width, max(1, int(img.height * ratio))))
+    for out_path in out_paths:
+        img.save(
+            out_path,
+            format=None if image_format.upper() == "PNG" else image_format,
+            quality=image_quality,
+        )
+
+
 def _write_action_screenshots_html(
     output_dir: Path,
     mapping: list[dict[str, Any]],
@@ -5,15 +5,17 @@ This file provides tools for parsing and replaying recorded VNC sessions.
 from __future__ import annotations
 
 import logging
-import struct
+import os
 import threading
 import time
-from collections.abc import Callable, Iterator
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from functools import partial
 from pathlib import Path
 from struct import Struct
-from typing import IO, Any, ClassVar, Literal, Self, TypeVar
+from typing import IO, Any, ClassVar, Literal, Self, TypeVar, cast
 
 from PIL.Image import Image
 
@@ -25,24 +27,42 @@ from ..rfb_messages import (
     PointerEvent,
     ProtocolVersion,
     QemuExtendedKeyEvent,
-    SecurityType,
     ServerMessage,
     _unpack_stream,
     parse_client_message,
 )
+from .chunked import ChunkedStreamWriter, StreamCompression, open_message_stream
+from .decimation import DecimationPolicy, UpdateDecimator
+from .index import MessageIndexWriter, MessageSource
+from .segments import (
+    RecordingManifest,
+    RecordingSegment,
+    RecordingSegmenter,
+    SegmentPolicy,
+    handshake_records,
+    segment_name,
+)
 
 
 @dataclass(frozen=True)
-class RfbReplayStep:
+class RfbReplayEvent:
     """
-    Represents a single step in the RFB replay.
+    The timestamp and event of a step in the RFB replay, without the screen.
     """
 
     timestamp: int  # u64, nanoseconds
-    screen: Image
     event: PointerEvent | KeyEvent | None
 
 
+@dataclass(frozen=True)
+class RfbReplayStep(RfbReplayEvent):
+    """
+    Represents a single step in the RFB replay.
+    """
+
+    screen: Image
+
+
 @dataclass(init=False)
 class RfbReplayParser:
     """
@@ -140,6 +160,52 @@ class RfbReplayParser:
                     # Ignore all other message kinds
                     continue
 
+    def iter_events(self) -> Iterator[RfbReplayEvent]:
+        """
+        Yields the steps of `iter_steps(continuous=True)` without their screens, which are not
+        rendered.
+        """
+        for timestamp, message in self.iter_raw_messages():
+            match message:
+                case FramebufferUpdate():
+                    yield RfbReplayEvent(timestamp=timestamp, event=None)
+                case QemuExtendedKeyEvent():
+                    event = KeyEvent(key=message.keysym, is_down=message.is_down)
+                    yield RfbReplayEvent(timestamp=timestamp, event=event)
+                case KeyEvent() | PointerEvent():
+                    yield RfbReplayEvent(timestamp=timestamp, event=message)
+                case _:
+                    # Ignore all other message kinds
+                    continue
+
+    def iter_screens_at(
+        self, step_indices: Iterable[int], images_with_cursor: bool = True
+    ) -> Iterator[tuple[int, Image]]:
+        """
+        Yields `(step index, screen)` for the given indices of the steps of
+        `iter_steps(continuous=True)`, in increasing order. Only these screens are rendered, and the
+        replay stops after the last one.
+        """
+        targets = iter(sorted(set(step_indices)))
+        target = next(targets, None)
+        step_index = 0
+        for _, message in self.iter_raw_messages():
+            if target is None:
+                return
+            if not isinstance(
+                message, FramebufferUpdate | QemuExtendedKeyEvent | KeyEvent | PointerEvent
+            ):
+                continue
+            if step_index == target:
+                yield (
+                    step_index,
+                    self._session.get_image_with_cursor()
+                    if images_with_cursor
+                    else self._session.get_image_without_cursor(),
+                )
+                target = next(targets, None)
+            step_index += 1
+
     def iter_raw_messages(self) -> Iterator[tuple[int, ClientMessage | ServerMessage]]:
         while True:
             try:
@@ -217,9 +283,15 @@ class RfbReplayStreams:
         Returns:
             A tuple containing the timestamp and the parsed message.
         """
-        if self.has_server_messages or self.has_client_messages:
+        # Once a stream ends, continue with the rest of the other one
+        while self.has_server_messages or self.has_client_messages:
             # Interleave the messages based on the timestamps
             (next_client_timestamp, next_server_timestamp) = self._next_message_timestamps()
+            # A stream ends with its last annotated byte, bytes without timestamp are not replayed
+            if self.client_timestamps.finished:
+                self.has_client_messages = False
+            if self.server_timestamps.finished:
+                self.has_server_messages = False
             next_message_is_server = next_server_timestamp < next_client_timestamp
 
             if self.has_server_messages and (
@@ -230,8 +302,7 @@ class RfbReplayStreams:
                 except EOFError:
                     # Also ignores potentially incomplete messages at the end
                     self.has_server_messages = False
-            else:
-                assert self.has_client_messages
+            elif self.has_client_messages:
                 try:
                     return (next_client_timestamp, parse_client_message(self.client_messages))
                 except EOFError:
@@ -240,6 +311,20 @@ class RfbReplayStreams:
 
         raise StopIteration()
 
+    def rewind(self) -> None:
+        """
+        Goes back to the start of the streams, so a new `RfbReplayParser` replays them again. The
+        message and timestamp streams must be seekable.
+        """
+        for messages in (self.client_messages, self.server_messages):
+            if not messages.seekable():
+                raise ValueError("Cannot rewind replay streams which are not seekable")
+            messages.seek(0)
+        self.client_timestamps.rewind()
+        self.server_timestamps.rewind()
+        self.has_client_messages = True
+        self.has_server_messages = True
+
     def _next_message_timestamps(self) -> tuple[int, int]:
         """
         Gets the next message timestamps for both client and server streams.
@@ -280,9 +365,15 @@ class RfbMessageStream:
         timestamps_path = prefix / f"{suffix}.time.bin"
         messages_path = prefix / f"{suffix}.rfb.bin"
 
+        if mode == "rb":
+            # Compressed message streams are read transparently, see `recording.chunked`
+            open_messages = open_message_stream
+        else:
+            open_messages = partial(open, mode=mode)
+
         with (
             open(timestamps_path, mode) as timestamps,
-            open(messages_path, mode) as messages,
+            open_messages(messages_path) as messages,
         ):
             yield cls(
                 timestamps=timestamps,
@@ -362,118 +453,518 @@ class _TimestampAnnotationStream:
         except EOFError:
             self._stream_finished = True
 
-        if self._stream_finished:
-            assert position <= self._current_timestamp.length, (
-                # allow exactly off by one, as we'll try to read one
-                # more message at the end
-                f"Out of bound position for timestamp stream, "
-                f"got {self._current_timestamp=} {position=}",
-            )
-
         return self._current_timestamp.timestamp
 
+    def rewind(self) -> None:
+        """Goes back to the start of the stream, which must be seekable."""
+        self._stream.seek(0)
+        self._stream_finished = False
+        self._current_timestamp = TimestampAnnotation.from_bytes(self._stream)
+        self._last_queried_position = 0
+
+    @property
+    def finished(self) -> bool:
+        """
+        Whether the last queried position is at or past the last annotated byte. A writer which
+        did not close, e.g. because it crashed, may have written bytes without their annotation.
+        """
+        return self._stream_finished
+
+
+class RecordingError(OSError):
+    """Writing a recording failed, e.g. because the disk is full. The recorded connection is fine."""
+
 
 class RfbRecordingWriter:
     """Write-through recorder for client/server byte streams with timestamps.
 
-    Produces files compatible with the replay/export pipeline.
+    Produces files compatible with the replay/export pipeline. With `index`, the recorded messages
+    are also indexed into `messages.index.bin` (see `recording.index`). With `compression`, the
+    message streams are written in the compressed chunked format (see `recording.chunked`). With
+    `decimation`, framebuffer updates are dropped according to the policy (see
+    `recording.decimation`). With `segments`, the recording is split into segment directories
+    listed by a manifest (see `recording.segments`).
     """
 
-    def __init__(self, output_dir: Path) -> None:
-        self._client_messages = open(output_dir / "client.rfb.bin", "wb")
-        self._client_timestamps = open(output_dir / "client.time.bin", "wb")
+    def __init__(
+        self,
+        output_dir: Path,
+        index: bool = False,
+        compression: StreamCompression | None = None,
+        decimation: DecimationPolicy | None = None,
+        segments: SegmentPolicy | None = None,
+    ) -> None:
+        self._output_dir = output_dir
+        self._indexed = index
+        self._compression = compression
+
+        self._client_lock = threading.Lock()
+        self._server_lock = threading.Lock()
+
+        self._decimator: UpdateDecimator | None = (
+            UpdateDecimator(decimation) if decimation is not None else None
+        )
+        self._segmenter = RecordingSegmenter(segments) if segments is not None else None
+        self._manifest = RecordingManifest() if segments is not None else None
+        self._open_segment()
+
+    def _open_segment(self) -> None:
+        """Opens the files of the recording, or of the next segment."""
+        directory = self._output_dir
+        if self._manifest is not None:
+            name = segment_name(len(self._manifest.segments))
+            directory = self._output_dir / name
+            directory.mkdir(parents=True, exist_ok=True)
+            self._manifest.segments.append(RecordingSegment(name))
+            self._manifest.write(self._output_dir)
+        self._directory = directory
+
+        self._client_messages = _open_message_file(directory / "client.rfb.bin", self._compression)
+        self._client_timestamps = open(directory / "client.time.bin", "wb")
         self._client_len = 0
 
-        self._server_messages = open(output_dir / "server.rfb.bin", "wb")
-        self._server_timestamps = open(output_dir / "server.time.bin", "wb")
+        self._server_messages = _open_message_file(directory / "server.rfb.bin", self._compression)
+        self._server_timestamps = open(directory / "server.time.bin", "wb")
         self._server_len = 0
 
-        self._client_lock = threading.Lock()
-        self._server_lock = threading.Lock()
+        self._index = MessageIndexWriter(directory) if self._indexed else None
 
     def record_client_bytes(self, data: bytes) -> None:
-        if not data:
-            return
-        with self._client_lock:
-            self._client_messages.write(data)
-            self._client_len += len(data)
-            ts = TimestampAnnotation(timestamp=time.time_ns(), length=self._client_len)
-            self._client_timestamps.write(ts.to_bytes())
+        self._record(True, data, None)
 
     def record_server_bytes(self, data: bytes) -> None:
-        if not data:
-            return
-        with self._server_lock:
-            self._server_messages.write(data)
-            self._server_len += len(data)
-            ts = TimestampAnnotation(timestamp=time.time_ns(), length=self._server_len)
-            self._server_timestamps.write(ts.to_bytes())
+        self._record(False, data, None)
 
     def record_client_bytes_at(self, data: bytes, timestamp_ns: int) -> None:
+        self._record(True, data, timestamp_ns)
+
+    def record_server_bytes_at(self, data: bytes, timestamp_ns: int) -> None:
+        self._record(False, data, timestamp_ns)
+
+    def _record(self, client: bool, data: bytes, timestamp_ns: int | None) -> None:
+        """Records a chunk, stamped now unless `timestamp_ns` is given."""
         if not data:
             return
-        with self._client_lock:
+        if self._decimator is not None or self._segmenter is not None:
+            # Both follow the two streams: the decimator may store server bytes for a client
+            # chunk, a rotation switches the files of both
+            with self._client_lock, self._server_lock:
+                timestamp = time.time_ns() if timestamp_ns is None else timestamp_ns
+                if self._decimator is not None:
+                    self._write_segmented(self._decimator.filter(client, data, timestamp))
+                else:
+                    self._write_segmented([(client, data, timestamp)])
+            return
+        with self._client_lock if client else self._server_lock:
+            timestamp = time.time_ns() if timestamp_ns is None else timestamp_ns
+            self._write_record(client, data, timestamp)
+
+    def _write_segmented(self, records: list[tuple[bool, bytes, int]]) -> None:
+        """Writes chunks, rotating segments between them, with the locks of both streams held."""
+        if self._segmenter is None:
+            self._write_records(records)
+            return
+        start = 0
+        for i, (client, data, timestamp) in enumerate(records):
+            if self._segmenter.observe(client, data, timestamp):
+                self._write_records(records[start : i + 1])
+                start = i + 1
+                self._rotate(timestamp)
+        self._write_records(records[start:])
+
+    def _rotate(self, timestamp_ns: int) -> None:
+        """Closes the current segment and opens the next one, which starts from the live state."""
+        assert self._segmenter is not None
+        self._close_segment()
+        self._open_segment()
+        self._write_records(self._segmenter.start_segment(timestamp_ns))
+
+    def _write_records(self, records: list[tuple[bool, bytes, int]]) -> None:
+        for record in records:
+            self._write_record(*record)
+
+    def _write_record(self, client: bool, data: bytes, timestamp_ns: int) -> None:
+        """Writes a chunk, with the lock of its stream held."""
+        if client:
             self._client_messages.write(data)
             self._client_len += len(data)
             ts = TimestampAnnotation(timestamp=timestamp_ns, length=self._client_len)
             self._client_timestamps.write(ts.to_bytes())
-
-    def record_server_bytes_at(self, data: bytes, timestamp_ns: int) -> None:
-        if not data:
-            return
-        with self._server_lock:
+        else:
             self._server_messages.write(data)
             self._server_len += len(data)
             ts = TimestampAnnotation(timestamp=timestamp_ns, length=self._server_len)
             self._server_timestamps.write(ts.to_bytes())
+        if self._index is not None:
+            source = MessageSource.CLIENT if client else MessageSource.SERVER
+            self._index.add(source, data, timestamp_ns)
+
+    def _files(self) -> tuple[IO[bytes], ...]:
+        return (
+            self._client_messages,
+            self._client_timestamps,
+            self._server_messages,
+            self._server_timestamps,
+        )
+
+    def _close_segment(self) -> None:
+        """Closes the files of the recording or current segment, and lists the segment complete."""
+        try:
+            for file in self._files():
+                file.flush()
+        finally:
+            for file in self._files():
+                file.close()
+            if self._index is not None:
+                self._index.close()
+        if self._manifest is not None and self._segmenter is not None:
+            segment = self._manifest.segments[-1]
+            segment.start_ns = self._segmenter.start_ns
+            segment.end_ns = self._segmenter.end_ns
+            segment.num_bytes = self._segmenter.num_bytes
+            segment.complete = True
+            self._manifest.write(self._output_dir)
 
     def close(self) -> None:
         try:
-            self._client_messages.flush()
-            self._client_timestamps.flush()
-            self._server_messages.flush()
-            self._server_timestamps.flush()
+            if self._decimator is not None:
+                with self._client_lock, self._server_lock:
+                    self._write_segmented(self._decimator.finish())
         finally:
-            self._client_messages.close()
-            self._client_timestamps.close()
-            self._server_messages.close()
-            self._server_timestamps.close()
+            self._close_segment()
+
+
+@dataclass
+class RecordingWriterStats:
+    """Counters of a `QueuedRfbRecordingWriter`, which tell whether the disk keeps up"""
+
+    # Chunks and bytes recorded, and the batches the flush thread wrote them in
+    chunks: int = 0
+    num_bytes: int = 0
+    batches: int = 0
+
+    # Bytes waiting to be written right now, and the most there ever were
+    queued_bytes: int = 0
+    max_queued_bytes: int = 0
+
+    # How often and for how long recording callers were blocked because the queue was full
+    stalls: int = 0
+    stall_seconds: float = 0.0
+
+
+class QueuedRfbRecordingWriter(RfbRecordingWriter):
+    """
+    A `RfbRecordingWriter` which does not write on the calling thread.
+
+    Recorded chunks are stamped and appended to an in-memory queue, a flush thread writes them in
+    batches: the data of each stream with one `writelines`, its timestamp records with one `write`.
+    Callers, e.g. the proxy's event loop, thus only wait for the disk when more than
+    `max_queued_bytes` are still unwritten (backpressure), which `stats` reports as stalls.
+
+    `close` writes everything still queued and, with `fsync`, makes the files durable before it
+    returns. A write error of the flush thread is re-raised by the next call, as a `RecordingError`.
+    """
+
+    # Callers block once this many recorded bytes have not been written yet
+    MAX_QUEUED_BYTES: ClassVar[int] = 64 << 20
+
+    def __init__(
+        self,
+        output_dir: Path,
+        max_queued_bytes: int = MAX_QUEUED_BYTES,
+        fsync: bool = True,
+        index: bool = False,
+        compression: StreamCompression | None = None,
+        decimation: DecimationPolicy | None = None,
+        segments: SegmentPolicy | None = None,
+    ) -> None:
+        super().__init__(
+            output_dir,
+            index=index,
+            compression=compression,
+            decimation=decimation,
+            segments=segments,
+        )
+        self._max_queued_bytes = max_queued_bytes
+        self._fsync = fsync
+
+        # Chunks not written yet: (client side?, data, timestamp), guarded by `_cv`
+        self._queue: deque[tuple[bool, bytes, int]] = deque()
+        self._cv = threading.Condition()
+        self._stats = RecordingWriterStats()
+        self._closed = False
+        self._error: BaseException | None = None
+
+        self._thread = threading.Thread(
+            target=self._flush_loop, daemon=True, name="RfbRecordingFlush"
+        )
+        self._thread.start()
+
+    @property
+    def stats(self) -> RecordingWriterStats:
+        """A snapshot of the counters"""
+        with self._cv:
+            return replace(self._stats)
+
+    def record_client_bytes(self, data: bytes) -> None:
+        self._enqueue(True, data, None)
+
+    def record_server_bytes(self, data: bytes) -> None:
+        self._enqueue(False, data, None)
+
+    def record_client_bytes_at(self, data: bytes, timestamp_ns: int) -> None:
+        self._enqueue(True, data, timestamp_ns)
+
+    def record_server_bytes_at(self, data: bytes, timestamp_ns: int) -> None:
+        self._enqueue(False, data, timestamp_ns)
+
+    def _enqueue(self, client: bool, data: bytes, timestamp_ns: int | None) -> None:
+        if not data:
+            return
+        data = bytes(data)
+        with self._cv:
+            self._raise_error()
+            if self._closed:
+                raise ValueError("The recording writer is closed")
+
+            stats = self._stats
+            if not self._has_room(len(data)):
+                stats.stalls += 1
+                start = time.perf_counter()
+                while not self._has_room(len(data)) and self._error is None:
+                    self._cv.wait()
+                stats.stall_seconds += time.perf_counter() - start
+                self._raise_error()
+
+            # Stamped under the lock, so the timestamps of each stream are in order
+            timestamp = time.time_ns() if timestamp_ns is None else timestamp_ns
+            self._queue.append((client, data, timestamp))
+            stats.chunks += 1
+            stats.num_bytes += len(data)
+            stats.queued_bytes += len(data)
+            stats.max_queued_bytes = max(stats.max_queued_bytes, stats.queued_bytes)
+            self._cv.notify_all()
+
+    def _has_room(self, num_bytes: int) -> bool:
+        """Must be called with `_cv` held. A chunk above the limit waits for an empty queue."""
+        queued = self._stats.queued_bytes
+        return queued == 0 or queued + num_bytes <= self._max_queued_bytes
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RecordingError("Writing the recording failed") from self._error
+
+    def _flush_loop(self) -> None:
+        """Body of the flush thread."""
+        while True:
+            with self._cv:
+                while not self._queue and not self._closed:
+                    self._cv.wait()
+                if not self._queue:
+                    return
+                batch = list(self._queue)
+                self._queue.clear()
+
+            try:
+                self._write_batch(batch)
+            except BaseException as e:
+                _log.exception("Writing the recording failed")
+                with self._cv:
+                    self._error = e
+                    self._cv.notify_all()
+                return
+
+            with self._cv:
+                self._stats.batches += 1
+                self._stats.queued_bytes -= sum(len(data) for _, data, _ in batch)
+                self._cv.notify_all()
+
+    def _write_batch(self, batch: list[tuple[bool, bytes, int]]) -> None:
+        # Decimating on the flush thread keeps the decoding off the recording callers
+        records: list[tuple[bool, bytes, int]] = batch
+        if self._decimator is not None:
+            records = [record for chunk in batch for record in self._decimator.filter(*chunk)]
+        self._write_segmented(records)
+
+    def _write_records(self, records: list[tuple[bool, bytes, int]]) -> None:
+        client_data: list[bytes] = []
+        client_timestamps: list[bytes] = []
+        server_data: list[bytes] = []
+        server_timestamps: list[bytes] = []
+        pack = TimestampAnnotation._STRUCT.pack
+        for client, data, timestamp in records:
+            # Indexing on the flush thread keeps the framing pass off the recording callers
+            if self._index is not None:
+                source = MessageSource.CLIENT if client else MessageSource.SERVER
+                self._index.add(source, data, timestamp)
+            if client:
+                self._client_len += len(data)
+                client_data.append(data)
+                client_timestamps.append(pack(timestamp, self._client_len))
+            else:
+                self._server_len += len(data)
+                server_data.append(data)
+                server_timestamps.append(pack(timestamp, self._server_len))
+
+        if client_data:
+            self._client_messages.writelines(client_data)
+            self._client_timestamps.write(b"".join(client_timestamps))
+        if server_data:
+            self._server_messages.writelines(server_data)
+            self._server_timestamps.write(b"".join(server_timestamps))
+        for file in self._files():
+            file.flush()
+
+    def _close_segment(self) -> None:
+        """Makes the files durable (with `fsync`) before they are closed."""
+        try:
+            if self._error is None and self._fsync:
+                for file in self._files():
+                    # The chunk table of a compressed stream is written before the fsync
+                    if isinstance(file, ChunkedStreamWriter):
+                        file.finish()
+                    file.flush()
+                    os.fsync(file.fileno())
+                if self._index is not None:
+                    self._index.fsync()
+                _fsync_directory(self._directory)
+        finally:
+            super()._close_segment()
+        if self._error is None and self._fsync and self._directory != self._output_dir:
+            _fsync_directory(self._output_dir)
+
+    def close(self) -> None:
+        """
+        Writes the queued chunks, fsyncs the files and their directory (with `fsync`) and closes
+        the files. Raises if the flush thread failed to write.
+        """
+        with self._cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._cv.notify_all()
+        self._thread.join()
+
+        try:
+            # Whatever the decimator still holds back is written before the fsync
+            decimator, self._decimator = self._decimator, None
+            if self._error is None and decimator is not None:
+                self._write_segmented(decimator.finish())
+        finally:
+            super().close()
+
+        stats = self.stats
+        if stats.stalls:
+            _log.warning(
+                f"Recording to {self._output_dir} stalled {stats.stalls} times for "
+                f"{stats.stall_seconds:.3f}s in total, the disk did not keep up"
+            )
+        self._raise_error()
 
 
 class RecordingStream(IO[bytes]):
-    """IO[bytes] wrapper that tees reads/writes to an RfbRecordingWriter."""
+    """
+    IO[bytes] wrapper that tees reads/writes to an RfbRecordingWriter.
+
+    Client messages are recorded as they are written. Server bytes are collected while a message is
+    parsed and recorded as one chunk, stamped with the time of its first read, when the reader
+    waits for the next message (`read_ready`) or calls `flush_reads`.
+
+    A failure of the writer never reaches the reads and writes of the stream, it would look like a
+    lost connection: the stream stops recording and keeps the failure in `error` instead.
+    """
 
     def __init__(self, underlying: IO[bytes], writer: RfbRecordingWriter) -> None:
         self._underlying = underlying
         self._writer = writer
+        self._pending_reads = bytearray()
+        self._pending_timestamp = 0
+        self._pending_lock = threading.Lock()
+        self._error: RecordingError | None = None
 
     def unwrap(self) -> IO[bytes]:
         return self._underlying
 
+    def rewrap(self, underlying: IO[bytes]) -> RecordingStream:
+        """The stream continuing this recording on `underlying`, e.g. a new connection."""
+        stream = RecordingStream(underlying, self._writer)
+        stream._error = self._error
+        return stream
+
+    @property
+    def error(self) -> RecordingError | None:
+        """Why the recording stopped, None while it is running"""
+        return self._error
+
     def write(self, data: bytes) -> int:  # pyright: ignore [reportIncompatibleMethodOverride]
         written = self._underlying.write(data)
-        self._writer.record_client_bytes(data)
+        self._record(True, data)
         return written
 
     def read(self, n: int = 1) -> bytes:
         data = self._underlying.read(n)
-        self._writer.record_server_bytes(data)
+        if data and self._error is None:
+            with self._pending_lock:
+                if not self._pending_reads:
+                    self._pending_timestamp = time.time_ns()
+                self._pending_reads += data
         return data
 
+    def record_server_bytes(self, data: bytes) -> None:
+        """Records server bytes which were not read from the stream, e.g. a keyframe."""
+        self._record(False, data)
+
+    def flush_reads(self) -> None:
+        """Records the server bytes read since the last flush."""
+        with self._pending_lock:
+            if self._pending_reads:
+                data = bytes(self._pending_reads)
+                self._pending_reads.clear()
+                self._record(False, data, self._pending_timestamp)
+
+    def discard_reads(self) -> None:
+        """Drops the server bytes read since the last flush, e.g. a message cut off midway."""
+        with self._pending_lock:
+            self._pending_reads.clear()
+
     def close(self) -> None:
+        self.flush_reads()
         self._underlying.close()
 
-    def read_ready(self) -> bool:
+    def read_ready(self, timeout: float | None = 0) -> bool:
+        # Waiting for more data means the previous message was read completely
+        self.flush_reads()
+
         # Delegate to underlying stream if supported; otherwise assume data may be ready
         try:
             underlying_read_ready = getattr(self._underlying, "read_ready", None)
             if callable(underlying_read_ready):
-                return bool(underlying_read_ready())
+                return bool(underlying_read_ready(timeout=timeout))
         except Exception:
             return False
         # Fallback when the underlying stream doesn't expose readiness
         return False
 
+    def _record(self, client: bool, data: bytes, timestamp_ns: int | None = None) -> None:
+        """Records the bytes, unless the recording stopped, and stops it if the writer fails."""
+        if self._error is not None:
+            return
+        try:
+            try:
+                if client:
+                    self._writer.record_client_bytes(data)
+                elif timestamp_ns is None:
+                    self._writer.record_server_bytes(data)
+                else:
+                    self._writer.record_server_bytes_at(data, timestamp_ns)
+            except RecordingError:
+                raise
+            except Exception as e:
+                raise RecordingError("Writing the recording failed") from e
+        except RecordingError as e:
+            _log.exception("Recording the VNC session failed, the recording is stopped")
+            self._error = e
+
     def __enter__(self) -> RecordingStream:
         return self
 
@@ -487,48 +978,33 @@ def emit_handshake_for_recording(
     writer: RfbRecordingWriter,
 ) -> None:
     """Emit a complete RFB handshake into the recording with ordered timestamps."""
-    ts = time.time_ns()
-
-    # Server → client: ProtocolVersion
-    writer.record_server_bytes_at(session.handshake.server_protocol_version.to_bytes(), ts)
-    ts += 1
-
-    # Client → server: ProtocolVersion
-    writer.record_client_bytes_at(client_protocol.to_bytes(), ts)
-    ts += 1
-
-    # Server → client: ServerSecurity (offer NONE)
-    writer.record_server_bytes_at(bytes((1, SecurityType.NONE.value)), ts)
-    ts += 1
-
-    # Client → server: select NONE
-    writer.record_client_bytes_at(bytes((SecurityType.NONE.value,)), ts)
-    ts += 1
-
-    # Server → client: ServerSecurityResult OK
-    writer.record_server_bytes_at(_u32(0), ts)
-    ts += 1
-
-    # Client → server: ClientInit (shared flag)
-    shared_flag = 1 if session.handshake.client_init.shared else 0
-    writer.record_client_bytes_at(bytes((shared_flag,)), ts)
-    ts += 1
-
-    # Server → client: ServerInit
-    server_init = session.handshake.server_init
-    payload = _u16(server_init.screen_width) + _u16(server_init.screen_height)
-    payload += server_init.pixel_format.to_bytes()
-    name_bytes = server_init.name.encode("iso-8859-1")
-    payload += _u32(len(name_bytes)) + name_bytes
-    writer.record_server_bytes_at(payload, ts)
-
-
-def _u32(v: int) -> bytes:
-    return struct.pack("!I", v)
-
-
-def _u16(v: int) -> bytes:
-    return struct.pack("!H", v)
+    for client, data, timestamp in handshake_records(
+        session.handshake, client_protocol, time.time_ns()
+    ):
+        if client:
+            writer.record_client_bytes_at(data, timestamp)
+        else:
+            writer.record_server_bytes_at(data, timestamp)
+
+
+def _open_message_file(path: Path, compression: StreamCompression | None) -> IO[bytes]:
+    if compression is None:
+        return open(path, "wb")
+    return cast(IO[bytes], ChunkedStreamWriter(path, compression))
+
+
+def _fsync_directory(path: Path) -> None:
+    """Makes the creation of the files in a directory durable, where the platform supports it."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
 
 _log = logging.getLogger(__name__)
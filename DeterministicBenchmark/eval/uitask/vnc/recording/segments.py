@@ -0,0 +1,270 @@
+"""
+This file splits a recording into segments: the writer rotates to a new segment directory once the
+current one is large or old enough (see `SegmentPolicy`), and `manifest.json` lists the segments in
+order:
+
+    recording/
+        manifest.json
+        segment-00000/   client.rfb.bin, client.time.bin, server.rfb.bin, server.time.bin, ...
+        segment-00001/
+        ...
+
+Every segment is a complete recording on its own. It starts with a synthesized handshake, the
+client's setup messages (`SetPixelFormat`, the last `SetEncodings`), a keyframe reproducing the
+screen at the rotation (see `recording.keyframe`) and the last `PointerEvent`, which puts the
+pointer back. Segments can thus be decoded in parallel, old ones deleted to trim a recording, and a
+crash only loses the tail of the segment being written.
+
+Segments are rotated between two messages in both directions. The `RecordingSegmenter` follows the
+stored streams with a decoding `SessionMirror` to know where messages end and what the screen is.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from struct import Struct
+from typing import Final
+
+from ..protocol import HandshakeResult, SessionMirror
+from ..rfb_messages import (
+    ClientMessageKind,
+    ProtocolVersion,
+    SecurityType,
+    SetPixelFormat,
+)
+from .keyframe import build_keyframe
+
+MANIFEST_FILENAME: Final[str] = "manifest.json"
+MANIFEST_VERSION: Final[int] = 1
+
+# A recorded chunk: client side?, data, timestamp (nanoseconds)
+Record = tuple[bool, bytes, int]
+
+
+@dataclass(frozen=True)
+class SegmentPolicy:
+    """When the writer starts a new segment, whichever limit is reached first"""
+
+    # Client and server bytes recorded into a segment, besides those it starts with (see
+    # `RecordingSegmenter.start_segment`), None for no limit
+    max_bytes: int | None = 256 << 20
+
+    # Recorded time covered by a segment, None for no limit
+    max_seconds: float | None = None
+
+
+@dataclass
+class RecordingSegment:
+    """An entry of the manifest"""
+
+    # Directory of the segment, relative to the recording
+    name: str
+
+    # Timestamps (nanoseconds) of the first and last chunk, None while nothing was stored
+    start_ns: int | None = None
+    end_ns: int | None = None
+
+    # Client and server bytes stored, including the synthesized start
+    num_bytes: int = 0
+
+    # False for the segment being written, or the last one of a recording which was not closed
+    complete: bool = False
+
+
+@dataclass
+class RecordingManifest:
+    """The segments of a segmented recording, in order"""
+
+    segments: list[RecordingSegment] = field(default_factory=list)
+
+    @classmethod
+    def from_file(cls, recording_path: Path) -> RecordingManifest | None:
+        """
+        Reads the manifest of the recording in `recording_path`, None if it is not segmented.
+        """
+        path = recording_path / MANIFEST_FILENAME
+        if not path.exists():
+            return None
+        with open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version in {path}: {data.get('version')}")
+        return cls(segments=[RecordingSegment(**segment) for segment in data["segments"]])
+
+    def write(self, recording_path: Path) -> None:
+        """Replaces the manifest atomically, a crash leaves either the old or the new one."""
+        path = recording_path / MANIFEST_FILENAME
+        temporary_path = path.with_name(f"{path.name}.tmp")
+        data = {
+            "version": MANIFEST_VERSION,
+            "segments": [asdict(segment) for segment in self.segments],
+        }
+        with open(temporary_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+
+
+def segment_name(number: int) -> str:
+    return f"segment-{number:05d}"
+
+
+def segment_paths(recording_path: Path) -> list[Path]:
+    """
+    The directories holding the segments of the recording in `recording_path`, in order. A
+    recording which is not segmented is its only segment.
+    """
+    manifest = RecordingManifest.from_file(recording_path)
+    if manifest is None:
+        return [recording_path]
+    paths = []
+    for segment in manifest.segments:
+        path = recording_path / segment.name
+        if not (path / "server.time.bin").exists():
+            _log.warning(f"Segment {path} of the manifest is missing, it is skipped")
+            continue
+        paths.append(path)
+    return paths
+
+
+def handshake_records(
+    handshake: HandshakeResult, client_protocol: ProtocolVersion, timestamp_ns: int
+) -> list[Record]:
+    """
+    The chunks of a handshake without security which leads to the session of `handshake`, stamped
+    from `timestamp_ns` on in increments of a nanosecond.
+    """
+    server_init = handshake.server_init
+    name = server_init.name.encode("iso-8859-1")
+    messages = [
+        # ProtocolVersion of both sides
+        (False, handshake.server_protocol_version.to_bytes()),
+        (True, client_protocol.to_bytes()),
+        # The server offers no security, the client selects it and the server confirms
+        (False, bytes((1, SecurityType.NONE.value))),
+        (True, bytes((SecurityType.NONE.value,))),
+        (False, _U32.pack(0)),
+        # ClientInit, ServerInit
+        (True, bytes((1 if handshake.client_init.shared else 0,))),
+        (
+            False,
+            _SERVER_INIT_HEADER.pack(server_init.screen_width, server_init.screen_height)
+            + server_init.pixel_format.to_bytes()
+            + _U32.pack(len(name))
+            + name,
+        ),
+    ]
+    return [(client, data, timestamp_ns + i) for i, (client, data) in enumerate(messages)]
+
+
+class RecordingSegmenter:
+    """
+    Follows the chunks a writer stores and tells when to rotate to a new segment according to
+    `policy`, see `observe`.
+    """
+
+    def __init__(self, policy: SegmentPolicy) -> None:
+        self.policy = policy
+        self._mirror = SessionMirror()
+        # Client messages received, and the last SetEncodings and PointerEvent among them
+        self._client_messages = 0
+        self._set_encodings: bytes | None = None
+        self._pointer_event: bytes | None = None
+
+        # The current segment
+        self.start_ns: int | None = None
+        self.end_ns: int | None = None
+        self.num_bytes = 0
+        # Bytes of the chunks the segment started with
+        self._start_bytes = 0
+
+    def observe(self, client: bool, data: bytes, timestamp_ns: int) -> bool:
+        """
+        Follows a stored chunk.
+
+        Returns:
+            Whether the current segment is full and ends after this chunk.
+        """
+        self._account(data, timestamp_ns)
+        failed = self._mirror.failed
+        if client:
+            for message in self._mirror.feed_client(data):
+                self._client_messages += 1
+                if self._client_messages <= self._mirror.client_handshake_messages:
+                    continue
+                if message[0] == ClientMessageKind.SET_ENCODINGS.value:
+                    self._set_encodings = message
+                elif message[0] == ClientMessageKind.POINTER_EVENT.value:
+                    self._pointer_event = message
+        else:
+            self._mirror.feed_server(data)
+        if self._mirror.failed and not failed:
+            _log.warning("Cannot follow the recorded session, it is no longer segmented")
+
+        return (
+            self._is_full(timestamp_ns)
+            and self._mirror.session is not None
+            and not self._mirror.failed
+            and not self._mirror.pending
+            and not self._mirror.client_pending
+        )
+
+    def start_segment(self, timestamp_ns: int) -> list[Record]:
+        """
+        Starts a new segment after `observe` returned True.
+
+        Returns:
+            The chunks the new segment starts with, they bring a new connection into the current
+            state of the session.
+        """
+        session = self._mirror.session
+        assert session is not None
+        handshake = session.handshake
+        records = handshake_records(handshake, handshake.client_protocol_version, timestamp_ns)
+        timestamp_ns += len(records)
+
+        setup_messages = [SetPixelFormat(session.framebuffer.pixel_format).to_bytes()]
+        if self._set_encodings is not None:
+            setup_messages.append(self._set_encodings)
+        for message in setup_messages:
+            records.append((True, message, timestamp_ns))
+            timestamp_ns += 1
+        records.append((False, build_keyframe(session.framebuffer), timestamp_ns))
+        # The pointer, which the screen is composited with and actions start from, is where the
+        # last PointerEvent left it
+        if self._pointer_event is not None:
+            records.append((True, self._pointer_event, timestamp_ns + 1))
+
+        self.start_ns = None
+        self.num_bytes = 0
+        for _, data, timestamp in records:
+            self._account(data, timestamp)
+        self._start_bytes = self.num_bytes
+        return records
+
+    def _account(self, data: bytes, timestamp_ns: int) -> None:
+        if self.start_ns is None:
+            self.start_ns = timestamp_ns
+        self.end_ns = timestamp_ns
+        self.num_bytes += len(data)
+
+    def _is_full(self, timestamp_ns: int) -> bool:
+        max_bytes = self.policy.max_bytes
+        if max_bytes is not None and self.num_bytes - self._start_bytes >= max_bytes:
+            return True
+        max_seconds = self.policy.max_seconds
+        return (
+            max_seconds is not None
+            and self.start_ns is not None
+            and timestamp_ns - self.start_ns >= max_seconds * 1e9
+        )
+
+
+_U32: Final[Struct] = Struct("!I")
+_SERVER_INIT_HEADER: Final[Struct] = Struct("!HH")
+_log = logging.getLogger(__name__)
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
 import threading
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
 import uvicorn
 from fastapi import APIRouter, FastAPI, WebSocket
 
-from ..ws import VncRecorder
+from ..ws import TcpConnection, VncFanout, VncRecorder
+from .chunked import StreamCompression
+from .decimation import DecimationPolicy
+from .segments import SegmentPolicy
 
 
 @dataclass(frozen=True)
@@ -16,18 +19,35 @@ class VncService:
     vnc_host: str
     vnc_port: int
     output_dir: Path
+    # Serves the recorded session to read-only observers at `/observe`, see `VncFanout`
+    fanout: VncFanout | None = field(default=None, compare=False)
+    # Writes the message streams compressed, see `recording.chunked`
+    compression: StreamCompression | None = None
+    # Drops framebuffer updates from the recording, see `recording.decimation`
+    decimation: DecimationPolicy | None = None
+    # Splits the recording into segments, see `recording.segments`
+    segments: SegmentPolicy | None = None
 
     def router(self) -> APIRouter:
         router = APIRouter()
         router.websocket("/")(self.vnc_record)
+        if self.fanout is not None:
+            router.websocket("/observe")(self.fanout.observe)
         return router
 
     async def vnc_record(self, frontend: WebSocket) -> None:
         recording_path = self.output_dir / "recording"
         recording_path.mkdir(exist_ok=True, parents=True)
-        await VncRecorder.from_connection(self.vnc_host, self.vnc_port).vnc_ws(
+        recorder = VncRecorder(
+            TcpConnection(self.vnc_host, self.vnc_port),
+            compression=self.compression,
+            decimation=self.decimation,
+            segments=self.segments,
+        )
+        await recorder.vnc_ws(
             frontend=frontend,
             recording_path=recording_path,
+            fanout=self.fanout,
         )
 
         return
@@ -54,9 +74,21 @@ class VncServer:
         vnc_host: str,
         vnc_port: int,
         output_dir: Path,
+        observers: bool = False,
+        compression: StreamCompression | None = None,
+        decimation: DecimationPolicy | None = None,
+        segments: SegmentPolicy | None = None,
     ) -> VncServer:
         app = FastAPI(debug=True)
-        service = VncService(vnc_host=vnc_host, vnc_port=vnc_port, output_dir=output_dir)
+        service = VncService(
+            vnc_host=vnc_host,
+            vnc_port=vnc_port,
+            output_dir=output_dir,
+            fanout=VncFanout() if observers else None,
+            compression=compression,
+            decimation=decimation,
+            segments=segments,
+        )
         app.include_router(router=service.router())
         config = uvicorn.Config(
             app,
@@ -25,7 +25,7 @@ References
 
 from __future__ import annotations
 
-from collections.abc import Iterable, Mapping
+from collections.abc import Generator, Iterable, Mapping
 from dataclasses import dataclass, field
 from enum import Enum, Flag
 from struct import Struct
@@ -44,6 +44,9 @@ __all__ = [
     "PointerEvent",
     "MouseButtons",
     "ClientCutText",
+    "EnableContinuousUpdates",
+    "Fence",
+    "FenceFlags",
     "parse_client_message",
     # Server Messages
     "ServerMessage",
@@ -52,7 +55,10 @@ __all__ = [
     "SetColorMapEntries",
     "Bell",
     "ServerCutText",
+    "EndOfContinuousUpdates",
     "parse_server_message",
+    "frame_server_message",
+    "MessageFramer",
     # Server Messages: FramebufferUpdate rect types
     "FramebufferUpdateRect",
     "Rectangle",
@@ -80,6 +86,11 @@ __all__ = [
     "Encoding",
 ]
 
+# The sans-IO counterpart of a `from_bytes` parser, which only finds where a message ends: it yields
+# the number of bytes it needs next, receives them through `send()` and stops after the last byte of
+# the message. This lets asynchronous code read exactly one message before parsing it.
+MessageFramer = Generator[int, bytes, None]
+
 #    ____ _ _            _     __  __
 #   / ___| (_) ___ _ __ | |_  |  \/  | ___  ___ ___  __ _  __ _  ___  ___
 #  | |   | | |/ _ \ '_ \| __| | |\/| |/ _ \/ __/ __|/ _` |/ _` |/ _ \/ __|
@@ -103,9 +114,14 @@ class ClientMessageKind(Enum):
                     | 4      | KeyEvent                 |
                     | 5      | PointerEvent             |
                     | 6      | ClientCutText            |
+                    | 150    | EnableContinuousUpdates  |
+                    | 248    | ClientFence              |
                     | 255    | QEMU Client Message      |
                     +--------+--------------------------+
 
+    EnableContinuousUpdates and ClientFence are extensions documented in
+    https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst
+
     Other message types exist but are not publicly documented.  Before
     sending a message other than those described in this document, a
     client must have determined that the server supports the relevant
@@ -119,6 +135,8 @@ class ClientMessageKind(Enum):
     KEY_EVENT = 4
     POINTER_EVENT = 5
     CLIENT_CUT_TEXT = 6
+    ENABLE_CONTINUOUS_UPDATES = 150
+    FENCE = 248
     QEMU = 255
 
 
@@ -503,6 +521,8 @@ class ClientCutText:
 
     text: bytes
 
+    _STRUCT_WITH_TAG: ClassVar[Struct] = Struct("!BxxxI")
+
     @classmethod
     def from_bytes(cls, message: IO[bytes]) -> Self:
         (length,) = _unpack_stream(Struct("!xxxl"), message)
@@ -510,6 +530,161 @@ class ClientCutText:
             length = -length
         return cls(_read_exactly(message, length))
 
+    @classmethod
+    def from_text(cls, text: str) -> Self:
+        """
+        Creates the message from a Python string. Line endings are normalised to a bare newline as
+        required by the RFC.
+
+        Raises:
+            ValueError: If the text contains characters outside the Latin-1 character set.
+        """
+        normalized = text.replace("\r\n", "\n").replace("\r", "\n")
+        try:
+            return cls(normalized.encode("latin-1"))
+        except UnicodeEncodeError as e:
+            raise ValueError(f"ClientCutText only supports Latin-1 text: {e}") from e
+
+    def to_bytes(self) -> bytes:
+        return (
+            self._STRUCT_WITH_TAG.pack(ClientMessageKind.CLIENT_CUT_TEXT.value, len(self.text))
+            + self.text
+        )
+
+
+@dataclass(frozen=True)
+class EnableContinuousUpdates:
+    """
+    https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst#enablecontinuousupdates
+
+    This message informs the server to switch between only sending
+    FramebufferUpdate messages as a result of a FramebufferUpdateRequest
+    message, or sending FramebufferUpdate messages continuously.
+
+    The server must ignore this message if the client has not requested
+    the ContinuousUpdates pseudo-encoding (-313), and the client must not
+    send it before the server has confirmed support by sending an
+    EndOfContinuousUpdates message.
+
+    If enable-flag is non-zero, then the server can start sending
+    FramebufferUpdate messages as needed for the area specified by
+    x-position, y-position, width, and height. If continuous updates are
+    already active, then they must remain active and the coordinates
+    must be replaced with the last message seen.
+
+    If enable-flag is zero, then the server must only send
+    FramebufferUpdate messages as a result of receiving
+    FramebufferUpdateRequest messages. The server must also immediately
+    send out a EndOfContinuousUpdates message.
+
+               +--------------+--------------+--------------+
+               | No. of bytes | Type [Value] | Description  |
+               +--------------+--------------+--------------+
+               | 1            | U8 [150]     | message-type |
+               | 1            | U8           | enable-flag  |
+               | 2            | U16          | x-position   |
+               | 2            | U16          | y-position   |
+               | 2            | U16          | width        |
+               | 2            | U16          | height       |
+               +--------------+--------------+--------------+
+    """
+
+    enable: bool  # u8
+    x: int  # u16
+    y: int  # u16
+    width: int  # u16
+    height: int  # u16
+
+    _STRUCT_NO_TAG: ClassVar[Struct] = Struct("!BHHHH")
+    _STRUCT_WITH_TAG: ClassVar[Struct] = Struct("!BBHHHH")
+
+    @classmethod
+    def from_bytes(cls, message: IO[bytes]) -> Self:
+        enable, x, y, width, height = _unpack_stream(cls._STRUCT_NO_TAG, message)
+        return cls(enable=enable != 0, x=x, y=y, width=width, height=height)
+
+    def to_bytes(self) -> bytes:
+        return self._STRUCT_WITH_TAG.pack(
+            ClientMessageKind.ENABLE_CONTINUOUS_UPDATES.value,
+            int(self.enable),
+            self.x,
+            self.y,
+            self.width,
+            self.height,
+        )
+
+
+class FenceFlags(Flag):
+    BLOCK_BEFORE = 1 << 0
+    BLOCK_AFTER = 1 << 1
+    SYNC_NEXT = 1 << 2
+    REQUEST = 1 << 31
+
+
+@dataclass(frozen=True)
+class Fence:
+    """
+    https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst#clientfence
+
+    A fence is a synchronisation point between the client and the server.
+    The same message layout is used in both directions (ClientFence and
+    ServerFence). A peer receiving a fence with the Request bit set must
+    respond with a fence carrying the same payload, the Request bit
+    cleared and only the flags it understood.
+
+    The client must not send fences before the server has confirmed
+    support by sending a ServerFence, and the server will only send one
+    after the client requested the Fence pseudo-encoding (-312).
+
+               +--------------+--------------+--------------+
+               | No. of bytes | Type [Value] | Description  |
+               +--------------+--------------+--------------+
+               | 1            | U8 [248]     | message-type |
+               | 3            |              | padding      |
+               | 4            | U32          | flags        |
+               | 1            | U8           | length       |
+               | length       | U8 array     | payload      |
+               +--------------+--------------+--------------+
+    """
+
+    flags: FenceFlags  # u32
+    payload: bytes  # at most 64 bytes
+
+    _STRUCT_NO_TAG: ClassVar[Struct] = Struct("!xxxIB")
+    _STRUCT_WITH_TAG: ClassVar[Struct] = Struct("!BxxxIB")
+
+    @classmethod
+    def from_bytes(cls, message: IO[bytes]) -> Self:
+        """
+        Parses the message from raw bytes. The leading message-type byte should not be included.
+        """
+        flags, length = _unpack_stream(cls._STRUCT_NO_TAG, message)
+        return cls(FenceFlags(flags & _FENCE_FLAGS_MASK), _read_exactly(message, length))
+
+    @classmethod
+    def frame(cls) -> MessageFramer:
+        """Frames the message like `from_bytes` parses it, see `MessageFramer`."""
+        _, length = cls._STRUCT_NO_TAG.unpack((yield cls._STRUCT_NO_TAG.size))
+        yield length
+
+    def to_bytes(self) -> bytes:
+        return (
+            self._STRUCT_WITH_TAG.pack(
+                ClientMessageKind.FENCE.value, self.flags.value, len(self.payload)
+            )
+            + self.payload
+        )
+
+    def response(self) -> Fence:
+        """
+        The fence to send back for a request. We handle messages strictly in order, so all of the
+        synchronisation flags are trivially honoured.
+        """
+        return Fence(self.flags & ~FenceFlags.REQUEST, self.payload)
+
+
+_FENCE_FLAGS_MASK = sum(flag.value for flag in FenceFlags)
+
 
 class QemuClientMessageKind(Enum):
     EXTENDED_KEY_EVENT = 0
@@ -643,6 +818,8 @@ ClientMessage = (
     | KeyEvent
     | PointerEvent
     | ClientCutText
+    | EnableContinuousUpdates
+    | Fence
     | QemuExtendedKeyEvent
 )
 
@@ -663,6 +840,10 @@ def parse_client_message(message: IO[bytes]) -> ClientMessage:
             return PointerEvent.from_bytes(message)
         case ClientMessageKind.CLIENT_CUT_TEXT:
             return ClientCutText.from_bytes(message)
+        case ClientMessageKind.ENABLE_CONTINUOUS_UPDATES:
+            return EnableContinuousUpdates.from_bytes(message)
+        case ClientMessageKind.FENCE:
+            return Fence.from_bytes(message)
         case ClientMessageKind.QEMU:
             return parse_qemu_client_message(message)
         case _:
@@ -708,6 +889,9 @@ class ServerMessageKind(Enum):
                       | 3      | ServerCutText      |
                       +--------+--------------------+
 
+    We additionally parse EndOfContinuousUpdates (150) and ServerFence
+    (248) from https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst
+
     Other private message types exist but are not publicly documented.
     Before sending a message other than those described in this document
     a server must have determined that the client supports the relevant
@@ -719,6 +903,8 @@ class ServerMessageKind(Enum):
     SET_COLOR_MAP_ENTRIES = 1
     BELL = 2
     SERVER_CUT_TEXT = 3
+    END_OF_CONTINUOUS_UPDATES = 150
+    FENCE = 248
 
 
 @dataclass(frozen=True)
@@ -868,6 +1054,40 @@ class TightRect:
 
         return cls(patch, content, reset_streams)
 
+    @classmethod
+    def frame(cls, patch: Rectangle) -> MessageFramer:
+        """Frames the rectangle like `from_bytes` parses it, see `MessageFramer`."""
+        compression_control = (yield 1)[0] >> cls.NUM_ZLIB_STREAMS
+
+        if compression_control == cls._FILL_COMPRESSION_PATTERN:
+            yield cls._TIGHT_PIXEL_STRUCT.size
+        elif compression_control == cls._JPEG_COMPRESSION_PATTERN:
+            yield (yield from _frame_varint())
+        elif (compression_control & cls._BASIC_COMPRESSION_FLAG) == 0:
+            pixel_filter = 0
+            if compression_control & 0b100:
+                pixel_filter = (yield 1)[0]
+
+            match pixel_filter:
+                case 0:  # COPY_FILTER
+                    yield (yield from _frame_varint())
+                case 1:  # PALETTE_FILTER
+                    num_colors = (yield 1)[0] + 1
+                    yield num_colors * cls._TIGHT_PIXEL_STRUCT.size
+                    bits_per_pixel = 1 if num_colors <= 2 else 8
+                    row_size = (patch.width * bits_per_pixel + 7) // 8
+                    uncompressed_size = row_size * patch.height
+                    if uncompressed_size < 12:
+                        yield uncompressed_size
+                    else:
+                        yield (yield from _frame_varint())
+                case 2:  # GRADIENT_FILTER
+                    raise NotImplementedError("Tight GRADIENT_FILTER not supported")
+                case _:
+                    raise ValueError(f"Illegal tight filter encountered: {pixel_filter}")
+        else:
+            raise ValueError("Only JPEG or FILL compression is supported for TightRect")
+
 
 def _decode_varint(stream: IO[bytes]) -> int:
     """
@@ -900,6 +1120,22 @@ def _decode_varint(stream: IO[bytes]) -> int:
     return value
 
 
+def _frame_varint() -> Generator[int, bytes, int]:
+    """Same as `_decode_varint`, as part of a `MessageFramer`. Returns the decoded value."""
+    byte: int = (yield 1)[0]
+    value: int = byte & 0x7F
+
+    if byte & 0x80:
+        byte = (yield 1)[0]
+        value |= (byte & 0x7F) << 7
+
+        if byte & 0x80:
+            byte = (yield 1)[0]
+            value |= byte << 14
+
+    return value
+
+
 @dataclass(frozen=True)
 class Rectangle:
     x: int  # u16
@@ -1041,12 +1277,15 @@ class PseudoExtendedDesktopSizeRect:
     num_screens: int
     screens: tuple[PseudoExtendedDesktopScreen, ...]
 
+    _HEADER_STRUCT: ClassVar[Struct] = Struct("!Bxxx")
+    _SCREEN_STRUCT: ClassVar[Struct] = Struct("!LHHHHL")
+
     @classmethod
     def from_bytes(cls, message: IO[bytes]) -> Self:
-        (num_screens,) = _unpack_stream(Struct("!Bxxx"), message)
+        (num_screens,) = _unpack_stream(cls._HEADER_STRUCT, message)
         screens: list[PseudoExtendedDesktopScreen] = []
         for _ in range(num_screens):
-            screen_id, x, y, width, height, flags = _unpack_stream(Struct("!LHHHHL"), message)
+            screen_id, x, y, width, height, flags = _unpack_stream(cls._SCREEN_STRUCT, message)
             screens.append(
                 PseudoExtendedDesktopScreen(
                     screen_id=screen_id,
@@ -1060,6 +1299,12 @@ class PseudoExtendedDesktopSizeRect:
 
         return cls(num_screens, tuple(screens))
 
+    @classmethod
+    def frame(cls) -> MessageFramer:
+        """Frames the rectangle like `from_bytes` parses it, see `MessageFramer`."""
+        (num_screens,) = cls._HEADER_STRUCT.unpack((yield cls._HEADER_STRUCT.size))
+        yield num_screens * cls._SCREEN_STRUCT.size
+
 
 @dataclass(frozen=True)
 class PseudoQemuExtendedKeyEventRect:
@@ -1176,6 +1421,7 @@ class FramebufferUpdate:
     rectangles: tuple[FramebufferUpdateRect, ...]
 
     _HEADER_STRUCT: ClassVar[Struct] = Struct("!xH")
+    _RECT_HEADER_STRUCT: ClassVar[Struct] = Struct("!HHHHi")
 
     @classmethod
     def from_bytes(cls, message: IO[bytes], bytes_per_pixel: int) -> Self:
@@ -1198,7 +1444,9 @@ class FramebufferUpdate:
         """
         Parses a rectangle update from raw bytes. Used as part of a `FramebufferUpdate` message.
         """
-        (x, y, width, height, encoding_int) = _unpack_stream(Struct("!HHHHi"), message)
+        (x, y, width, height, encoding_int) = _unpack_stream(
+            FramebufferUpdate._RECT_HEADER_STRUCT, message
+        )
         rect = Rectangle(x, y, width, height, Encoding(encoding_int))
 
         match rect.encoding:
@@ -1221,6 +1469,48 @@ class FramebufferUpdate:
             case _:
                 raise NotImplementedError(f"Unsupported rect update with encoding {rect.encoding}")
 
+    @classmethod
+    def frame(cls, bytes_per_pixel: int) -> MessageFramer:
+        """
+        Frames the message like `from_bytes` parses it, see `MessageFramer`. The leading
+        message-type byte should not be included.
+        """
+        (num_rectangles,) = cls._HEADER_STRUCT.unpack((yield cls._HEADER_STRUCT.size))
+        for _ in range(num_rectangles):
+            is_last_rect = yield from FramebufferUpdate.frame_rect(bytes_per_pixel)
+            if is_last_rect:
+                break
+
+    @staticmethod
+    def frame_rect(bytes_per_pixel: int) -> Generator[int, bytes, bool]:
+        """
+        Frames a rectangle like `parse_rect` parses it. Returns whether it was a `PseudoLastRect`.
+        """
+        header = yield FramebufferUpdate._RECT_HEADER_STRUCT.size
+        (x, y, width, height, encoding_int) = FramebufferUpdate._RECT_HEADER_STRUCT.unpack(header)
+        rect = Rectangle(x, y, width, height, Encoding(encoding_int))
+
+        match rect.encoding:
+            case Encoding.RAW:
+                yield width * height * bytes_per_pixel
+            case Encoding.COPY_RECTANGLE:
+                yield CopyRect._STRUCT.size
+            case Encoding.TIGHT:
+                yield from TightRect.frame(rect)
+            case Encoding.PSEUDO_LAST_RECT:
+                return True
+            case Encoding.PSEUDO_CURSOR:
+                yield width * height * bytes_per_pixel + ((width + 7) // 8) * height
+            case Encoding.PSEUDO_EXTENDED_DESKTOP_SIZE:
+                yield from PseudoExtendedDesktopSizeRect.frame()
+            case Encoding.PSEUDO_QEMU_EXTENDED_KEY_EVENT:
+                pass
+            case Encoding.PSEUDO_QEMU_LED_STATE:
+                yield PseudoQemuLedStateRect._STRUCT.size
+            case _:
+                raise NotImplementedError(f"Unsupported rect update with encoding {rect.encoding}")
+        return False
+
 
 @dataclass(frozen=True)
 class SetColorMapEntries:
@@ -1286,6 +1576,15 @@ class SetColorMapEntries:
             colors=tuple(colors),
         )
 
+    @classmethod
+    def frame(cls) -> MessageFramer:
+        """
+        Frames the message like `from_bytes` parses it, see `MessageFramer`. The leading
+        message-type byte should not be included.
+        """
+        _, number_of_colors = cls._STRUCT.unpack((yield cls._STRUCT.size))
+        yield number_of_colors * cls._COLOR_STRUCT.size
+
 
 @dataclass(frozen=True)
 class Bell:
@@ -1325,17 +1624,50 @@ class ServerCutText:
 
     text: bytes
 
+    _STRUCT: ClassVar[Struct] = Struct("!xxxl")
+
     @classmethod
     def from_bytes(cls, message: IO[bytes]) -> Self:
         """
         Parses the message from raw bytes. The leading message-type byte should not be included.
         """
-        (length,) = _unpack_stream(Struct("!xxxl"), message)
+        (length,) = _unpack_stream(cls._STRUCT, message)
 
         if length < 0:
             length = -length
         return cls(_read_exactly(message, length))
 
+    @classmethod
+    def frame(cls) -> MessageFramer:
+        """
+        Frames the message like `from_bytes` parses it, see `MessageFramer`. The leading
+        message-type byte should not be included.
+        """
+        (length,) = cls._STRUCT.unpack((yield cls._STRUCT.size))
+        yield abs(length)
+
+
+@dataclass(frozen=True)
+class EndOfContinuousUpdates:
+    """
+    https://github.com/rfbproto/rfbproto/blob/master/rfbproto.rst#endofcontinuousupdates
+
+    This message is sent whenever the server sees a EnableContinuousUpdates
+    message with enable set to zero. It indicates that the
+    server has stopped sending continuous updates and is now only
+    reacting to FramebufferUpdateRequest messages.
+
+    The server must also send this message in response to the client
+    requesting the ContinuousUpdates pseudo-encoding, which is how the
+    client learns that the extension is supported.
+
+              +--------------+--------------+--------------+
+              | No. of bytes | Type [Value] | Description  |
+              +--------------+--------------+--------------+
+              | 1            | U8 [150]     | message-type |
+              +--------------+--------------+--------------+
+    """
+
 
 @dataclass(frozen=True)
 class UnknownServerMessage:
@@ -1349,7 +1681,15 @@ class UnknownServerMessage:
     kind: int
 
 
-ServerMessage = FramebufferUpdate | SetColorMapEntries | Bell | ServerCutText | UnknownServerMessage
+ServerMessage = (
+    FramebufferUpdate
+    | SetColorMapEntries
+    | Bell
+    | ServerCutText
+    | EndOfContinuousUpdates
+    | Fence
+    | UnknownServerMessage
+)
 
 
 def parse_server_message(message: IO[bytes], bytes_per_pixel: int | None) -> ServerMessage:
@@ -1370,11 +1710,53 @@ def parse_server_message(message: IO[bytes], bytes_per_pixel: int | None) -> Ser
             return Bell()
         case ServerMessageKind.SERVER_CUT_TEXT:
             return ServerCutText.from_bytes(message)
+        case ServerMessageKind.END_OF_CONTINUOUS_UPDATES:
+            return EndOfContinuousUpdates()
+        case ServerMessageKind.FENCE:
+            return Fence.from_bytes(message)
         case _:
             # Should be unreachable due to try/except above, but keep safe fallback
             return UnknownServerMessage(kind=kind_byte)
 
 
+def frame_server_message(bytes_per_pixel: int | None) -> MessageFramer:
+    """
+    Frames a server message exactly like `parse_server_message` parses it, see `MessageFramer`.
+
+    Example, reading one message from an `asyncio.StreamReader`:
+
+    ```python
+    framer = frame_server_message(bytes_per_pixel)
+    chunks = []
+    try:
+        num_bytes = next(framer)
+        while True:
+            chunks.append(await reader.readexactly(num_bytes))
+            num_bytes = framer.send(chunks[-1])
+    except StopIteration:
+        message = parse_server_message(BytesIO(b"".join(chunks)), bytes_per_pixel)
+    ```
+    """
+    kind_byte = (yield 1)[0]
+    try:
+        kind = ServerMessageKind(kind_byte)
+    except ValueError:
+        return
+
+    match kind:
+        case ServerMessageKind.FRAMEBUFFER_UPDATE:
+            assert bytes_per_pixel is not None
+            yield from FramebufferUpdate.frame(bytes_per_pixel)
+        case ServerMessageKind.SET_COLOR_MAP_ENTRIES:
+            yield from SetColorMapEntries.frame()
+        case ServerMessageKind.SERVER_CUT_TEXT:
+            yield from ServerCutText.frame()
+        case ServerMessageKind.FENCE:
+            yield from Fence.frame()
+        case _:
+            pass
+
+
 #   _   _                 _     _           _          __  __
 #  | | | | __ _ _ __   __| |___| |__   __ _| | _____  |  \/  | ___  ___ ___  __ _  __ _  ___  ___
 #  | |_| |/ _` | '_ \ / _` / __| '_ \ / _` | |/ / _ \ | |\/| |/ _ \/ __/ __|/ _` |/ _` |/ _ \/ __|
@@ -1426,6 +1808,11 @@ class ProtocolVersion:
     def from_bytes(cls, stream: IO[bytes]) -> Self:
         return cls(_read_exactly(stream, cls.NUM_BYTES))
 
+    @classmethod
+    def frame(cls) -> MessageFramer:
+        """Frames the message like `from_bytes` parses it, see `MessageFramer`."""
+        yield cls.NUM_BYTES
+
     def to_bytes(self) -> bytes:
         return self.version
 
@@ -1454,6 +1841,11 @@ class ServerSecurity:
         num_security_types = _read_exactly(stream, 1)[0]
         return cls(supported=tuple(map(SecurityType, _read_exactly(stream, num_security_types))))
 
+    @classmethod
+    def frame(cls) -> MessageFramer:
+        """Frames the message like `from_bytes` parses it, see `MessageFramer`."""
+        yield (yield 1)[0]
+
 
 @dataclass(frozen=True)
 class ServerSecurityResult:
@@ -1501,6 +1893,14 @@ class ServerSecurityResult:
             reason = _read_exactly(stream, reason_len).decode()
         return cls(success, reason)
 
+    @classmethod
+    def frame(cls) -> MessageFramer:
+        """Frames the message like `from_bytes` parses it, see `MessageFramer`."""
+        (status,) = cls._STATUS_STRUCT.unpack((yield cls._STATUS_STRUCT.size))
+        if status != 0:
+            (reason_len,) = cls._REASON_LEN_STRUCT.unpack((yield cls._REASON_LEN_STRUCT.size))
+            yield reason_len
+
 
 @dataclass(frozen=True)
 class ClientInit:
@@ -1580,6 +1980,22 @@ class ServerInit:
 
         return cls(width, height, pixel_format, name)
 
+    @classmethod
+    def frame(cls) -> MessageFramer:
+        """Frames the message like `from_bytes` parses it, see `MessageFramer`."""
+        yield cls._STRUCT_SCREEN_SIZE.size + PixelFormat.STRUCT.size
+        (name_len,) = cls._STRUCT_NAME_LENGTH.unpack((yield cls._STRUCT_NAME_LENGTH.size))
+        yield name_len
+
+    def to_bytes(self) -> bytes:
+        name = self.name.encode("iso-8859-1")
+        return (
+            self._STRUCT_SCREEN_SIZE.pack(self.screen_width, self.screen_height)
+            + self.pixel_format.to_bytes()
+            + self._STRUCT_NAME_LENGTH.pack(len(name))
+            + name
+        )
+
 
 @dataclass(frozen=True)
 class PixelFormat:
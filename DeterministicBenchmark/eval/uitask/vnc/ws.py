@@ -3,21 +3,54 @@ from __future__ import annotations
 import asyncio
 import logging
 import socket
+import struct
+import time
 from asyncio import StreamReader, StreamWriter
-from dataclasses import dataclass
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from dataclasses import dataclass, field
+from functools import partial
+from io import BytesIO
 from pathlib import Path
-from typing import Final
+from typing import Any, Final
 
 from fastapi import WebSocket, WebSocketDisconnect
 from websockets.exceptions import ConnectionClosed
 
-from .recording.replay import RfbRecordingWriter
+from .protocol import RfbSession, SessionMirror
+from .recording.chunked import StreamCompression
+from .recording.decimation import DecimationPolicy
+from .recording.keyframe import build_keyframe
+from .recording.replay import QueuedRfbRecordingWriter, RecordingWriterStats, RfbRecordingWriter
+from .recording.segments import SegmentPolicy
+from .rfb_messages import (
+    ClientMessage,
+    Encoding,
+    FramebufferUpdateRequest,
+    ProtocolVersion,
+    SecurityType,
+    ServerInit,
+    SetEncodings,
+    SetPixelFormat,
+    parse_client_message,
+)
+
+# Number of server messages buffered for an observer before it is resynchronized with a keyframe
+OBSERVER_QUEUE_SIZE: Final[int] = 256
+
+# Most bytes read from the VNC server at once, and forwarded in one WebSocket message
+READ_SIZE: Final[int] = 256 << 10
+
+# How long to wait for the rest of an incomplete server message before forwarding what was read
+COALESCE_WINDOW: Final[float] = 0.002
 
 
 @dataclass(frozen=True)
 class RecordingInfo:
     num_client_messages: int
     num_server_messages: int
+    writer_stats: RecordingWriterStats | None = None
 
 
 @dataclass(frozen=True)
@@ -34,6 +67,14 @@ class Socket:
 @dataclass(frozen=True)
 class VncRecorder:
     connection: Socket | TcpConnection
+    read_size: int = READ_SIZE
+    coalesce_window: float = COALESCE_WINDOW
+    # Writes the message streams compressed, see `recording.chunked`
+    compression: StreamCompression | None = None
+    # Drops framebuffer updates from the recording, see `recording.decimation`
+    decimation: DecimationPolicy | None = None
+    # Splits the recording into segments, see `recording.segments`
+    segments: SegmentPolicy | None = None
 
     @classmethod
     def from_connection(cls, host: str, port: int) -> VncRecorder:
@@ -64,26 +105,426 @@ class VncRecorder:
         self,
         frontend: WebSocket,
         recording_path: Path,
+        fanout: VncFanout | None = None,
     ) -> RecordingInfo:
+        """
+        Bridges `frontend` to the VNC server and records the session. With a `fanout`, the session
+        is also served to its read-only observers.
+        """
         await frontend.accept()
         reader, writer = await self.connect()
 
-        recording_writer: RfbRecordingWriter = RfbRecordingWriter(recording_path)
+        # Disk writes happen on the writer's flush thread, the event loop only queues the bytes
+        recording_writer = QueuedRfbRecordingWriter(
+            recording_path,
+            index=True,
+            compression=self.compression,
+            decimation=self.decimation,
+            segments=self.segments,
+        )
+        # Delimits the server messages, so that each is recorded with a timestamp of its own. The
+        # observers' framebuffer is kept up to date by the fan-out, off the event loop.
+        mirror = SessionMirror(decode=False)
+        if fanout is not None:
+            fanout.start_session(mirror)
 
         try:
             num_client_messages, num_server_messages = await asyncio.gather(
-                forward_client_to_tcp_server(frontend, writer, recording_writer),
-                forward_tcp_server_to_client(reader, frontend, recording_writer),
+                forward_client_to_tcp_server(frontend, writer, recording_writer, mirror, fanout),
+                forward_tcp_server_to_client(
+                    reader,
+                    frontend,
+                    recording_writer,
+                    mirror,
+                    fanout,
+                    read_size=self.read_size,
+                    coalesce_window=self.coalesce_window,
+                ),
             )
-            return RecordingInfo(num_client_messages, num_server_messages)
         finally:
-            recording_writer.close()
+            if fanout is not None:
+                fanout.end_session()
+            # Waits for the remaining bytes and the fsync without blocking the event loop
+            await asyncio.to_thread(recording_writer.close)
+        return RecordingInfo(num_client_messages, num_server_messages, recording_writer.stats)
+
+
+@dataclass
+class VncFanout:
+    """
+    Multiplexes the session of the client controlling the proxy to any number of read-only
+    observers, so that attaching a monitor or a second recorder does not open another connection to
+    the VNC server.
+
+    The proxy only splits the controlling session into messages, the event loop forwarding it never
+    decodes an update. The fan-out follows the session again on a decoder thread of its own (see
+    `_SessionDecoder`), which keeps a `FramebufferState` up to date. An observer gets a handshake
+    advertising the controller's screen and pixel format, then a keyframe (see `recording.keyframe`)
+    reproducing the framebuffer and Tight zlib streams at a message boundary, then every server
+    message of the controlling session after it. Observers thus see the updates the controller
+    requests, in the encodings it negotiated: one which asks for another pixel format, or does not
+    support all of these encodings, is closed. Their other messages, including input, are dropped.
+
+    An observer which falls `queue_size` messages behind is resynchronized with a fresh keyframe
+    instead of slowing down the controlling session.
+    """
+
+    queue_size: int = OBSERVER_QUEUE_SIZE
+
+    _mirror: SessionMirror | None = field(default=None, init=False, repr=False)
+    _decoder: _SessionDecoder | None = field(default=None, init=False, repr=False)
+    _observers: list[_Observer] = field(default_factory=list, init=False, repr=False)
+
+    @property
+    def num_observers(self) -> int:
+        return len(self._observers)
+
+    def start_session(self, mirror: SessionMirror) -> None:
+        """
+        Starts serving a new controlling session, split into messages by `mirror`, which does not
+        need to `decode`. Observers of a previous one are closed. Must be called on the event loop
+        forwarding the session.
+        """
+        self.end_session()
+        self._mirror = mirror
+        self._decoder = _SessionDecoder(asyncio.get_running_loop())
+
+    def end_session(self) -> None:
+        """Stops following the controlling session and closes its observers."""
+        self._mirror = None
+        if self._decoder is not None:
+            self._decoder.close()
+            self._decoder = None
+        for observer in self._observers:
+            observer.close()
+        self._observers.clear()
+
+    def feed_client(self, data: bytes) -> None:
+        """Follows client bytes of the controlling session, fed before the server can answer."""
+        if self._decoder is not None:
+            self._decoder.feed_client(data)
+
+    def broadcast(self, messages: list[bytes]) -> None:
+        """
+        Forwards server messages of the controlling session, as completed by its mirror, to the
+        observers once the decoder applied them. A session the mirror or the decoder cannot follow
+        ends the fan-out, but never the session.
+        """
+        if self._mirror is None or self._decoder is None:
+            return
+        if self._mirror.failed:
+            _log.warning("Lost track of the VNC session, closing its observers")
+            self.end_session()
+            return
+        if messages:
+            self._decoder.feed_server(messages, partial(self._deliver, self._decoder))
+
+    async def observe(self, websocket: WebSocket) -> None:
+        """
+        Serves the controlling session to `websocket` as a read-only RFB server, until either side
+        disconnects.
+        """
+        await websocket.accept()
+        mirror, decoder = self._mirror, self._decoder
+        if mirror is None or mirror.session is None or decoder is None:
+            await websocket.close(code=_WEBSOCKET_TRY_AGAIN_LATER, reason="No VNC session")
+            return
+
+        # Subscribe right away, the keyframe covers the messages broadcast before
+        input_stream = _WebSocketReader(websocket)
+        loop = asyncio.get_running_loop()
+        observer = _Observer(asyncio.Queue(self.queue_size), loop.create_future())
+        self._observers.append(observer)
+        decoder.snapshot(partial(self._start_observer, decoder, observer))
+        tasks: list[asyncio.Task[Any]] = []
+        try:
+            snapshot = await observer.snapshot
+            if snapshot is None:
+                return
+            await _serve_handshake(websocket, input_stream, snapshot.server_init)
+            reason = await _check_observer_setup(input_stream, snapshot)
+            if reason is not None:
+                _log.info(f"Closing an observer which cannot decode the session: {reason}")
+                await websocket.close(code=_WEBSOCKET_POLICY_VIOLATION, reason=reason)
+                return
+            _log.debug(f"Observer attached, {self.num_observers} observer(s)")
+
+            tasks.append(asyncio.create_task(_send_to_observer(observer, websocket)))
+            tasks.append(asyncio.create_task(input_stream.drain()))
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        except (WebSocketDisconnect, ConnectionClosed) as e:
+            _log.debug(f"Observer disconnected: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            if observer in self._observers:
+                self._observers.remove(observer)
+            await _close_observer_websocket(websocket)
+
+    def _deliver(self, decoder: _SessionDecoder, messages: list[bytes], failed: bool) -> None:
+        """Queues server messages the decoder applied for the observers."""
+        if decoder is not self._decoder:
+            return
+        if failed:
+            _log.warning("Lost track of the VNC session, closing its observers")
+            self.end_session()
+            return
+        for observer in self._observers:
+            if not observer.synced:
+                continue
+            for message in messages:
+                try:
+                    observer.queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # The keyframe will reproduce the state after the messages decoded by then,
+                    # the ones delivered before it are dropped
+                    observer.desync()
+                    decoder.snapshot(partial(self._resync, decoder, observer))
+                    break
+
+    def _start_observer(
+        self, decoder: _SessionDecoder, observer: _Observer, snapshot: _Snapshot | None
+    ) -> None:
+        if decoder is not self._decoder or observer not in self._observers:
+            return
+        if snapshot is None:
+            self._observers.remove(observer)
+            observer.close()
+            return
+        observer.start(snapshot)
+
+    def _resync(
+        self, decoder: _SessionDecoder, observer: _Observer, snapshot: _Snapshot | None
+    ) -> None:
+        if decoder is self._decoder and observer in self._observers and snapshot is not None:
+            observer.resync(snapshot.keyframe)
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    """The controlling session at a message boundary, which an observer starts from"""
+
+    server_init: ServerInit
+    # Encodings the controller asked for, the observer must support them too
+    encodings: tuple[Encoding, ...]
+    keyframe: bytes
+
+
+class _SessionDecoder:
+    """
+    Follows the controlling session of a `VncFanout` with a decoding `SessionMirror`, on a thread
+    of its own so that decoding zlib and JPEG data does not delay the event loop forwarding the
+    session. The bytes are applied in the order they were fed, the results are handed back to the
+    event loop through callbacks.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._mirror = SessionMirror()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="VncFanoutDecoder")
+
+    def feed_client(self, data: bytes) -> None:
+        self._submit(self._mirror.feed_client, data)
+
+    def feed_server(
+        self, messages: list[bytes], callback: Callable[[list[bytes], bool], None]
+    ) -> None:
+        """Applies server messages, then calls back with them and whether the mirror failed."""
+        self._submit(self._feed_server, messages, callback)
+
+    def snapshot(self, callback: Callable[[_Snapshot | None], None]) -> None:
+        """
+        Calls back with the session after the bytes fed so far, None if the mirror cannot follow
+        it.
+        """
+        self._submit(self._snapshot, callback)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _feed_server(
+        self, messages: list[bytes], callback: Callable[[list[bytes], bool], None]
+    ) -> None:
+        for message in messages:
+            self._mirror.feed_server(message)
+        self._call_soon(callback, messages, self._mirror.failed)
+
+    def _snapshot(self, callback: Callable[[_Snapshot | None], None]) -> None:
+        session = self._mirror.session
+        if session is None or self._mirror.failed:
+            self._call_soon(callback, None)
+            return
+        framebuffer = session.framebuffer
+        server_init = ServerInit(
+            screen_width=framebuffer.width,
+            screen_height=framebuffer.height,
+            pixel_format=framebuffer.pixel_format,
+            name=session.handshake.server_init.name,
+        )
+        self._call_soon(
+            callback, _Snapshot(server_init, session.encodings, build_keyframe(framebuffer))
+        )
+
+    def _submit(self, function: Callable[..., object], *args: Any) -> None:
+        self._executor.submit(self._run, function, *args)
+
+    def _run(self, function: Callable[..., object], *args: Any) -> None:
+        try:
+            function(*args)
+        except Exception:
+            _log.exception("Decoding the VNC session for its observers failed")
+
+    def _call_soon(self, callback: Callable[..., None], *args: Any) -> None:
+        # The event loop is closed once the proxy shut down
+        with suppress(RuntimeError):
+            self._loop.call_soon_threadsafe(callback, *args)
+
+
+@dataclass(eq=False)
+class _Observer:
+    # Server messages to send, None closes the observer
+    queue: asyncio.Queue[bytes | None]
+    # The state the observer starts from, None if it cannot start
+    snapshot: asyncio.Future[_Snapshot | None]
+    # Whether the queue continues a keyframe, server messages are dropped until the next one if not
+    synced: bool = False
+    resyncs: int = 0
+
+    def start(self, snapshot: _Snapshot) -> None:
+        self.queue.put_nowait(snapshot.keyframe)
+        self.synced = True
+        self.snapshot.set_result(snapshot)
+
+    def desync(self) -> None:
+        """Drops the queued messages, see `resync`."""
+        _drain_queue(self.queue)
+        self.synced = False
+
+    def resync(self, keyframe: bytes) -> None:
+        """Replaces the queued messages by a keyframe."""
+        _drain_queue(self.queue)
+        self.queue.put_nowait(keyframe)
+        self.synced = True
+        self.resyncs += 1
+        _log.debug(f"Observer fell behind, resynchronized with a keyframe ({self.resyncs} times)")
+
+    def close(self) -> None:
+        _drain_queue(self.queue)
+        self.queue.put_nowait(None)
+        self.synced = False
+        if not self.snapshot.done():
+            self.snapshot.set_result(None)
+
+
+class _WebSocketReader:
+    """Reads exact numbers of bytes from the binary messages of a WebSocket."""
+
+    def __init__(self, websocket: WebSocket) -> None:
+        self._websocket = websocket
+        self._buffer = bytearray()
+
+    async def readexactly(self, n: int) -> bytes:
+        while len(self._buffer) < n:
+            self._buffer += await self._websocket.receive_bytes()
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    async def read_client_message(self) -> ClientMessage:
+        """Receives the next RFB client message."""
+        while True:
+            stream = BytesIO(self._buffer)
+            try:
+                message = parse_client_message(stream)
+            except EOFError:
+                self._buffer += await self._websocket.receive_bytes()
+                continue
+            del self._buffer[: stream.tell()]
+            return message
+
+    async def drain(self) -> None:
+        """Receives and drops messages until the WebSocket disconnects."""
+        try:
+            while True:
+                await self._websocket.receive_bytes()
+        except (WebSocketDisconnect, ConnectionClosed):
+            pass
+
+
+async def _serve_handshake(
+    websocket: WebSocket, input_stream: _WebSocketReader, server_init: ServerInit
+) -> None:
+    """Performs the server side of the RFB handshake (no security) for an observer."""
+    await websocket.send_bytes(_SERVER_PROTOCOL_VERSION.to_bytes())
+    await input_stream.readexactly(len(_SERVER_PROTOCOL_VERSION.to_bytes()))
+    await websocket.send_bytes(bytes((1, SecurityType.NONE.value)))
+    await input_stream.readexactly(1)
+    await websocket.send_bytes(struct.pack("!I", 0))
+    await input_stream.readexactly(1)  # ClientInit, the shared flag does not matter
+    await websocket.send_bytes(server_init.to_bytes())
+
+
+async def _check_observer_setup(input_stream: _WebSocketReader, snapshot: _Snapshot) -> str | None:
+    """
+    Reads the messages an observer sets itself up with, up to its first `FramebufferUpdateRequest`.
+
+    Returns:
+        Why the observer cannot decode the session, the reason to close it with, or None if it can.
+    """
+    pixel_format = snapshot.server_init.pixel_format
+    encodings: tuple[Encoding, ...] = ()
+    try:
+        while not isinstance(
+            message := await input_stream.read_client_message(), FramebufferUpdateRequest
+        ):
+            match message:
+                case SetPixelFormat():
+                    pixel_format = message.pixel_format
+                case SetEncodings():
+                    encodings = message.encodings
+                case _:
+                    continue
+    except (ValueError, RuntimeError) as e:
+        _log.debug(f"Cannot parse a message of an observer: {e!r}")
+        return "Unsupported RFB client message"
+
+    if pixel_format != snapshot.server_init.pixel_format:
+        return "The session only has the pixel format of its ServerInit"
+    # Raw pixel data is always supported
+    supported = {Encoding.RAW, *encodings, *_OPTIONAL_ENCODINGS}
+    missing = [encoding.name for encoding in snapshot.encodings if encoding not in supported]
+    if missing:
+        # A close reason has at most 123 bytes
+        return f"Unsupported encodings of the session: {', '.join(missing)}"[:123]
+    return None
+
+
+async def _send_to_observer(observer: _Observer, websocket: WebSocket) -> None:
+    while (message := await observer.queue.get()) is not None:
+        await websocket.send_bytes(message)
+
+
+async def _close_observer_websocket(websocket: WebSocket) -> None:
+    try:
+        await websocket.close()
+    except (RuntimeError, WebSocketDisconnect) as e:
+        # Raised when the WebSocket is closed already
+        _log.debug(f"Observer WebSocket closed: {e!r}")
+    except Exception as e:
+        _log.warning(f"Unexpected exception closing an observer WebSocket: {e!r}")
+
+
+def _drain_queue(queue: asyncio.Queue[bytes | None]) -> None:
+    while not queue.empty():
+        queue.get_nowait()
 
 
 async def forward_client_to_tcp_server(
     source: WebSocket,
     destination: StreamWriter,
     recording_writer: RfbRecordingWriter,
+    mirror: SessionMirror | None = None,
+    fanout: VncFanout | None = None,
 ) -> int:
     """
     Forwards messages from a WebSocket client to the TCP VNC server.
@@ -92,6 +533,8 @@ async def forward_client_to_tcp_server(
         source (WebSocket): Source WebSocket client to receive messages from.
         destination (StreamWriter): Destination TCP VNC server to send messages to.
         recording_path: Where to save the recording. If `None` then don't record.
+        mirror: Follows the session, if given.
+        fanout: Follows the session for its observers, if given.
 
     Returns:
         num_messages: The number of messages forwarded.
@@ -101,6 +544,11 @@ async def forward_client_to_tcp_server(
     try:
         while True:
             message = await source.receive_bytes()
+            # Before the server can answer, so that the mirror sees the handshake in order
+            if mirror is not None:
+                mirror.feed_client(message)
+            if fanout is not None:
+                fanout.feed_client(message)
             destination.write(message)
             await destination.drain()
             num_messages += 1
@@ -124,26 +572,60 @@ async def forward_tcp_server_to_client(
     source: StreamReader,
     destination: WebSocket,
     recording_writer: RfbRecordingWriter,
+    mirror: SessionMirror | None = None,
+    fanout: VncFanout | None = None,
+    read_size: int = READ_SIZE,
+    coalesce_window: float = COALESCE_WINDOW,
 ) -> int:
     """
     Forwards messages from a TCP VNC server to a WebSocket client.
 
+    Up to `read_size` bytes are forwarded per WebSocket message. While the `mirror` reports an
+    incomplete server message, bytes arriving within `coalesce_window` seconds are added to the
+    same WebSocket message, complete ones are forwarded right away. With a `mirror`, the recording
+    gets one timestamp per RFB message, taken when its first byte arrived, instead of one per read.
+
     Args:
         source (StreamReader): Source TCP VNC server to receive messages from.
         destination (WebSocket): Destination WebSocket client to send messages to.
         recording_path: Where to save the recording. If `None` then don't record.
+        mirror: Follows the session, if given.
+        fanout: Serves the session followed by `mirror` to its observers, if given.
 
     Returns:
-        num_messages: The number of messages forwarded.
+        num_messages: The number of WebSocket messages forwarded.
     """
     num_messages: int = 0
+    recorder = _ServerRecorder(recording_writer, mirror, fanout)
+    loop = asyncio.get_running_loop()
 
     try:
         while True:
-            message = await source.read(4096)
+            message = await source.read(read_size)
             if not message:
                 _log.debug("TCP connection closed by VNC server.")
                 break
+            recorder.add(message)
+
+            chunks = [message]
+            num_bytes = len(message)
+            deadline = loop.time() + coalesce_window
+            while mirror is not None and mirror.pending and num_bytes < read_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(source.read(read_size - num_bytes), timeout)
+                except TimeoutError:
+                    break
+                if not chunk:
+                    break
+                recorder.add(chunk)
+                chunks.append(chunk)
+                num_bytes += len(chunk)
+            if len(chunks) > 1:
+                message = b"".join(chunks)
+
             try:
                 await destination.send_bytes(message)
             except RuntimeError as e:
@@ -155,7 +637,6 @@ async def forward_tcp_server_to_client(
                 raise
 
             num_messages += 1
-            recording_writer.record_server_bytes(message)
 
     except (WebSocketDisconnect, ConnectionClosed) as e:
         _log.debug(f"Websocket disconnected in forward_tcp_server_to_client: {e}")
@@ -164,6 +645,7 @@ async def forward_tcp_server_to_client(
     except Exception as e:
         _log.warning(f"Unexpected exception in forward_tcp_server_to_client: {e}")
     finally:
+        recorder.finish()
         try:
             await destination.close()
         except RuntimeError as e:
@@ -180,6 +662,62 @@ async def forward_tcp_server_to_client(
     return num_messages
 
 
+class _ServerRecorder:
+    """
+    Records the server bytes forwarded by `forward_tcp_server_to_client`, split into RFB messages
+    by the mirror if there is one, and broadcasts the messages to the observers of `fanout`.
+    """
+
+    def __init__(
+        self,
+        recording_writer: RfbRecordingWriter,
+        mirror: SessionMirror | None,
+        fanout: VncFanout | None,
+    ) -> None:
+        self._recording_writer = recording_writer
+        self._mirror = mirror
+        self._fanout = fanout
+        # When the first byte of the incomplete server message arrived
+        self._pending_since: int | None = None
+
+    def add(self, data: bytes) -> None:
+        timestamp = time.time_ns()
+        if self._mirror is None:
+            self._recording_writer.record_server_bytes_at(data, timestamp)
+            return
+
+        if self._pending_since is None:
+            self._pending_since = timestamp
+        messages = self._mirror.feed_server(data)
+        for i, message in enumerate(messages):
+            # Only the first message can have started in an earlier read
+            self._recording_writer.record_server_bytes_at(
+                message, self._pending_since if i == 0 else timestamp
+            )
+        if messages:
+            self._pending_since = timestamp if self._mirror.pending else None
+        if self._fanout is not None:
+            self._fanout.broadcast(messages)
+
+    def finish(self) -> None:
+        """Records the bytes of a server message the connection ended in."""
+        if self._mirror is not None and self._mirror.pending:
+            assert self._pending_since is not None
+            data = self._mirror.take_pending()
+            self._recording_writer.record_server_bytes_at(data, self._pending_since)
+
+
+_SERVER_PROTOCOL_VERSION: Final[ProtocolVersion] = ProtocolVersion(b"RFB 003.008\n")
+# WebSocket close code 1013: the server cannot serve the request right now
+_WEBSOCKET_TRY_AGAIN_LATER: Final[int] = 1013
+# WebSocket close code 1008: the client does not meet the requirements of the server
+_WEBSOCKET_POLICY_VIOLATION: Final[int] = 1008
+# Pseudo-encodings which only tune the server's compression, observers can do without them
+_OPTIONAL_ENCODINGS: Final[frozenset[Encoding]] = frozenset(
+    encoding
+    for encoding in Encoding
+    if encoding.name.startswith(("JPEG_", "PSEUDO_COMPRESSION_LEVEL_", "PSEUDO_JPEG_"))
+)
 _WEBSOCKET_ALREADY_CLOSE_MSG: Final[str] = (
     "Unexpected ASGI message 'websocket.close', after sending 'websocket.close' or response already completed."
 )